@@ -0,0 +1,102 @@
+"""
+Throughput of concurrent top-ups and spends on a single (hot) account.
+
+Each thread alternates top-ups and spends of 1 on the same user. The "document" mode increments the balance
+of the user document (findAndModify returning the whole user, as User.modify does), the "ledger" mode goes through
+the balance ledger (app/balance.py) with the given numbers of counter shards.
+Requires the docker-compose services (mongodb as a replica set) and the environment from webapp.local.env:
+
+    python3 benchmarks/balance.py --threads 1 8 32 --shards 1 4 16 --ops 200
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from pymongo import ReturnDocument
+
+from common import save_results
+
+from app import create_worker_app, USERS_COLL, BALANCE_SHARDS_COLL, BALANCE_LEDGER_COLL
+from app import balance
+
+
+USER_ID = 'balance-benchmark'
+
+
+def document_operation(amount: int):
+    USERS_COLL.find_one_and_update(
+        {'_id': USER_ID}, {'$inc': {'balance.amount': amount}}, return_document=ReturnDocument.AFTER
+    )
+
+
+def ledger_operation(amount: int):
+    if amount > 0:
+        balance.topup(USER_ID, amount)
+    else:
+        balance.spend(USER_ID, -amount)
+
+
+def run(operation, threads: int, ops: int) -> dict:
+    def worker(_):
+        latencies = []
+        for i in range(ops):
+            start = time.perf_counter()
+            operation(1 if i % 2 == 0 else -1)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = sorted(latency for result in executor.map(worker, range(threads)) for latency in result)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'ops_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+def reset_account():
+    USERS_COLL.replace_one(
+        {'_id': USER_ID}, {'_id': USER_ID, 'balance': {'amount': 10 ** 9, 'last_topup': None}}, upsert=True
+    )
+    BALANCE_SHARDS_COLL.delete_many({'user': USER_ID})
+    BALANCE_LEDGER_COLL.delete_many({'user': USER_ID})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32], help='concurrency levels')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 4, 16], help='counter shards (ledger mode)')
+    parser.add_argument('--ops', type=int, default=200, help='operations per thread')
+    args = parser.parse_args()
+
+    app = create_worker_app()
+    app.app_context().push()
+
+    modes = [('document', None, document_operation)]
+    modes += [(f'ledger-{shards}', shards, ledger_operation) for shards in args.shards]
+
+    results = []
+    try:
+        for threads in args.threads:
+            for mode, shards, operation in modes:
+                reset_account()
+                with patch.object(balance.Config, 'BALANCE_SHARDS', shards or 1):
+                    result = run(operation, threads, args.ops)
+                results.append({'mode': mode, 'threads': threads, **result})
+                print(f'{mode:<12} threads={threads:<3} {result["ops_per_second"]:9.1f} ops/s  '
+                      f'p50 {result["p50_ms"]:7.2f} ms  p99 {result["p99_ms"]:7.2f} ms')
+    finally:
+        reset_account()
+        USERS_COLL.delete_one({'_id': USER_ID})
+
+    results_file = save_results('balance', results)
+    print(f'results saved to {results_file}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+# add flask-boilerplate to Python path for all benchmarks (same as tests/conftest.py)
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent / "flask-boilerplate"))
+
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save_results(benchmark: str, results: dict) -> Path:
+    """ Append the results of a benchmark run to benchmarks/results/<benchmark>.jsonl """
+    RESULTS_DIR.mkdir(exist_ok=True)
+    results_file = RESULTS_DIR / f'{benchmark}.jsonl'
+
+    record = {
+        'benchmark': benchmark,
+        'revision': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'results': results,
+    }
+    with open(results_file, 'a') as file:
+        file.write(json.dumps(record) + os.linesep)
+    return results_file
+
+
+def load_results(benchmark: str) -> list:
+    """ Load all the recorded runs of a benchmark, oldest first """
+    results_file = RESULTS_DIR / f'{benchmark}.jsonl'
+    if not results_file.exists():
+        return []
+    with open(results_file) as file:
+        return [json.loads(line) for line in file if line.strip()]
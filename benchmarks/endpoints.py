@@ -0,0 +1,194 @@
+"""
+Throughput and latency percentiles of the HTTP endpoints, served by gunicorn (benchmarks/endpoints_server.py).
+
+For each concurrency level and endpoint, --concurrency client threads send requests as fast as possible during
+--duration seconds (after --warmup seconds), each thread with its own logged in session. The client threads share
+one interpreter: at high concurrency, check that the client process is not the bottleneck (CPU bound).
+RabbitMQ and S3 are stubbed out in the server, MongoDB and Redis are the real local services: load a realistic
+dataset first (python3 -m tests.test_data.generate) to measure the listings at scale.
+Requires the docker-compose services (mongodb as a replica set, redis) and the environment from webapp.local.env:
+
+    python3 benchmarks/endpoints.py --concurrency 1 16 --duration 10
+    python3 benchmarks/endpoints.py --endpoints user reports --server-workers 8
+"""
+import argparse
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import requests
+
+from common import save_results
+
+from app import create_worker_app, USERS_COLL, REPORTS_COLL, OUTBOX_COLL
+from app.models import User, Report
+
+
+SERVER = Path(__file__).parent / 'endpoints_server.py'
+PASSWORD = 'benchmark-password'
+USERS = {
+    'admin': {'_id': 'endpoints-benchmark-admin', 'phone_number': '+19879990001', 'role': 'admin'},
+    'user': {'_id': 'endpoints-benchmark-user', 'phone_number': '+19879990002', 'role': 'user'},
+}
+
+
+class Endpoint(NamedTuple):
+    method: str
+    path: str
+    # user logged in for the requests (None: anonymous)
+    role: Optional[str]
+    # request arguments (json body...)
+    arguments: Callable[[], dict] = dict
+
+
+ENDPOINTS: Dict[str, Endpoint] = {
+    'login': Endpoint('POST', '/login', None, lambda: {
+        'json': {'phone_number': USERS['user']['phone_number'], 'password': PASSWORD}
+    }),
+    'user': Endpoint('GET', '/user', 'user'),
+    'admin_users': Endpoint('GET', '/admin/users', 'admin'),
+    'admin_users_page': Endpoint('GET', '/admin/users?page=1', 'admin'),
+    'reports': Endpoint('GET', '/reports', 'user'),
+    'report_get': Endpoint('GET', '/report/endpoints-benchmark-report', 'user'),
+    # distinct request data, identical requests would be served by the first report
+    'report_post': Endpoint('POST', '/report', 'user', lambda: {'json': {'data': {'request': uuid.uuid4().hex}}}),
+    'redis_event': Endpoint('POST', '/redis-pubsub-event', 'user'),
+    'rabbitmq_event': Endpoint('POST', '/rabbitmq-event', 'user'),
+}
+
+
+def create_users():
+    for role, user in USERS.items():
+        User(
+            **user, password=PASSWORD, status='active',
+            details={'first_name': 'Benchmark', 'last_name': role.capitalize()},
+        ).save(force_insert=True)
+    Report(
+        _id='endpoints-benchmark-report', user=USERS['user']['_id'], task_id='endpoints-benchmark-report',
+        status='completed', result_data={'processed_items': 100},
+    ).save(force_insert=True)
+
+
+def delete_users():
+    user_ids = [user['_id'] for user in USERS.values()]
+    USERS_COLL.delete_many({'_id': {'$in': user_ids}})
+    REPORTS_COLL.delete_many({'user': {'$in': user_ids}})
+    OUTBOX_COLL.delete_many({'payload.args.user_id': {'$in': user_ids}})
+
+
+def start_server(port: int, workers: int, threads: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, str(SERVER), '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         '--threads', str(threads)],
+        cwd=SERVER.parent,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'the server exited with code {server.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise TimeoutError('the server did not start within 60 seconds')
+
+
+def login(base_url: str, role: Optional[str]) -> requests.Session:
+    session = requests.Session()
+    if role is not None:
+        response = session.post(f'{base_url}/login', json={
+            'phone_number': USERS[role]['phone_number'], 'password': PASSWORD
+        })
+        response.raise_for_status()
+    return session
+
+
+def percentile(latencies: List[float], percent: float) -> float:
+    """ Nearest-rank percentile of sorted latencies, in milliseconds """
+    index = max(int(round(len(latencies) * percent / 100)) - 1, 0)
+    return round(latencies[index] * 1000, 2)
+
+
+def run(base_url: str, endpoint: Endpoint, concurrency: int, warmup: float, duration: float) -> dict:
+    sessions = [login(base_url, endpoint.role) for _ in range(concurrency)]
+    url = base_url + endpoint.path
+    measure_start = time.monotonic() + warmup
+    measure_end = measure_start + duration
+    latencies, errors = [], []
+
+    def client(session: requests.Session):
+        while (now := time.monotonic()) < measure_end:
+            start = time.perf_counter()
+            response = session.request(endpoint.method, url, **endpoint.arguments())
+            latency = time.perf_counter() - start
+            if now >= measure_start:
+                # list.append is atomic, no lock is needed
+                latencies.append(latency)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    threads = [threading.Thread(target=client, args=(session,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        'requests_per_second': round(len(latencies) / duration, 1),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'requests': len(latencies),
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16], help='client threads')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per endpoint')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before each measure')
+    parser.add_argument('--server-workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--server-threads', type=int, default=1, help='threads per gunicorn worker')
+    parser.add_argument('--port', type=int, default=5100)
+    args = parser.parse_args()
+
+    app = create_worker_app()
+    app.app_context().push()
+
+    delete_users()
+    create_users()
+    server = start_server(args.port, args.server_workers, args.server_threads)
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            for name in args.endpoints:
+                result = run(base_url, ENDPOINTS[name], concurrency, args.warmup, args.duration)
+                results.append({'endpoint': name, 'concurrency': concurrency, **result})
+                print(f'{name:<18} concurrency={concurrency:<3} {result["requests_per_second"]:8.1f} req/s  '
+                      f'p50 {result["p50_ms"]:7.2f} ms  p95 {result["p95_ms"]:7.2f} ms  '
+                      f'p99 {result["p99_ms"]:7.2f} ms  errors {result["errors"]}')
+    finally:
+        server.terminate()
+        server.wait()
+        delete_users()
+
+    results_file = save_results('endpoints', {
+        'server_workers': args.server_workers, 'server_threads': args.server_threads, 'endpoints': results,
+    })
+    print(f'results saved to {results_file}')
+
+
+if __name__ == '__main__':
+    main()
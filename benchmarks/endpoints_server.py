@@ -0,0 +1,83 @@
+"""
+Server process of benchmarks/endpoints.py: serves the webapp with gunicorn, as in production, with the external
+brokers (RabbitMQ) and S3 stubbed out and the time-restricted endpoints always open.
+MongoDB and Redis are the real local services.
+
+    python3 benchmarks/endpoints_server.py --bind 127.0.0.1:5100 --workers 4
+"""
+import argparse
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+from gunicorn.app.base import BaseApplication
+
+import common  # noqa: F401 (adds flask-boilerplate to the Python path)
+from startup_probe import StubConnection
+
+
+APP_DIR = Path(__file__).parent.parent / 'flask-boilerplate'
+
+
+class BusinessHoursDatetime(datetime):
+    """ The event endpoints only answer during business hours: the benchmark always runs on a Monday morning """
+
+    @classmethod
+    def utcnow(cls):
+        return datetime(2024, 6, 3, 10, 0)
+
+
+def stub_external_services():
+    import pika
+
+    # the s3 factory is replaced once registered by app.extensions
+    from app.extensions import services
+    from app.utils import time_restrictions
+
+    pika.BlockingConnection = StubConnection
+    services.register('s3', StubConnection)
+    time_restrictions.datetime = BusinessHoursDatetime
+
+
+class WebappServer(BaseApplication):
+
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from webapp import app
+
+        # the request logs would measure the terminal rather than the webapp
+        logging.disable(logging.INFO)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bind', default='127.0.0.1:5100')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=1, help='threads per worker (gthread worker if > 1)')
+    args = parser.parse_args()
+
+    os.chdir(APP_DIR)
+    stub_external_services()
+
+    WebappServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        # the app is loaded (and the stubs applied) once, before the workers are forked
+        'preload_app': True,
+        'accesslog': None,
+        'loglevel': 'warning',
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Wall-clock time of a chunked report versus the number of report workers.
+
+For each concurrency level a Celery worker consuming the report queue is started, a report whose input
+splits into --chunks chunks is submitted and the time until the report is completed is measured.
+Requires the docker-compose services (mongodb, redis) and the environment from webapp.local.env:
+
+    python3 benchmarks/report_workers.py --workers 1 2 4 8 --chunks 8
+"""
+import argparse
+import subprocess
+import time
+from pathlib import Path
+
+from common import save_results
+
+from app import create_app
+from app.models import Report
+from app.tasks.report import process_report
+from config import Config
+
+
+APP_DIR = Path(__file__).parent.parent / 'flask-boilerplate'
+
+
+def start_worker(concurrency: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [
+            'celery', '-A', 'celery_worker.celery', 'worker',
+            '-Q', Config.REPORT_CELERY_QUEUE,
+            '--concurrency', str(concurrency),
+            '--loglevel', 'WARNING',
+        ],
+        cwd=APP_DIR,
+    )
+
+
+def run_report(chunks: int, timeout: int) -> float:
+    # one item per chunk key, so the input splits exactly into the requested number of chunks
+    data = {f'item-{i}': i for i in range(chunks * Config.REPORT_CHUNK_SIZE)}
+
+    report = Report(user='benchmark', task_id='', status='pending')
+    report.save()
+
+    start = time.perf_counter()
+    task = process_report.apply_async(args=[{'user_id': 'benchmark', 'report_id': report._id, 'data': data}])
+    report.update(task_id=task.task_id)
+
+    while time.perf_counter() - start < timeout:
+        report.reload('status', 'error_message')
+        if report.status == 'completed':
+            elapsed = time.perf_counter() - start
+            report.delete()
+            return elapsed
+        if report.status == 'failed':
+            raise RuntimeError(f'report failed: {report.error_message}')
+        time.sleep(0.1)
+
+    raise TimeoutError(f'report did not complete within {timeout} seconds')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='worker concurrency levels')
+    parser.add_argument('--chunks', type=int, default=8, help='number of chunks of the benchmark report')
+    parser.add_argument('--timeout', type=int, default=600, help='timeout of a single report (seconds)')
+    args = parser.parse_args()
+
+    app = create_app()
+    app.app_context().push()
+
+    results = []
+    for concurrency in args.workers:
+        worker = start_worker(concurrency)
+        try:
+            time.sleep(5)  # give the worker time to connect to the broker
+            elapsed = run_report(args.chunks, args.timeout)
+        finally:
+            worker.terminate()
+            worker.wait()
+
+        results.append({'workers': concurrency, 'chunks': args.chunks, 'wall_time': round(elapsed, 3)})
+        print(f'workers={concurrency:<3} chunks={args.chunks:<3} wall time {elapsed:8.2f}s')
+
+    results_file = save_results('report_workers', results)
+    print(f'results saved to {results_file}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+CPU cost of the model layer and of the response serialization, per document, for the real models.
+
+For users and reports (generated by tests/test_data/generate.py), the benchmark compares:
+hydration of raw documents into MongoEngine documents (_from_son, as done by querysets), to_mongo, validation,
+the Marshmallow dumps of the endpoints (app/domains/user.py, app/domains/report.py) and building the same response
+dicts directly, from the documents or from the raw documents. The query cases compare fetching the same documents
+from MongoDB as hydrated documents, with as_pymongo() and with pymongo, in a scratch copy of the collection; they
+require the docker-compose mongodb service and the environment from webapp.local.env (--skip-queries runs the
+CPU-only cases):
+
+    python3 benchmarks/serialization.py --documents 1000 --repeat 7
+    python3 benchmarks/serialization.py --skip-queries
+"""
+import argparse
+import statistics
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from common import save_results
+
+# the documents are those of the synthetic dataset generator
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from mongoengine.context_managers import switch_collection
+
+from tests.test_data.generate import CHUNK_SIZE, Dataset, generate_chunk
+
+from app import create_worker_app, mongodb
+from app.models import User, Report
+from app.domains.user import user_details_schema, user_contacts_schema
+from app.domains.report import report_response_schema
+
+
+def user_response_from_document(user: User) -> dict:
+    return {
+        '_id': user._id,
+        'details': {
+            'first_name': user.details.first_name,
+            'last_name': user.details.last_name,
+            'date_of_birth': user.details.date_of_birth.isoformat() if user.details.date_of_birth else None,
+        },
+        'contacts': {
+            name: {'contact': contact.contact} if contact else None
+            for name, contact in [('email', user.contacts.email), ('telegram', user.contacts.telegram)]
+        },
+        'phone_number': user.phone_number,
+        'signup_date': user.signup_date,
+        'role': user.role,
+        'status': user.status,
+    }
+
+
+def user_response_from_son(user: dict) -> dict:
+    details, contacts = user['details'], user.get('contacts') or {}
+    return {
+        '_id': user['_id'],
+        'details': {
+            'first_name': details['first_name'],
+            'last_name': details['last_name'],
+            'date_of_birth': details['date_of_birth'].isoformat() if details.get('date_of_birth') else None,
+        },
+        'contacts': {
+            name: {'contact': contacts[name]['contact']} if contacts.get(name) else None
+            for name in ['email', 'telegram']
+        },
+        'phone_number': user['phone_number'],
+        'signup_date': user['signup_date'],
+        'role': user['role'],
+        'status': user['status'],
+    }
+
+
+def user_response_marshmallow(user: User) -> dict:
+    # as GET /user
+    return {
+        '_id': user._id,
+        'details': user_details_schema.dump(user.details),
+        'contacts': user_contacts_schema.dump(user.contacts),
+        'phone_number': user.phone_number,
+        'signup_date': user.signup_date,
+        'role': user.role,
+        'status': user.status,
+    }
+
+
+def isoformat(value: datetime):
+    return value.isoformat() if value else None
+
+
+def report_response_from_document(report: Report) -> dict:
+    return {
+        'id': report._id,
+        'task_id': report.task_id,
+        'user': report.user,
+        'status': report.status,
+        'created_at': isoformat(report.created_at),
+        'completed_at': isoformat(report.completed_at),
+        'result_data': report.result_data,
+        'error_message': report.error_message,
+    }
+
+
+def report_response_from_son(report: dict) -> dict:
+    return {
+        'id': report['_id'],
+        'task_id': report['task_id'],
+        'user': report['user'],
+        'status': report['status'],
+        'created_at': isoformat(report['created_at']),
+        'completed_at': isoformat(report.get('completed_at')),
+        'result_data': report.get('result_data'),
+        'error_message': report.get('error_message'),
+    }
+
+
+MODELS = {
+    'users': (User, user_response_marshmallow, user_response_from_document, user_response_from_son),
+    'reports': (Report, report_response_schema.dump, report_response_from_document, report_response_from_son),
+}
+
+
+def cpu_cases(model, sons: List[dict], marshmallow, from_document, from_son) -> Dict[str, Callable[[], object]]:
+    documents = [model._from_son(son) for son in sons]
+    return {
+        'hydrate (_from_son)': lambda: [model._from_son(son) for son in sons],
+        'to_mongo': lambda: [document.to_mongo() for document in documents],
+        'validate': lambda: [document.validate() for document in documents],
+        'marshmallow dump': lambda: [marshmallow(document) for document in documents],
+        'dict from document': lambda: [from_document(document) for document in documents],
+        'dict from raw document': lambda: [from_son(son) for son in sons],
+        'hydrate + marshmallow dump': lambda: [marshmallow(model._from_son(son)) for son in sons],
+    }
+
+
+def query_cases(model, collection_name: str, ids: List[str]) -> Dict[str, Callable[[], object]]:
+    def documents():
+        with switch_collection(model, collection_name) as scratch_model:
+            return list(scratch_model.objects(_id__in=ids))
+
+    def as_pymongo():
+        with switch_collection(model, collection_name) as scratch_model:
+            return list(scratch_model.objects(_id__in=ids).as_pymongo())
+
+    return {
+        'query: documents': documents,
+        'query: as_pymongo': as_pymongo,
+        'query: pymongo': lambda: list(mongodb[collection_name].find({'_id': {'$in': ids}})),
+    }
+
+
+def measure(case: Callable[[], object], count: int, repeat: int) -> float:
+    """ Median time per document over the repeats, in microseconds """
+    timings = timeit.Timer(case).repeat(repeat=repeat, number=1)
+    return round(statistics.median(timings) / count * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=1000, help='documents per case')
+    parser.add_argument('--repeat', type=int, default=7, help='runs per case (median is reported)')
+    parser.add_argument('--skip-queries', action='store_true', help='only run the cases not using MongoDB')
+    args = parser.parse_args()
+
+    app = create_worker_app()
+    app.app_context().push()
+
+    dataset = Dataset(seed=1, users=args.documents, reports=args.documents, another_model=0, days=730,
+                      end_date=datetime(2024, 6, 1))
+
+    results = {}
+    for name, (model, marshmallow, from_document, from_son) in MODELS.items():
+        # raw documents as stored by the model
+        sons = [
+            model._from_son(document).to_mongo().to_dict()
+            for chunk in range((args.documents + CHUNK_SIZE - 1) // CHUNK_SIZE)
+            for document in generate_chunk(dataset, name, chunk)
+        ]
+        cases = cpu_cases(model, sons, marshmallow, from_document, from_son)
+
+        # the query cases use a scratch collection, never the documents of the application
+        scratch_collection = f'{name}_serialization_benchmark'
+        if not args.skip_queries:
+            mongodb.drop_collection(scratch_collection)
+            mongodb[scratch_collection].insert_many(sons)
+            cases.update(query_cases(model, scratch_collection, [son['_id'] for son in sons]))
+
+        try:
+            results[name] = {case: measure(function, len(sons), args.repeat) for case, function in cases.items()}
+        finally:
+            if not args.skip_queries:
+                mongodb.drop_collection(scratch_collection)
+
+        print(f'{name} ({len(sons)} documents, microseconds per document)')
+        for case, microseconds in results[name].items():
+            print(f'    {case:<30} {microseconds:10.2f}')
+
+    results_file = save_results('serialization', results)
+    print(f'results saved to {results_file}')
+
+
+if __name__ == '__main__':
+    main()
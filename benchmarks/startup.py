@@ -0,0 +1,151 @@
+"""
+Cold-start benchmark of the process entry points (webapp, celery worker, websocket server).
+
+Each entry point is started --runs times in a fresh interpreter with the external services stubbed out.
+The benchmark reports the median wall time until the entry point is ready, its baseline RSS and the
+top-level packages dominating the import time (python -X importtime), then checks them against the budget
+in benchmarks/startup_budget.json. The exit code is 1 if any budget is exceeded:
+
+    python3 benchmarks/startup.py
+    python3 benchmarks/startup.py --entry-points websocket --runs 10 --budget websocket.wall_ms=800
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from common import save_results
+
+
+ROOT_DIR = Path(__file__).parent.parent
+ENTRY_POINTS = {
+    'webapp': ROOT_DIR / 'flask-boilerplate' / 'webapp.py',
+    'worker': ROOT_DIR / 'flask-boilerplate' / 'celery_worker.py',
+    'websocket': ROOT_DIR / 'flask-boilerplate' / 'websocket.py',
+}
+PROBE = Path(__file__).parent / 'startup_probe.py'
+BUDGET_FILE = Path(__file__).parent / 'startup_budget.json'
+
+
+def probe_environment() -> dict:
+    """ Environment of the probed processes: variables of webapp.local.env, unless already set """
+    env = dict(os.environ)
+    with open(ROOT_DIR / 'webapp.local.env') as env_file:
+        for line in env_file:
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                key, value = line.split('=', 1)
+                env.setdefault(key, value)
+    return env
+
+
+def parse_importtime(stderr: str) -> dict:
+    """ Self import time (ms) aggregated by top-level package """
+    packages = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, module = line[len('import time:'):].split('|')
+        packages[module.strip().split('.')[0]] += int(self_us) / 1000
+    return packages
+
+
+def run_probe(entry_point: Path, env: dict) -> dict:
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', str(PROBE), str(entry_point)],
+        env=env, capture_output=True, text=True, timeout=120
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    ready = [line for line in process.stdout.splitlines() if line.startswith('READY ')]
+    if process.returncode != 0 or not ready:
+        raise RuntimeError(f'{entry_point.name} failed to start:\n{process.stderr[-2000:]}')
+
+    probe_result = json.loads(ready[-1][len('READY '):])
+    return {
+        'wall_ms': wall_ms,
+        'startup_ms': probe_result['startup_ms'],
+        'rss_mb': probe_result['rss_bytes'] / 1024 / 1024,
+        'imports': parse_importtime(process.stderr),
+    }
+
+
+def benchmark_entry_point(entry_point: Path, runs: int, top: int, env: dict) -> dict:
+    probes = [run_probe(entry_point, env) for _ in range(runs)]
+
+    imports = defaultdict(list)
+    for probe in probes:
+        for package, import_ms in probe['imports'].items():
+            imports[package].append(import_ms)
+    top_imports = sorted(
+        ((package, statistics.median(times)) for package, times in imports.items()),
+        key=lambda item: item[1], reverse=True
+    )[:top]
+
+    return {
+        'wall_ms': round(statistics.median(probe['wall_ms'] for probe in probes), 1),
+        'startup_ms': round(statistics.median(probe['startup_ms'] for probe in probes), 1),
+        'rss_mb': round(statistics.median(probe['rss_mb'] for probe in probes), 1),
+        'import_ms': round(statistics.median(sum(probe['imports'].values()) for probe in probes), 1),
+        'top_imports': {package: round(import_ms, 1) for package, import_ms in top_imports},
+    }
+
+
+def load_budget(overrides: list) -> dict:
+    budget = json.loads(BUDGET_FILE.read_text()) if BUDGET_FILE.exists() else {}
+    for override in overrides:
+        key, value = override.split('=')
+        entry_point, metric = key.split('.')
+        budget.setdefault(entry_point, {})[metric] = float(value)
+    return budget
+
+
+def check_budget(name: str, result: dict, budget: dict) -> list:
+    violations = []
+    for metric, limit in budget.get(name, {}).items():
+        if metric not in result:
+            violations.append(f'{name}: unknown metric {metric} in the budget (one of {", ".join(sorted(result))})')
+        elif result[metric] > limit:
+            violations.append(f'{name}: {metric} {result[metric]} exceeds the budget of {limit}')
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entry-points', nargs='+', choices=list(ENTRY_POINTS), default=list(ENTRY_POINTS))
+    parser.add_argument('--runs', type=int, default=5, help='cold starts per entry point (median is reported)')
+    parser.add_argument('--top', type=int, default=10, help='number of top-level packages to report')
+    parser.add_argument('--budget', nargs='*', default=[], metavar='ENTRY_POINT.METRIC=VALUE',
+                        help='override a budget of startup_budget.json, e.g. webapp.wall_ms=2000')
+    args = parser.parse_args()
+
+    env = probe_environment()
+    budget = load_budget(args.budget)
+
+    results, violations = {}, []
+    for name in args.entry_points:
+        result = benchmark_entry_point(ENTRY_POINTS[name], args.runs, args.top, env)
+        results[name] = result
+        violations += check_budget(name, result, budget)
+
+        print(f'{name}: wall {result["wall_ms"]} ms, startup {result["startup_ms"]} ms, '
+              f'imports {result["import_ms"]} ms, RSS {result["rss_mb"]} MB')
+        for package, import_ms in result['top_imports'].items():
+            print(f'    {package:<30} {import_ms:8.1f} ms')
+
+    results_file = save_results('startup', results)
+    print(f'results saved to {results_file}')
+
+    for violation in violations:
+        print(f'BUDGET EXCEEDED - {violation}')
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == '__main__':
+    main()
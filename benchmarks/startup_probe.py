@@ -0,0 +1,106 @@
+"""
+Child process of benchmarks/startup.py: runs one entry point with the external services stubbed out,
+then prints a single READY line with the in-process startup time and the RSS of the process.
+
+    python3 -X importtime benchmarks/startup_probe.py flask-boilerplate/webapp.py
+"""
+import importlib.abc
+import json
+import os
+import runpy
+import sys
+import time
+
+started = time.perf_counter()
+
+
+class StubConnection:
+    """ Accepts any call (connections, channels, declarations...) and returns itself """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __getattr__(self, name):
+        return self
+
+    def __bool__(self):
+        return True
+
+
+def stub_pymongo_collection(module):
+    module.Collection.create_index = lambda self, *args, **kwargs: None
+    module.Collection.list_indexes = lambda self, *args, **kwargs: iter([])
+
+
+# stubs of the external service clients, applied to their modules when (and only if) the entry point imports them
+STUBS = {
+    'pika': lambda module: setattr(module, 'BlockingConnection', StubConnection),
+    'pymongo.collection': stub_pymongo_collection,
+    'redis': lambda module: setattr(module.Redis, 'execute_command', lambda self, *args, **kwargs: None),
+}
+
+
+class StubbingLoader(importlib.abc.Loader):
+    """ Loader of a stubbed module: the original loader, followed by the stub """
+
+    def __init__(self, loader, stub):
+        self.loader = loader
+        self.stub = stub
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        self.stub(module)
+
+    def __getattr__(self, name):
+        # resources and source of the module
+        return getattr(self.loader, name)
+
+
+class StubbingFinder(importlib.abc.MetaPathFinder):
+    """ Finds the stubbed modules with the other finders and wraps their loader """
+
+    def find_spec(self, name, path, target=None):
+        stub = STUBS.get(name)
+        if stub is None:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                spec.loader = StubbingLoader(spec.loader, stub)
+                return spec
+        return None
+
+
+def stub_external_services():
+    # startup must not depend on the availability or latency of the external services, the modules are not imported
+    # here: the import time and memory of the entry points only count the packages they import themselves
+    sys.meta_path.insert(0, StubbingFinder())
+
+
+def main():
+    entry_point = os.path.abspath(sys.argv[1])
+    sys.path.insert(0, os.path.dirname(entry_point))
+    os.chdir(os.path.dirname(entry_point))
+
+    stub_external_services()
+    # a run_name other than __main__ skips the server/worker startup of the entry point
+    runpy.run_path(entry_point, run_name='__startup_probe__')
+
+    from app.utils.process import current_rss
+
+    print('READY ' + json.dumps({
+        'startup_ms': (time.perf_counter() - started) * 1000,
+        'rss_bytes': current_rss(),
+    }), flush=True)
+
+
+if __name__ == '__main__':
+    main()
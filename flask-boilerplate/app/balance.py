@@ -0,0 +1,176 @@
+"""
+User balances: append-only ledger and sharded counters.
+
+The balance of a user is Balance.amount (the compacted balance) plus the amounts of its counter shards.
+Top-ups and spends update one of the Config.BALANCE_SHARDS counter documents of the user and append a ledger entry
+in the same transaction, so that concurrent operations on an account are spread over several documents instead of
+contending on the user document. Spends are guarded: a shard (or the compacted balance) is only decremented when it
+holds the whole amount, a balance never goes negative.
+
+compact_balance() moves the shard amounts into Balance.amount, it is run periodically by the compact_balances task
+and when a spend does not fit in any single shard.
+"""
+import random
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from mongoengine.errors import OperationError
+from pymongo import UpdateOne
+from pymongo.client_session import ClientSession
+
+from app.extensions import mongo_client, USERS_COLL, BALANCE_SHARDS_COLL, BALANCE_LEDGER_COLL
+from app.models.base_document import generate_unique_id
+from config import Config
+
+
+class InsufficientBalanceError(OperationError):
+    pass
+
+
+def shard_id(user_id: str, shard: int) -> str:
+    return f'{user_id}:{shard}'
+
+
+def run_transaction(callback):
+    """ Run callback(session) in a transaction, retried on transient errors (e.g. write conflicts) """
+    with mongo_client.start_session() as session:
+        return session.with_transaction(callback)
+
+
+def ledger_entry(user_id: str, amount: int, kind: str, shard: int = None) -> dict:
+    return {
+        '_id': generate_unique_id(),
+        'user': user_id,
+        'amount': amount,
+        'kind': kind,
+        'shard': shard,  # None: applied to the compacted balance
+        'created_at': datetime.utcnow(),
+        'compacted_at': None,
+    }
+
+
+def append_entry(session: ClientSession, user_id: str, amount: int, kind: str, shard: int = None):
+    BALANCE_LEDGER_COLL.insert_one(ledger_entry(user_id, amount, kind, shard), session=session)
+
+
+def shard_increment(user_id: str, shard: int, amount: int) -> dict:
+    return {'$inc': {'amount': amount}, '$setOnInsert': {'user': user_id, 'shard': shard}}
+
+
+def topup(user_id: str, amount: int):
+    if amount <= 0:
+        raise ValueError('Invalid amount for topup()')
+    shard = random.randrange(Config.BALANCE_SHARDS)
+
+    def callback(session):
+        BALANCE_SHARDS_COLL.update_one(
+            {'_id': shard_id(user_id, shard)}, shard_increment(user_id, shard, amount), upsert=True, session=session
+        )
+        append_entry(session, user_id, amount, 'topup', shard)
+
+    run_transaction(callback)
+
+
+def credit_many(credits: List[Tuple[str, int]]):
+    """ Credit several users (user_id, amount) in one transaction: one bulk write of the shards and of the entries """
+    if any(amount <= 0 for _, amount in credits):
+        raise ValueError('Invalid amount for credit_many()')
+
+    def callback(session):
+        operations, entries = [], []
+        for user_id, amount in credits:
+            shard = random.randrange(Config.BALANCE_SHARDS)
+            operations.append(UpdateOne(
+                {'_id': shard_id(user_id, shard)}, shard_increment(user_id, shard, amount), upsert=True
+            ))
+            entries.append(ledger_entry(user_id, amount, 'credit', shard))
+        BALANCE_SHARDS_COLL.bulk_write(operations, ordered=False, session=session)
+        BALANCE_LEDGER_COLL.insert_many(entries, ordered=False, session=session)
+
+    run_transaction(callback)
+
+
+def spend(user_id: str, amount: int):
+    """ Spend the amount from a single shard or from the compacted balance, raise InsufficientBalanceError """
+    if amount <= 0:
+        raise ValueError('Invalid amount for spend()')
+    # shards are tried from a random one, so that concurrent spends do not all contend on the first shard
+    first_shard = random.randrange(Config.BALANCE_SHARDS)
+
+    def callback(session):
+        for offset in range(Config.BALANCE_SHARDS):
+            shard = (first_shard + offset) % Config.BALANCE_SHARDS
+            result = BALANCE_SHARDS_COLL.update_one(
+                {'_id': shard_id(user_id, shard), 'amount': {'$gte': amount}},
+                {'$inc': {'amount': -amount}}, session=session
+            )
+            if result.modified_count:
+                append_entry(session, user_id, -amount, 'spend', shard)
+                return True
+
+        result = USERS_COLL.update_one(
+            {'_id': user_id, 'balance.amount': {'$gte': amount}},
+            {'$inc': {'balance.amount': -amount}}, session=session
+        )
+        if result.modified_count:
+            append_entry(session, user_id, -amount, 'spend')
+            return True
+        return False
+
+    if run_transaction(callback):
+        return
+    # the funds may be split over several shards: gather them into the compacted balance and try again
+    if compact_balance(user_id) and run_transaction(callback):
+        return
+    raise InsufficientBalanceError(f'Insufficient balance to spend {amount}')
+
+
+def compact_balance(user_id: str) -> int:
+    """ Move the shard amounts of the user into Balance.amount, return the number of shards compacted """
+    def callback(session):
+        # a concurrent top-up or spend on one of these shards is a write conflict: the transaction is retried
+        shards = list(BALANCE_SHARDS_COLL.find({'user': user_id, 'amount': {'$ne': 0}}, session=session))
+        if not shards:
+            return 0
+        for shard in shards:
+            BALANCE_SHARDS_COLL.update_one(
+                {'_id': shard['_id']}, {'$inc': {'amount': -shard['amount']}}, session=session
+            )
+
+        balance_update = {'$inc': {'balance.amount': sum(shard['amount'] for shard in shards)}}
+        last_topup = BALANCE_LEDGER_COLL.find_one(
+            {'user': user_id, 'kind': 'topup', 'compacted_at': None}, sort=[('created_at', -1)], session=session
+        )
+        if last_topup:
+            balance_update['$max'] = {'balance.last_topup': last_topup['created_at']}
+        USERS_COLL.update_one({'_id': user_id}, balance_update, session=session)
+
+        BALANCE_LEDGER_COLL.update_many(
+            {'user': user_id, 'compacted_at': None}, {'$set': {'compacted_at': datetime.utcnow()}}, session=session
+        )
+        return len(shards)
+
+    return run_transaction(callback)
+
+
+def pending_last_topup(user_id: str) -> Optional[datetime]:
+    """ Date of the last top-up of the user not compacted yet into Balance.last_topup """
+    entry = BALANCE_LEDGER_COLL.find_one(
+        {'user': user_id, 'compacted_at': None, 'kind': 'topup'}, {'created_at': True}, sort=[('created_at', -1)]
+    )
+    return entry['created_at'] if entry else None
+
+
+def users_to_compact() -> List[str]:
+    return BALANCE_SHARDS_COLL.distinct('user', {'amount': {'$ne': 0}})
+
+
+def shard_balances(user_ids: List[str]) -> Dict[str, int]:
+    """ Sum of the shard amounts of each user, to be added to their Balance.amount """
+    return {
+        result['_id']: result['amount']
+        for result in BALANCE_SHARDS_COLL.aggregate([
+            {'$match': {'user': {'$in': user_ids}}},
+            {'$group': {'_id': '$user', 'amount': {'$sum': '$amount'}}},
+        ])
+    }
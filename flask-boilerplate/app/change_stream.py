@@ -0,0 +1,121 @@
+"""
+Change stream watcher: publishes the changes of the watched collections (app/utils/changes.py) on Redis pub/sub,
+to invalidate the process-local caches and push live updates to the websocket clients.
+
+A single watcher process runs per deployment (change_watcher.py). Its resume token is persisted in MongoDB,
+so a restarted watcher publishes the changes that happened while it was down: events are delivered at least once.
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+import orjson
+from pymongo.errors import OperationFailure
+
+from app.extensions import mongodb, redis_client, CHANGE_STREAM_TOKENS_COLL
+from app.metrics import observe, channel_group, REDIS_PUBLISH_DURATION
+from app.tracing import span, inject
+from app.utils.changes import (
+    WATCHED_COLLECTIONS, COLLECTION_CHANGES_CHANNEL, HEARTBEAT_CHANNEL, change_event, change_channels, reset_event
+)
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+WATCHER_ID = 'change_watcher'
+# error codes of a resume token that cannot be used anymore (not in the oplog anymore, invalidated stream)
+CHANGE_STREAM_HISTORY_LOST = 286
+CHANGE_STREAM_FATAL_ERROR = 280
+
+
+def change_stream_pipeline() -> list:
+    owner_fields = [f'fullDocument.{field}' for field in WATCHED_COLLECTIONS.values() if field]
+    return [
+        {'$match': {
+            'ns.coll': {'$in': list(WATCHED_COLLECTIONS)},
+            'operationType': {'$in': ['insert', 'update', 'replace', 'delete']},
+        }},
+        # the watcher only needs the owner of the documents, not their content
+        {'$project': {
+            'ns': 1, 'operationType': 1, 'documentKey': 1, 'updateDescription.updatedFields': 1,
+            **{field: 1 for field in owner_fields},
+        }},
+    ]
+
+
+def load_resume_token() -> Optional[dict]:
+    checkpoint = CHANGE_STREAM_TOKENS_COLL.find_one({'_id': WATCHER_ID})
+    return checkpoint['resume_token'] if checkpoint else None
+
+
+def save_resume_token(resume_token: dict):
+    CHANGE_STREAM_TOKENS_COLL.replace_one(
+        {'_id': WATCHER_ID}, {'_id': WATCHER_ID, 'resume_token': resume_token, 'saved_at': time.time()},
+        upsert=True
+    )
+
+
+def publish(channel: str, event: dict):
+    # each change starts a trace, followed up to its delivery by the websocket server
+    with span(f'redis publish {channel_group(channel)}', kind='PRODUCER', channel=channel), \
+            observe(REDIS_PUBLISH_DURATION, channel=channel_group(channel)):
+        redis_client.publish(channel, orjson.dumps(inject(dict(event))))
+
+
+def reset_changes(reason: str):
+    """ Start again from the current changes: the subscribers drop everything they cached """
+    logger.error(f'change stream reset: {reason}')
+    CHANGE_STREAM_TOKENS_COLL.delete_one({'_id': WATCHER_ID})
+    for collection in WATCHED_COLLECTIONS:
+        publish(COLLECTION_CHANGES_CHANNEL.format(collection=collection), reset_event(reason))
+
+
+def watch_changes(stop: threading.Event = None):
+    """ Publish the changes until stop is set, resuming after the last persisted resume token """
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        resume_token = load_resume_token()
+        try:
+            with mongodb.watch(
+                change_stream_pipeline(), full_document='updateLookup', resume_after=resume_token,
+                max_await_time_ms=1000,
+            ) as stream:
+                logger.info('watching changes of ' + ', '.join(WATCHED_COLLECTIONS)
+                            + (' (resumed)' if resume_token else ''))
+                last_saved = last_heartbeat = 0
+                saved_token, unsaved_changes = resume_token, False
+                while stream.alive and not stop.is_set():
+                    change = stream.try_next()
+                    if change is not None:
+                        event = change_event(change)
+                        for channel in change_channels(event):
+                            publish(channel, event)
+                        unsaved_changes = True
+
+                    # the token is saved after the events are published: a restarted watcher may publish
+                    # the last events again, which is harmless for cache invalidation and live updates.
+                    # Without changes, the token still moves with the oplog: it is only saved at the heartbeat
+                    # interval, so that a restarted watcher resumes within the oplog window
+                    now = time.monotonic()
+                    save_interval = Config.CHANGE_STREAM_TOKEN_SAVE_INTERVAL if unsaved_changes \
+                        else Config.CHANGE_STREAM_HEARTBEAT_INTERVAL
+                    if stream.resume_token and stream.resume_token != saved_token \
+                            and now - last_saved >= save_interval:
+                        save_resume_token(stream.resume_token)
+                        saved_token, unsaved_changes, last_saved = stream.resume_token, False, now
+                    if now - last_heartbeat >= Config.CHANGE_STREAM_HEARTBEAT_INTERVAL:
+                        publish(HEARTBEAT_CHANNEL, {'timestamp': time.time()})
+                        last_heartbeat = now
+
+                if stream.resume_token and stream.resume_token != saved_token:
+                    save_resume_token(stream.resume_token)
+                if not stream.alive:
+                    # invalidated stream (e.g. dropped database), its resume token cannot be used
+                    reset_changes('change stream invalidated')
+
+        except OperationFailure as error:
+            if error.code not in (CHANGE_STREAM_HISTORY_LOST, CHANGE_STREAM_FATAL_ERROR):
+                raise
+            reset_changes(f'cannot resume the change stream: {error}')
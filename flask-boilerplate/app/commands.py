@@ -0,0 +1,86 @@
+""" Flask CLI commands for operational tasks, run as: flask --app webapp <group> <command> """
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.factory import setup_rabbitmq
+from app.indexes import sync_indexes, find_uncovered_queries
+from app.user_import import import_users
+from app.utils.task_usage import task_usage_summary
+
+
+rabbitmq_cli = AppGroup('rabbitmq', help='RabbitMQ topology management.')
+
+
+@rabbitmq_cli.command('declare')
+@click.option('--force', is_flag=True, help='Declare the topology even if its fingerprint is unchanged.')
+def rabbitmq_declare(force):
+    """ Declare the events exchange, queues and bindings """
+    if setup_rabbitmq(current_app, force=force):
+        click.echo('RabbitMQ topology declared')
+    else:
+        click.echo('RabbitMQ topology unchanged, nothing to declare (use --force to declare it anyway)')
+
+
+mongo_cli = AppGroup('mongo', help='MongoDB maintenance.')
+
+
+@mongo_cli.command('indexes')
+@click.option('--dry-run', is_flag=True, help='Only print the changes.')
+@click.option('--obsolete', type=click.Choice(['keep', 'hide', 'drop']), default='keep', show_default=True,
+              help='What to do with existing indexes that are not declared.')
+@click.option('--rebuild-unique', is_flag=True,
+              help='Rebuild the changed unique indexes (duplicates can be written meanwhile: freeze the writes).')
+def mongo_indexes(dry_run, obsolete, rebuild_unique):
+    """ Apply the index registry (app/indexes.py) to the database """
+    plans = sync_indexes(dry_run=dry_run, obsolete=obsolete, rebuild_unique=rebuild_unique, echo=click.echo)
+    if not any(changes for plan in plans.values() for changes in plan.values()):
+        click.echo('indexes up to date')
+
+
+@mongo_cli.command('uncovered-queries')
+def mongo_uncovered_queries():
+    """ Report the endpoint queries that need a collection scan or an in-memory sort """
+    uncovered = find_uncovered_queries()
+    for query in uncovered:
+        click.echo(f'{query["source"]}: {query["collection"]} filter={query["filter"]} sort={query["sort"]} '
+                   f'-> {", ".join(query["stages"])}')
+    if not uncovered:
+        click.echo('all the queries are covered by an index')
+
+
+users_cli = AppGroup('users', help='User management.')
+
+
+@users_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=None, help='Users validated and inserted per batch.')
+@click.option('--workers', type=int, default=None,
+              help='Password hashing processes (default: number of CPUs, 0: no worker processes).')
+def users_import(path, batch_size, workers):
+    """ Import users from a mongodump .bson file or an extended JSON file (.json array, .jsonl) """
+    stats = import_users(path, batch_size=batch_size, workers=workers, echo=click.echo)
+    click.echo(f'import completed in {stats["duration_seconds"]}s')
+
+
+tasks_cli = AppGroup('tasks', help='Celery tasks.')
+
+
+@tasks_cli.command('usage')
+@click.option('--days', type=int, default=1, show_default=True, help='Tasks started in the last days.')
+def tasks_usage(days):
+    """ Resource usage per task: CPU, memory growth of the worker processes, MongoDB commands """
+    summary = task_usage_summary(days=days)
+    for task in summary:
+        click.echo(
+            f'{task["_id"]}: {task["runs"]} runs ({task["failures"]} failed, {task["unfinished"]} unfinished), '
+            f'wall {task["avg_wall_seconds"] or 0:.2f}s avg, cpu {task["avg_cpu_seconds"] or 0:.2f}s avg '
+            f'{task["max_cpu_seconds"] or 0:.2f}s max, '
+            f'rss growth {(task["avg_rss_growth_bytes"] or 0) / 2 ** 20:.1f} MB avg '
+            f'{(task["max_rss_growth_bytes"] or 0) / 2 ** 20:.1f} MB max, '
+            f'rss {(task["max_rss_bytes"] or 0) / 2 ** 20:.1f} MB max, '
+            f'mongo {task["avg_mongo_commands"] or 0:.1f} commands'
+            + (f' {task["avg_mongo_bytes"] / 1024:.1f} KB avg' if task['avg_mongo_bytes'] is not None else ' avg')
+        )
+    if not summary:
+        click.echo(f'no task started in the last {days} days (TASK_USAGE_RETENTION_DAYS=0 disables the history)')
@@ -1,11 +1,20 @@
-from typing import List
+from collections import Counter
+from typing import Callable, List, Optional
 from functools import wraps
 import logging
+import os
 
 from flask import Blueprint, jsonify, request, abort, g as g_context
+from flask_expects_json import expects_json
 from flask_jwt_extended import jwt_required
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 
+from app import mongo_pool_stats, STALE_READS, USERS_COLL
+from app.balance import shard_balances, credit_many
 from app.models import User
+from app.profiler import PROFILE_HEADER, create_profile_token
+from app.schemas import schema_admin_users_status, schema_admin_users_role, schema_admin_users_credit
 from config import Config
 
 bp = Blueprint('admin', 'admin')
@@ -34,7 +43,8 @@ def admin_users():
         response['page_count'], response['total_active_users'] = get_users_page_count()
     else:
         page = int(page)
-    users = get_users_page(page)
+    users = list(get_users_page(page))
+    pending_balances = shard_balances([user._id for user in users])
 
     # filter out sensitive / unnecessary fields
     for user in users:
@@ -42,7 +52,7 @@ def admin_users():
             '_id': user.id,
             'full_name': user.details.full_name,
             'phone_number': user.phone_number,
-            'balance': user.balance.amount,
+            'balance': user.balance.amount + pending_balances.get(user._id, 0),
             'role': user.role,
             'status': user.status
         })
@@ -50,14 +60,162 @@ def admin_users():
     return jsonify(response), 200
 
 
+@bp.route('/mongo/pool', methods=['GET'])
+@jwt_required()
+@admin_required
+def admin_mongo_pool():
+    """ Connection pool statistics of the MongoDB client of the process serving the request """
+    return jsonify({
+        'pid': os.getpid(),
+        'max_pool_size': Config.MONGODB_CLIENT_OPTIONS['maxPoolSize'],
+        'servers': mongo_pool_stats.snapshot(),
+    }), 200
+
+
+@bp.route('/profiler/token', methods=['POST'])
+@jwt_required()
+@admin_required
+def admin_profiler_token():
+    """ Short-lived token profiling the requests sending it in the Application-Profile header (app/profiler.py) """
+    return jsonify({
+        'header': PROFILE_HEADER,
+        'token': create_profile_token(g_context.current_user._id),
+        'expires_in': Config.PROFILER_TOKEN_MAX_AGE,
+    }), 200
+
+
+def resolve_users(items: List[dict]) -> List[Optional[dict]]:
+    """ Users (_id, status, role) of the bulk request items, identified by _id or phone number, None if not found """
+    user_ids = [item['_id'] for item in items if '_id' in item]
+    phone_numbers = [item['phone_number'] for item in items if 'phone_number' in item]
+    users = list(USERS_COLL.find(
+        {'$or': [{'_id': {'$in': user_ids}}, {'phone_number': {'$in': phone_numbers}}]},
+        {'phone_number': 1, 'status': 1, 'role': 1}
+    ))
+    users_by_id = {user['_id']: user for user in users}
+    users_by_phone_number = {user['phone_number']: user for user in users}
+    return [
+        users_by_id.get(item['_id']) if '_id' in item else users_by_phone_number.get(item['phone_number'])
+        for item in items
+    ]
+
+
+def bulk_results(items: List[dict], users: List[Optional[dict]]) -> List[dict]:
+    """ Result of each item, "not_found" or "pending" until the item is processed """
+    return [
+        {
+            'index': index,
+            '_id': user['_id'] if user else item.get('_id'),
+            'phone_number': user['phone_number'] if user else item.get('phone_number'),
+            'result': 'pending' if user else 'not_found',
+        }
+        for index, (item, user) in enumerate(zip(items, users))
+    ]
+
+
+def bulk_response(results: List[dict]):
+    return jsonify({'results': results, 'summary': Counter(result['result'] for result in results)}), 200
+
+
+def bulk_update_users(items: List[dict], update_for: Callable[[dict, dict], Optional[dict]]):
+    """
+    Update the users of the items with a single unordered bulk_write.
+    update_for(item, user) returns the update of the user, None if the user is already up to date.
+    """
+    users = resolve_users(items)
+    results = bulk_results(items, users)
+
+    operations, operation_results = [], []
+    for item, user, result in zip(items, users, results):
+        if user is None:
+            continue
+        update = update_for(item, user)
+        if update is None:
+            result['result'] = 'unchanged'
+            continue
+        operations.append(UpdateOne({'_id': user['_id']}, update))
+        operation_results.append(result)
+        result['result'] = 'updated'
+
+    if operations:
+        try:
+            USERS_COLL.bulk_write(operations, ordered=False)
+        except BulkWriteError as error:
+            # the other operations of an unordered bulk write are applied
+            for write_error in error.details['writeErrors']:
+                operation_results[write_error['index']].update(result='failed', error=write_error['errmsg'])
+
+    return bulk_response(results)
+
+
+def set_status(status: str):
+    def update_for(item, user):
+        return None if user['status'] == status else {'$set': {'status': status}}
+    return update_for
+
+
+@bp.route('/users/activate', methods=['POST'])
+@jwt_required()
+@admin_required
+@expects_json(schema_admin_users_status)
+def admin_users_activate():
+    """ Activate users in bulk (e.g. onboarding), the bulk equivalent of /register_confirm """
+    return bulk_update_users(request.json['users'], set_status('active'))
+
+
+@bp.route('/users/deactivate', methods=['POST'])
+@jwt_required()
+@admin_required
+@expects_json(schema_admin_users_status)
+def admin_users_deactivate():
+    return bulk_update_users(request.json['users'], set_status('deactivated'))
+
+
+@bp.route('/users/role', methods=['POST'])
+@jwt_required()
+@admin_required
+@expects_json(schema_admin_users_role)
+def admin_users_role():
+    return bulk_update_users(
+        request.json['users'],
+        lambda item, user: None if user['role'] == item['role'] else {'$set': {'role': item['role']}}
+    )
+
+
+@bp.route('/users/balance-credit', methods=['POST'])
+@jwt_required()
+@admin_required
+@expects_json(schema_admin_users_credit)
+def admin_users_balance_credit():
+    """ Credit the balance of users in bulk, one ledger transaction per batch of Config.ADMIN_BULK_BATCH_SIZE users """
+    items = request.json['users']
+    users = resolve_users(items)
+    results = bulk_results(items, users)
+
+    credits = [(item, user, result) for item, user, result in zip(items, users, results) if user is not None]
+    for start in range(0, len(credits), Config.ADMIN_BULK_BATCH_SIZE):
+        batch = credits[start:start + Config.ADMIN_BULK_BATCH_SIZE]
+        try:
+            credit_many([(user['_id'], item['amount']) for item, user, _ in batch])
+        except PyMongoError as error:
+            logger.exception(f'balance credit of {len(batch)} users failed')
+            for _, _, result in batch:
+                result.update(result='failed', error=str(error))
+        else:
+            for _, _, result in batch:
+                result['result'] = 'credited'
+
+    return bulk_response(results)
+
+
 def get_users_page(page_num, page_size=None) -> List[User]:
     if page_size is None:
         page_size = Config.USERS_PAGE_SIZE
-    return User.objects(status='active').skip(page_num * page_size).limit(page_size)
+    return User.objects(status='active').read_preference(STALE_READS).skip(page_num * page_size).limit(page_size)
 
 
 def get_users_page_count(page_size=None):
     if page_size is None:
         page_size = Config.USERS_PAGE_SIZE
-    users_count = User.objects(status='active').count()
+    users_count = User.objects(status='active').read_preference(STALE_READS).count()
     return (users_count - 1) // page_size + 1, users_count
@@ -8,6 +8,8 @@ from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app import redis_client, pika_client
+from app.metrics import observe, REDIS_PUBLISH_DURATION, RABBITMQ_PUBLISH_DURATION
+from app.tracing import span, inject
 from app.utils.time_restrictions import time_restricted
 from config import EVENT_TYPES
 
@@ -36,13 +38,15 @@ def publish_redis_event(event_type: str, data: Dict):
     if event_type not in EVENT_TYPES:
         raise ValueError(f'Invalid event type: {event_type}')
     
-    event_data = {
-        'timestamp': datetime.utcnow().isoformat(),
-        'type': event_type,
-        'data': data
-    }
-    
-    redis_client.publish('events:event', orjson.dumps(event_data))
+    with span('redis publish events:event', kind='PRODUCER', event_type=event_type):
+        event_data = inject({
+            'timestamp': datetime.utcnow().isoformat(),
+            'type': event_type,
+            'data': data
+        })
+
+        with observe(REDIS_PUBLISH_DURATION, channel='events:event'):
+            redis_client.publish('events:event', orjson.dumps(event_data))
 
 
 def publish_rabbitmq_event(event_type: str, data: Dict):
@@ -51,26 +55,28 @@ def publish_rabbitmq_event(event_type: str, data: Dict):
     if event_type not in EVENT_TYPES:
         raise ValueError(f'Invalid event type: {event_type}')
     
-    event_data = {
-        'timestamp': datetime.utcnow().isoformat(),
-        'type': event_type,
-        'data': data
-    }
-    
     # get a channel from flask-pika
     channel = pika_client.channel()
     
     try:
-        # publish message
-        channel.basic_publish(
-            exchange='events',
-            routing_key=event_type,
-            body=orjson.dumps(event_data),
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # make message persistent
-                content_type='application/json'
+        # publish message, the trace context is in the envelope and in the AMQP headers
+        with span(f'rabbitmq publish events {event_type}', kind='PRODUCER'), \
+                observe(RABBITMQ_PUBLISH_DURATION, exchange='events', routing_key=event_type):
+            event_data = inject({
+                'timestamp': datetime.utcnow().isoformat(),
+                'type': event_type,
+                'data': data
+            })
+            channel.basic_publish(
+                exchange='events',
+                routing_key=event_type,
+                body=orjson.dumps(event_data),
+                properties=pika.BasicProperties(
+                    delivery_mode=2,  # make message persistent
+                    content_type='application/json',
+                    headers=inject({})
+                )
             )
-        )
         
         logger.info(f"Published RabbitMQ event: {event_type}")
         
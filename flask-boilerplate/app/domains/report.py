@@ -1,12 +1,18 @@
 import logging
+from datetime import datetime
 
-from flask import Blueprint, jsonify, request, g as g_context
+from flask import Blueprint, jsonify, request, abort, g as g_context
 from flask_jwt_extended import jwt_required
 from flask_marshmallow.fields import fields as ma_fields
+from jsonschema import validate, ValidationError
+from celery.utils import uuid
 
-from app import ma, api_spec
+from app import ma, api_spec, STALE_READS, REPORTS_COLL
 from app.models import User, Report
+from app.schemas import schema_report_post
+from app.outbox import transaction, add_task
 from app.tasks.report import process_report
+from app.utils.report_cache import report_fingerprint, claim_report, release_report
 
 bp = Blueprint('report', 'report')
 logger = logging.getLogger(__name__)
@@ -49,33 +55,67 @@ api_spec.components.schema('ReportsListResponse', schema=ReportsListResponseSche
 def report_post():
     """Submit an async report generation task"""
     user: User = g_context.current_user
-    
-    # Create a new report record
+
+    # the request body is optional, hence it is validated here rather than with @expects_json
+    payload = request.get_json(silent=True) or {}
+    try:
+        validate(payload, schema_report_post)
+    except ValidationError as error:
+        abort(400, error)
+    data = payload.get('data') or {}
+
+    # the report is written with the message of its processing task, once its fingerprint is claimed: a report
+    # claimed but never committed (crash, failed transaction) is missing and its claim is dropped by the next request
     report = Report(
         user=user._id,  # Store user ID as string
-        task_id='',  # Will be updated after task creation
-        status='pending'
+        task_id=uuid(),
+        status='pending',
+        fingerprint=report_fingerprint(user._id, data),
+        queued_at=datetime.utcnow(),
     )
-    report.save()
-    
+    report.validate()
+
+    # identical requests attach to the report already computed or in progress (single-flight)
+    while (claimed_report_id := claim_report(report.fingerprint, report._id)) is not None:
+        claimed_report = Report.objects(_id=claimed_report_id, user=user._id).first()
+        if claimed_report is not None and claimed_report.status != 'failed':
+            logger.info(f"Report request of user {user._id} served by report {claimed_report_id}")
+            return jsonify({
+                'msg': 'identical report already submitted',
+                'report_id': claimed_report._id,
+                'task_id': claimed_report.task_id,
+                'deduplicated': True
+            }), 200
+
+        # stale cache entry (report missing or failed): drop it and claim the fingerprint again
+        release_report(report.fingerprint, claimed_report_id)
+
     # Prepare task data
     task_data = {
         'user_id': user._id,
-        'report_id': report._id
+        'report_id': report._id,
+        'data': data
     }
     celery_kwargs = {}  # can specify queue and other task options here
-    task = process_report.apply_async(args=[task_data], **celery_kwargs)
-    
-    # Update report with task_id
-    report.task_id = task.task_id
-    report.save()
+
+    # the task is sent by the outbox relay once committed: the request never waits for the broker
+    try:
+        with transaction() as session:
+            REPORTS_COLL.insert_one(report.to_mongo().to_dict(), session=session)
+            add_task(process_report.name, session, args=[task_data], task_id=report.task_id, **celery_kwargs)
+    except Exception as e:
+        # nothing was written: release the claim, so that identical requests are not attached to a missing report
+        logger.error(f"Failed to queue report {report._id} of user {user._id}: {str(e)}")
+        release_report(report.fingerprint, report._id)
+        raise
     
-    logger.info(f"Queued report task {task.task_id} for user {user._id}")
+    logger.info(f"Queued report task {report.task_id} for user {user._id}")
     
     return jsonify({
         'msg': 'report task submitted successfully',
         'report_id': report._id,
-        'task_id': task.task_id
+        'task_id': report.task_id,
+        'deduplicated': False
     }), 200
 
 
@@ -108,8 +148,8 @@ def reports_list():
     if status:
         query['status'] = status
     
-    # Get reports
-    reports = Report.objects(**query).order_by('-created_at').limit(limit)
+    # Get reports (a report created moments ago may be missing when served by a secondary)
+    reports = Report.objects(**query).read_preference(STALE_READS).order_by('-created_at').limit(limit)
     
     response_data = {
         'reports': list(reports),
@@ -1,5 +1,4 @@
 import os
-import hashlib
 import logging
 from datetime import datetime
 
@@ -9,11 +8,15 @@ from flask_expects_json import expects_json
 from flask_jwt_extended import jwt_required
 from flask_marshmallow.fields import fields as ma_fields
 from werkzeug.utils import secure_filename
+from botocore.exceptions import ClientError
 
-from app import ma, api_spec, MEDIA_BUCKET
+from app import ma, api_spec, boto_s3, MEDIA_BUCKET, USERS_COLL
 from app.models import User
 from app.models.user import Contacts
-from app.schemas import schema_user_put, schema_user_contacts_post
+from app.schemas import schema_user_put, schema_user_contacts_post, schema_user_profile_picture_upload
+from app.outbox import transaction, add_task
+from app.tasks.media import generate_profile_picture_variants
+from app.utils.streams import HashingReader, FileTooLargeError
 
 from config import Config
 
@@ -54,13 +57,14 @@ def get_user():
         '_id': user._id,
         'details': user_details_schema.dump(user.details),
         'profile_picture': user.profile_picture,
+        'profile_picture_variants': user.profile_picture_variants,
         'phone_number': user.phone_number,
         'signup_date': user.signup_date,
         'role': user.role,
         'status': user.status,
         'balance': {
-            'amount': user.balance.amount,
-            'last_topup': user.balance.last_topup
+            'amount': user.current_balance(),
+            'last_topup': user.last_topup()
         },
         'contacts': user_contacts_schema.dump(user.contacts),
     }), 200
@@ -115,6 +119,39 @@ def user_contacts_post():
     return jsonify({'contacts': user_contacts_schema.dump(user.contacts)}), 200
 
 
+def profile_picture_resource(user: User, filename: str):
+    """ Returns the bucket key and mime type of a user profile picture, or None if the file type is not allowed """
+    file_extension = os.path.splitext(secure_filename(filename))[1]
+
+    if file_extension not in Config.PROFILE_PIC_ALLOWED_EXTENSIONS:
+        return None, None
+
+    # inferring the mime type from the file extension
+    # should verify the file contents with magic library in production
+    mime_type = f'image/{file_extension[1:]}'
+
+    return f'profile-pic/{user.id}{file_extension}', mime_type
+
+
+def set_profile_picture(user: User, resource_path: str, content_hash: str):
+    # the content hash versions the URL, so that clients and CDNs do not serve a replaced picture from cache
+    version = content_hash[:12]
+    profile_picture = f'{Config.MEDIA_BASE_URL}/{resource_path}?v={version}'
+
+    # the variants task is sent by the outbox relay once committed with the new picture
+    with transaction() as session:
+        # variants of the previous picture are dropped, clients fall back to the original until the new ones are ready
+        USERS_COLL.update_one(
+            {'_id': user._id}, {'$set': {'profile_picture': profile_picture, 'profile_picture_variants': {}}},
+            session=session
+        )
+        add_task(generate_profile_picture_variants.name, session, args=[user.id, resource_path, version])
+
+    user.profile_picture = profile_picture
+    user.profile_picture_variants = {}
+    user._clear_changed_fields()
+
+
 @bp.route('/user/profile-picture', methods=['POST'])
 @jwt_required()
 def user_profile_picture_post():
@@ -124,45 +161,99 @@ def user_profile_picture_post():
     if not file:
         return jsonify({'msg': 'no file provided'}), 400
 
-    filename = secure_filename(file.filename)
-    file_extension = os.path.splitext(filename)[1]
-
-    if file_extension not in Config.PROFILE_PIC_ALLOWED_EXTENSIONS:
+    resource_path, mime_type = profile_picture_resource(user, file.filename)
+    if resource_path is None:
         return jsonify({'msg': 'invalid file type'}), 400
 
-    # get the length of the stream to check if it exceeds the limit
-    file_length = file.stream.seek(0, os.SEEK_END)
-    file.stream.seek(0)
+    # reject uploads that declare a size above the limit before reading them
+    if file.content_length and file.content_length > Config.PROFILE_PIC_MAX_SIZE:
+        logger.info(f'media file too large - size {file.content_length} bytes')
+        return jsonify({'msg': 'file too large'}), 400
+
+    # the file is hashed and its size checked while it is streamed to the bucket, in a single pass
+    reader = HashingReader(file.stream, max_size=Config.PROFILE_PIC_MAX_SIZE)
 
-    if file_length > Config.PROFILE_PIC_MAX_SIZE:
-        logger.info(f'media file too large - size {file_length} bytes')
+    try:
+        MEDIA_BUCKET.upload_fileobj(
+            reader,
+            resource_path,
+            ExtraArgs={
+                'ACL': 'public-read',
+                'ContentType': mime_type,
+                'Metadata': {'user': user.id or 'unauthenticated'}
+            }
+        )
+    except FileTooLargeError:
+        logger.info(f'media file too large - size over {reader.size} bytes')
         return jsonify({'msg': 'file too large'}), 400
 
-    # compute the md5sum of the user_id + file content for the resource name
-    # this avoids duplication of files on a per-user basis
-    resource_hash = hashlib.md5()
-    resource_hash.update(bytes.fromhex(user.id or ''))
-    resource_hash.update(file.stream.read())
-    resource_hash = resource_hash.digest()
-    file.stream.seek(0)
+    set_profile_picture(user, resource_path, reader.hexdigest())
 
-    # inferring the mime type from the file extension
-    # should verify the file contents with magic library in production
-    mime_type = f'image/{file_extension[1:]}'
+    return jsonify({'msg': 'success'}), 200
+
+
+@bp.route('/user/profile-picture/upload-url', methods=['POST'])
+@jwt_required()
+@expects_json(schema_user_profile_picture_upload)
+def user_profile_picture_upload_url_post():
+    """ Returns a presigned POST to upload the profile picture directly to the bucket """
+    user = g_context.current_user
 
-    resource_path = f'profile-pic/{user.id}{file_extension}'
+    resource_path, mime_type = profile_picture_resource(user, request.json['filename'])
+    if resource_path is None:
+        return jsonify({'msg': 'invalid file type'}), 400
 
-    MEDIA_BUCKET.upload_fileobj(
-        file.stream,
-        resource_path,
-        ExtraArgs={
-            'ACL': 'public-read',
-            'ContentType': mime_type,
-            'Metadata': {'user': user.id or 'unauthenticated'}
-        }
+    # the bucket enforces the same ACL, content type and size limit of the upload through the API
+    presigned_post = boto_s3.meta.client.generate_presigned_post(
+        Bucket=Config.MEDIA_BUCKET_NAME,
+        Key=resource_path,
+        Fields={
+            'acl': 'public-read',
+            'Content-Type': mime_type,
+            'x-amz-meta-user': user.id
+        },
+        Conditions=[
+            {'acl': 'public-read'},
+            {'Content-Type': mime_type},
+            {'x-amz-meta-user': user.id},
+            ['content-length-range', 1, Config.PROFILE_PIC_MAX_SIZE]
+        ],
+        ExpiresIn=Config.PROFILE_PIC_UPLOAD_URL_EXPIRES
     )
 
-    user.profile_picture = f'{Config.MEDIA_BASE_URL}/{resource_path}'
-    user.save()
+    return jsonify({
+        'url': presigned_post['url'],
+        'fields': presigned_post['fields'],
+        'expires_in': Config.PROFILE_PIC_UPLOAD_URL_EXPIRES
+    }), 200
+
+
+@bp.route('/user/profile-picture/confirm', methods=['POST'])
+@jwt_required()
+@expects_json(schema_user_profile_picture_upload)
+def user_profile_picture_confirm_post():
+    """ Confirms a profile picture uploaded directly to the bucket through a presigned POST """
+    user = g_context.current_user
+
+    resource_path, _ = profile_picture_resource(user, request.json['filename'])
+    if resource_path is None:
+        return jsonify({'msg': 'invalid file type'}), 400
+
+    # a HEAD request on the uploaded object - the file content never goes through the API
+    uploaded_object = MEDIA_BUCKET.Object(resource_path)
+    try:
+        uploaded_object.load()
+    except ClientError as error:
+        if error.response['Error']['Code'] in ['404', 'NoSuchKey']:
+            return jsonify({'msg': 'file not uploaded'}), 404
+        raise
+
+    if uploaded_object.content_length > Config.PROFILE_PIC_MAX_SIZE:
+        logger.info(f'media file too large - size {uploaded_object.content_length} bytes')
+        uploaded_object.delete()
+        return jsonify({'msg': 'file too large'}), 400
+
+    # the ETag of a single part upload is the MD5 of the content
+    set_profile_picture(user, resource_path, uploaded_object.e_tag.strip('"'))
 
-    return jsonify({'msg': 'success'}), 200 
+    return jsonify({'msg': 'success'}), 200
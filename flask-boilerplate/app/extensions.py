@@ -0,0 +1,166 @@
+""" Flask extensions, Celery app and external service clients shared by all the process roles """
+import mongoengine
+from mongoengine import connection as mongoengine_connection
+from mongoengine.base.common import _get_documents_by_db
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+from flask_redis import FlaskRedis
+from flask_pika import Pika
+from flask_marshmallow import Marshmallow
+import pymongo
+from pymongo.read_preferences import SecondaryPreferred
+from redis import Redis
+from celery import Celery
+from flask_log_request_id import RequestID
+
+from app.services import services
+from app.utils.mongo_pool import PoolStatsListener
+from config import Config
+
+
+# external service clients are created on first use by the services registry, once per process
+# module-level names are proxies to the clients of the current process and can be imported anywhere
+def register_mongo_connection():
+    """ Register the MongoDB connection of the process in MongoEngine, its client is created on first use """
+    from app.utils.mongo_commands import MongoCommandListener
+
+    mongoengine.register_connection(
+        alias=DEFAULT_CONNECTION_NAME,
+        db=Config.MONGODB_DB,
+        host=Config.MONGODB_URI,
+        connect=False,
+        event_listeners=[services.get('mongo_pool_stats'), MongoCommandListener()],
+        **Config.MONGODB_CLIENT_OPTIONS,
+    )
+
+
+def create_mongo_client():
+    """
+    The single MongoClient (and connection pool) of the process, shared by the MongoEngine models
+    and the raw pymongo collections
+    """
+    if DEFAULT_CONNECTION_NAME not in mongoengine_connection._connection_settings:
+        register_mongo_connection()
+    # the models may have created it already, on first use after a fork
+    return mongoengine.get_connection()
+
+
+def forget_mongo_connection():
+    """
+    Fork hook: drop the MongoEngine references to the client of the parent process, without closing it (the parent
+    keeps using it), and register the connection of the child, whose client is created on first use.
+    mongoengine.disconnect() would close the client, which ends the server sessions of the parent: the connection
+    registry is reset directly (mongoengine is pinned, the behavior is covered by test_mongo_client_after_fork)
+    """
+    mongoengine_connection._connections.pop(DEFAULT_CONNECTION_NAME, None)
+    mongoengine_connection._dbs.pop(DEFAULT_CONNECTION_NAME, None)
+    mongoengine_connection._connection_settings.pop(DEFAULT_CONNECTION_NAME, None)
+    # the models cache their collection, bound to the parent's client
+    for document in _get_documents_by_db(DEFAULT_CONNECTION_NAME, DEFAULT_CONNECTION_NAME):
+        if issubclass(document, mongoengine.Document):
+            document._collection = None
+    register_mongo_connection()
+
+
+services.register('mongo_pool_stats', PoolStatsListener)
+# MongoEngine holds a reference to the client: it is dropped right after a fork
+services.register('mongo_client', create_mongo_client, after_fork=forget_mongo_connection)
+services.register('mongodb', lambda: services.get('mongo_client')[Config.MONGODB_DB])
+
+mongo_client: pymongo.MongoClient = services.proxy('mongo_client')
+mongodb: pymongo.database.Database = services.proxy('mongodb')
+mongo_pool_stats: PoolStatsListener = services.proxy('mongo_pool_stats')
+
+# read preference of the heavy reads that tolerate stale data, applied per query:
+#   User.objects(...).read_preference(STALE_READS) or USERS_COLL.with_options(read_preference=STALE_READS)
+# reads that must see the writes of the request (e.g. current user lookup, report polling) stay on the primary
+STALE_READS = SecondaryPreferred(max_staleness=Config.MONGODB_READ_MAX_STALENESS)
+
+
+def collection_proxy(name: str) -> pymongo.collection.Collection:
+    services.register(f'{name}_collection', lambda: services.get('mongodb')[name])
+    return services.proxy(f'{name}_collection')
+
+
+USERS_COLL: pymongo.collection.Collection = collection_proxy('users')
+REPORTS_COLL: pymongo.collection.Collection = collection_proxy('reports')
+ANOTHER_MODEL_COLL: pymongo.collection.Collection = collection_proxy('another_model')
+ERRORS_COLL: pymongo.collection.Collection = collection_proxy('errors')
+TASK_CHECKPOINTS_COLL: pymongo.collection.Collection = collection_proxy('task_checkpoints')
+CHANGE_STREAM_TOKENS_COLL: pymongo.collection.Collection = collection_proxy('change_stream_tokens')
+OUTBOX_COLL: pymongo.collection.Collection = collection_proxy('outbox')
+BALANCE_SHARDS_COLL: pymongo.collection.Collection = collection_proxy('balance_shards')
+BALANCE_LEDGER_COLL: pymongo.collection.Collection = collection_proxy('balance_ledger')
+TASK_USAGE_COLL: pymongo.collection.Collection = collection_proxy('task_usage')
+
+# Redis client for events
+# NOTE: FlaskRedis exposes a Redis client instance, but it is not a subclass of Redis
+#       FlaskRedis | Redis typing is used to let the IDE provide autocompletion for Redis methods
+redis_client: FlaskRedis | Redis = FlaskRedis(decode_responses=True, config_prefix='REDIS_EVENTS')
+
+# pika client for event communication
+pika_client = Pika()
+
+# boto3 S3 resource and buckets
+def create_s3_resource():
+    # boto3 is imported here: its import and session setup are only paid by processes using S3
+    import boto3
+
+    return boto3.resource(
+        service_name='s3',
+        aws_access_key_id=Config.MEDIA_BUCKET_ACCESS_KEY,
+        aws_secret_access_key=Config.MEDIA_BUCKET_ACCESS_SECRET,
+        region_name='blr1',
+        endpoint_url='https://aws-s3-endpoint.com',
+    )
+
+
+services.register('s3', create_s3_resource)
+services.register('media_bucket', lambda: services.get('s3').Bucket(Config.MEDIA_BUCKET_NAME))
+
+boto_s3 = services.proxy('s3')
+MEDIA_BUCKET = services.proxy('media_bucket')
+
+# using marshmallow to marshall a few JSON responses
+ma = Marshmallow()
+
+
+def create_api_spec():
+    from apispec import APISpec
+    from apispec.ext.marshmallow import MarshmallowPlugin
+
+    return APISpec(
+        title="Flask Boilerplate",
+        version="1.0.0",
+        openapi_version="3.0.2",
+        plugins=[MarshmallowPlugin()],
+    )
+
+
+services.register('api_spec', create_api_spec, per_process=False)
+api_spec = services.proxy('api_spec')
+
+
+# instantiating a RequestID object to assign each request a unique ID for logging
+request_id = RequestID()
+
+# NOTE: the Celery app is not lazy, the task decorators need it at import time
+#       it does not connect to the broker or import the task modules until they are actually needed
+celery = Celery(
+    __name__,
+    backend=Config.CELERY_RESULT_BACKEND,
+    broker=Config.CELERY_BROKER_URL,
+)
+celery.autodiscover_tasks(packages=['app.tasks'])
+
+# configuring queues for different tasks
+celery_conf = {
+    'task_routes': {
+        'app.tasks.report.process_report': {'queue': Config.REPORT_CELERY_QUEUE},
+        'app.tasks.report.build_report_chunk': {'queue': Config.REPORT_CELERY_QUEUE},
+        'app.tasks.report.finalize_report': {'queue': Config.REPORT_CELERY_QUEUE},
+    },
+    'task_time_limit': 60 * 60,  # seconds - 1 hour task time limit
+    # recycling of the pool processes, to be set from the observed task usage (flask --app webapp tasks usage)
+    'worker_max_tasks_per_child': Config.CELERY_WORKER_MAX_TASKS_PER_CHILD,
+    'worker_max_memory_per_child': Config.CELERY_WORKER_MAX_MEMORY_PER_CHILD,
+}
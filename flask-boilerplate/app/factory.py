@@ -0,0 +1,271 @@
+import time
+import hashlib
+from datetime import datetime, date
+import logging
+
+from flask import Flask, make_response, jsonify, request, g as g_context
+from flask.json.provider import DefaultJSONProvider
+import orjson
+from bson import ObjectId
+from redis.exceptions import RedisError
+from flask_log_request_id import RequestID, current_request_id
+
+from app.extensions import redis_client, pika_client, ma, celery, celery_conf
+from app.extensions import ERRORS_COLL
+from app.services import services
+from app.metrics import init_metrics, init_celery_metrics
+from app.scopes import init_request_scope, init_task_scope
+from app.tracing import set_service_name
+from app.utils.task_usage import init_task_usage
+from app.utils.process import log_startup
+from config import Config, EVENT_TYPES
+
+
+logger = logging.getLogger(__name__)
+
+
+def init_g_context():
+    # add request timestamp information to the g_context
+    # useful for having a consistent timestamp across the request lifecycle
+    utc_now = datetime.utcnow()
+    g_context.utc_now = utc_now
+
+    # ensure current_user is always available, at worst None if not authenticated
+    # when the user is logged in, a loader in flask_jwt_extended module will set this
+    g_context.current_user = None
+
+
+# after_request handler to append Application-User-Id and Application-Request-Id headers
+def append_application_headers(response):
+    user = g_context.current_user
+    response.headers['Application-User-Id'] = user.id if user else 'unauthenticated'
+    response.headers['Application-Request-Id'] = current_request_id()
+    return response
+
+
+# handle jsonschema validation error
+def handle_bad_request(error):
+    from flask_jwt_extended import get_jwt_identity
+    from jsonschema import ValidationError
+
+    # log specific errors to mongodb for debug
+    if isinstance(error.description, ValidationError):
+
+        if request.endpoint in ['event.rabbitmq_event_post', 'event.redis_event_post']:
+            ERRORS_COLL.insert_one({
+                '_id': generate_unique_id(),
+                'user': get_jwt_identity(),
+                'user_agent': request.user_agent.string,
+                'time': datetime.utcnow(),
+                'endpoint': request.endpoint,
+                'error': error.description.message
+            })
+
+        return make_response(
+            jsonify({
+                'msg': 'Bad Object',
+                'schema_error': error.description.message
+            }),
+            400
+        )
+
+    # handle other "Bad Request"-errors
+    return error
+
+
+class CustomJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(obj):
+        # encode date/datetime objects to ISO format strings
+        # MongoDB saves timestamps with millisecond precision, using timespec='milliseconds' for consistency
+        if isinstance(obj, datetime):
+            return obj.isoformat(timespec='milliseconds')
+        if isinstance(obj, date):
+            return obj.isoformat()
+        return DefaultJSONProvider.default(obj)
+
+
+def generate_unique_id():
+    return str(ObjectId())
+
+
+def init_celery(app):
+    celery.conf.update(**celery_conf)
+
+    class ContextTask(celery.Task):
+        def __call__(self, *args, **kwargs):
+            with app.app_context():
+                return self.run(*args, **kwargs)
+
+    celery.Task = ContextTask
+    # queue wait and run time of the tasks published and run by the process
+    init_celery_metrics()
+    # spans of the tasks (trace context and request id in the headers of the tasks published), MongoDB commands
+    init_task_scope()
+    # CPU, memory and MongoDB usage of the tasks (after the task scope: the command accounting is closed first)
+    init_task_usage()
+    return celery
+
+
+# redis key holding the fingerprint of the last RabbitMQ topology declared
+RABBITMQ_TOPOLOGY_KEY = 'rabbitmq:topology:fingerprint'
+
+
+def rabbitmq_topology_fingerprint() -> str:
+    """ Hash of the exchanges, queues and bindings declared by setup_rabbitmq """
+    topology = {
+        'exchanges': [{'name': 'events', 'type': 'topic', 'durable': True}],
+        'queues': [
+            {'name': f'events.{event_type}', 'durable': True, 'exchange': 'events', 'routing_key': event_type}
+            for event_type in sorted(EVENT_TYPES)
+        ]
+    }
+    return hashlib.sha256(orjson.dumps(topology, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def setup_rabbitmq(app, force=False) -> bool:
+    """
+    Setup RabbitMQ exchanges, queues, and bindings.
+    Declarations are idempotent but cost a burst of broker round-trips: they are skipped when the fingerprint
+    of the topology stored in Redis matches the current one (i.e. EVENT_TYPES did not change since last time).
+    Returns True if the topology was declared.
+    """
+    fingerprint = rabbitmq_topology_fingerprint()
+
+    if not force:
+        try:
+            if redis_client.get(RABBITMQ_TOPOLOGY_KEY) == fingerprint:
+                logger.info('RabbitMQ infrastructure up to date')
+                return False
+        except RedisError as e:
+            logger.warning(f'Failed to read the RabbitMQ topology fingerprint, declaring it: {str(e)}')
+
+    # get a channel from flask-pika
+    channel = pika_client.channel()
+    
+    try:
+        # declare the main events exchange
+        channel.exchange_declare(exchange='events', exchange_type='topic', durable=True)
+        
+        # declare queues for each event type and bind them
+        for event_type in EVENT_TYPES:
+            queue_name = f'events.{event_type}'
+            channel.queue_declare(queue=queue_name, durable=True)
+            channel.queue_bind(exchange='events', queue=queue_name, routing_key=event_type)
+        
+        logger.info('RabbitMQ infrastructure setup completed')
+    
+    except Exception as e:
+        logger.error(f'Failed to setup RabbitMQ infrastructure: {str(e)}')
+        raise
+
+    finally:
+        # return the channel to the pool
+        pika_client.return_channel(channel)
+
+    redis_client.set(RABBITMQ_TOPOLOGY_KEY, fingerprint)
+    return True
+
+
+def init_data_layer(app):
+    """ Initialize the database and cache extensions, used by every Flask-based process role """
+    # registers the shared client as the MongoEngine connection (no connection is opened before first use)
+    services.get('mongo_client')
+    redis_client.init_app(app)
+
+
+def create_base_app(config_class=Config):
+    # web-only extensions are imported here, so that the other process roles do not pay for them
+    from flask_cors import CORS
+    from app.jwt import jwt, invalidate_current_user
+
+    app = Flask('app')
+    app.config.from_object(config_class)
+
+    # configure a custom JSON encoder to handle datetime objects
+    app.json_provider_class = CustomJSONProvider
+    app.json = app.json_provider_class(app)
+
+    if Config.WEBAPP_ENV == 'development':
+        cors = CORS(app, resources={r"/*": {"origins": ["http://localhost:3000"], }}, supports_credentials=True)
+
+    init_data_layer(app)
+    jwt.init_app(app)
+    ma.init_app(app)
+
+    request_id = RequestID(app)  # NOTE: this line is a workaround for an unfixed bug in init_app() that breaks
+    # request_id.init_app(app)   #       lazy initialization pattern (see issue #50 on project GitHub)
+
+    app.before_request(init_g_context)
+    app.after_request(append_application_headers)
+    # span of the request (continuing the trace of its traceparent header) and its MongoDB commands: Server-Timing
+    # header, slow commands and N+1 queries logs
+    init_request_scope(app)
+    app.after_request(invalidate_current_user)
+    app.register_error_handler(400, handle_bad_request)
+
+    return app
+
+
+def create_app(config_class=Config):
+    """ Application factory of the webapp role """
+    started = time.perf_counter()
+    set_service_name('webapp')
+    app = create_base_app(config_class)
+
+    pika_client.init_app(app)
+    app.config['FLASK_PIKA_PARAMS'] = Config.FLASK_PIKA_PARAMS
+    
+    init_celery(app)
+    # Prometheus metrics (GET /metrics), see app/metrics.py for the multi-process setup
+    init_metrics(app)
+    # opt-in profiling of single requests (signed header) or of a sample of the requests of some endpoints
+    from app.profiler import init_profiler
+    init_profiler(app)
+
+    # in production the topology is declared once per deploy with the "flask rabbitmq declare" command
+    if Config.RABBITMQ_DECLARE_ON_STARTUP:
+        setup_rabbitmq(app)
+
+    # dev tools for development environment (API specs, schema routes and Swagger Web UI)
+    if app.config['WEBAPP_ENV'] == 'development':
+        from flasgger import Swagger
+        Swagger(app)
+
+        from app.devtools import bp as devtools_blueprint
+        app.register_blueprint(devtools_blueprint, url_prefix=Config.SWAGGER_BASE_PREFIX)
+
+    from app.commands import rabbitmq_cli, mongo_cli, users_cli, tasks_cli
+    app.cli.add_command(rabbitmq_cli)
+    app.cli.add_command(mongo_cli)
+    app.cli.add_command(users_cli)
+    app.cli.add_command(tasks_cli)
+
+    from app import domains
+
+    app.register_blueprint(domains.admin_blueprint, url_prefix='/admin')
+    app.register_blueprint(domains.event_blueprint, url_prefix='/')
+    app.register_blueprint(domains.auth_blueprint, url_prefix='/')
+    app.register_blueprint(domains.report_blueprint, url_prefix='/')
+    app.register_blueprint(domains.user_blueprint, url_prefix='/')
+    app.register_blueprint(domains.webhook_blueprint, url_prefix='/webhook')
+
+    log_startup('webapp', started)
+    return app
+
+
+def create_worker_app(config_class=Config, role='worker'):
+    """
+    Application factory of the celery worker role.
+    Tasks only need an application context, the database and the cache: no blueprints, JWT, API docs or RabbitMQ.
+    """
+    started = time.perf_counter()
+    set_service_name(role)
+    app = Flask('app')
+    app.config.from_object(config_class)
+
+    init_data_layer(app)
+    init_celery(app)
+
+    log_startup(role, started)
+    return app
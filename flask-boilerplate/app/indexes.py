@@ -0,0 +1,183 @@
+"""
+Declarative registry of the MongoDB indexes and the migration applying it.
+
+INDEXES is the single source of truth for the indexes of every collection (MongoEngine automatic index creation
+is disabled in BaseDocument). sync_indexes() diffs it against list_indexes() and only applies the differences,
+it is run as an explicit deploy step ("flask --app webapp mongo indexes") instead of on every process start.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from pymongo import ASCENDING as ASC, DESCENDING as DESC, IndexModel
+
+from app.extensions import mongodb
+from app.models.another_model import StatusEnum
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    'users': [
+        IndexModel([('phone_number', ASC)], unique=True),  # authentication lookup
+        IndexModel([('access_token', ASC)], unique=True),  # webhook validation
+        IndexModel([('contacts.email.contact', ASC)]),  # fast lookup for email
+        IndexModel([('role', ASC)]),  # admin queries
+        # filter active/inactive users, inactive users lookup (paged by last_login and _id)
+        IndexModel([('status', ASC), ('last_login', ASC), ('_id', ASC)]),
+    ],
+    'reports': [
+        IndexModel([('task_id', ASC)], unique=True),
+        IndexModel([('user', ASC), ('created_at', DESC)]),  # user reports listing, newest first
+        IndexModel([('status', ASC)]),
+        IndexModel([('created_at', ASC)]),
+    ],
+    'another_model': [
+        IndexModel([('created_at', DESC)]),  # default ordering
+        IndexModel([('is_active', ASC), ('status', ASC), ('created_at', DESC)]),  # active_objects
+        IndexModel([('tags', ASC), ('is_active', ASC)]),  # search_by_tags
+    ],
+    'balance_shards': [
+        IndexModel([('user', ASC), ('amount', ASC)]),  # compaction, balance reads
+    ],
+    'balance_ledger': [
+        IndexModel([('user', ASC), ('compacted_at', ASC), ('created_at', DESC)]),  # compaction, history
+    ],
+    'outbox': [
+        IndexModel([('available_at', ASC), ('created_at', ASC)]),  # relay batches
+    ],
+    'task_usage': [
+        # retention, usage summary (the killed runs have no finished_at)
+        IndexModel([('started_at', ASC)], expireAfterSeconds=max(Config.TASK_USAGE_RETENTION_DAYS, 1) * 24 * 3600),
+    ],
+}
+
+# index options that make two indexes with the same name different
+COMPARED_OPTIONS = ['unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression', 'collation']
+
+# representative queries issued by the endpoints and tasks: (source, collection, filter, sort)
+QUERY_SHAPES = [
+    ('auth.login', 'users', {'phone_number': '+10000000000', 'status': 'active'}, None),
+    ('auth.register', 'users', {'phone_number': '+10000000000'}, None),
+    ('webhook.webhook_post', 'users', {'access_token': 'token'}, None),
+    ('admin.admin_users', 'users', {'status': 'active'}, None),
+    ('report.report_get', 'reports', {'_id': 'id', 'user': 'user'}, None),
+    ('report.reports_list', 'reports', {'user': 'user'}, [('created_at', DESC)]),
+    ('report.reports_list (status)', 'reports', {'user': 'user', 'status': 'completed'}, [('created_at', DESC)]),
+    ('tasks.disable_inactive_users', 'users',
+     {'status': 'active', 'last_login': {'$lte': datetime(2000, 1, 1)}}, [('last_login', ASC), ('_id', ASC)]),
+    ('AnotherModel.active_objects', 'another_model',
+     {'is_active': True, 'status': {'$ne': StatusEnum.ARCHIVED.value}}, [('created_at', DESC)]),
+    ('outbox.relay_batch', 'outbox', {'available_at': {'$lte': datetime(2000, 1, 1)}}, [('created_at', ASC)]),
+    ('AnotherModel.search_by_tags', 'another_model', {'tags': {'$in': ['tag']}, 'is_active': True}, None),
+]
+
+
+def index_spec(index: dict) -> dict:
+    """ Comparable specification of an index (as declared or as returned by list_indexes) """
+    return {
+        'key': list(index['key'].items()),
+        **{option: index[option] for option in COMPARED_OPTIONS if option in index},
+    }
+
+
+def plan_index_changes(collection_name: str, declared: List[IndexModel]) -> dict:
+    """ Diff the declared indexes against the existing ones """
+    existing = {index['name']: index for index in mongodb[collection_name].list_indexes()}
+    existing.pop('_id_', None)
+
+    plan = {'create': [], 'rebuild': [], 'obsolete': []}
+    declared_names = set()
+    for index in declared:
+        name = index.document['name']
+        declared_names.add(name)
+        if name not in existing:
+            plan['create'].append(index)
+        elif index_spec(index.document) != index_spec(existing[name]):
+            plan['rebuild'].append(index)
+
+    plan['obsolete'] = [name for name in existing if name not in declared_names]
+    return plan
+
+
+def sync_indexes(dry_run: bool = False, obsolete: str = 'keep', rebuild_unique: bool = False,
+                 echo=logger.info) -> Dict[str, dict]:
+    """
+    Apply the index registry to the database.
+    Indexes are built one at a time (MongoDB builds do not block reads and writes since 4.2), new indexes are
+    built before obsolete ones are removed and obsolete indexes are first hidden, which is reversible:
+    obsolete='keep' only reports them, 'hide' hides them from the query planner, 'drop' drops them.
+    Changed indexes (same name, different keys or options) have to be dropped and built again: MongoDB does not
+    accept a second index with the same keys, nor rename indexes. While a unique index is rebuilt the uniqueness
+    is not enforced, such rebuilds are only reported unless rebuild_unique is set (during a write freeze).
+    """
+    plans = {}
+    for collection_name, declared in INDEXES.items():
+        collection = mongodb[collection_name]
+        plan = plans[collection_name] = plan_index_changes(collection_name, declared)
+
+        for index in plan['create']:
+            echo(f'{collection_name}: create index {index.document["name"]}')
+            if not dry_run:
+                collection.create_indexes([index])
+
+        for index in plan['rebuild']:
+            name = index.document['name']
+            unique = index.document.get('unique') or existing_unique(collection, name)
+            if unique and not rebuild_unique:
+                echo(f'{collection_name}: unique index {name} changed, not rebuilt (uniqueness is not enforced '
+                     f'during the rebuild, see --rebuild-unique)')
+                continue
+            echo(f'{collection_name}: rebuild {"unique " if unique else ""}index {name} (changed keys or options)')
+            if not dry_run:
+                collection.drop_index(index.document['name'])
+                collection.create_indexes([index])
+
+        for name in plan['obsolete']:
+            if obsolete == 'keep':
+                echo(f'{collection_name}: obsolete index {name} (kept)')
+                continue
+            echo(f'{collection_name}: {obsolete} obsolete index {name}')
+            if dry_run:
+                continue
+            if obsolete == 'hide':
+                mongodb.command('collMod', collection_name, index={'name': name, 'hidden': True})
+            elif obsolete == 'drop':
+                collection.drop_index(name)
+
+    return plans
+
+
+def existing_unique(collection, name: str) -> bool:
+    return any(index['name'] == name and index.get('unique') for index in collection.list_indexes())
+
+
+def plan_stages(plan: dict) -> List[str]:
+    """ All the stage names of a query plan (recursively, including SBE plans nested in queryPlan) """
+    stages = [plan['stage']] if 'stage' in plan else []
+    for key in ['queryPlan', 'inputStage']:
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for input_stage in plan.get('inputStages', []):
+        stages += plan_stages(input_stage)
+    return stages
+
+
+def find_uncovered_queries() -> List[dict]:
+    """ Explain the QUERY_SHAPES and report the ones needing a collection scan or an in-memory sort """
+    uncovered = []
+    for source, collection_name, query_filter, sort in QUERY_SHAPES:
+        cursor = mongodb[collection_name].find(query_filter)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        stages = plan_stages(cursor.explain()['queryPlanner']['winningPlan'])
+        problems = [stage for stage in ['COLLSCAN', 'SORT'] if stage in stages]
+        if problems:
+            uncovered.append({
+                'source': source, 'collection': collection_name,
+                'filter': query_filter, 'sort': sort, 'stages': problems,
+            })
+    return uncovered
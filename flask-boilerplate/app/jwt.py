@@ -1,20 +1,29 @@
-from flask import g as g_context
+import copy
+
+from flask import request, g as g_context
 from flask_jwt_extended import JWTManager
 
+from app.extensions import USERS_COLL
 from app.models.user import User
+from app.utils.local_cache import LocalCache
 
 
 jwt = JWTManager()
 
+# the user of each request is cached by the process, until the change stream watcher publishes a change of it
+user_cache = LocalCache('users')
+
 
 @jwt.user_lookup_loader
 def user_lookup_callback(_jwt_headers, jwt_payload):
     user_id = jwt_payload['sub']
 
-    try:
-        user = User.objects(_id=user_id).get()
-    except User.DoesNotExist:
+    # read from the primary: the user may have been modified by the previous request of the client
+    user_document = user_cache.get(user_id, lambda: USERS_COLL.find_one({'_id': user_id}))
+    if user_document is None:
         return None
+    # the cached document is shared by the requests, the User object is built from a copy
+    user = User._from_son(copy.deepcopy(user_document))
 
     # flask_jwt_extended sets the user object in the request context (g_context) in a "_jwt_extended_jwt_user"
     # attribute and exposes it through the "current_user" object or get_current_user() function
@@ -22,3 +31,11 @@ def user_lookup_callback(_jwt_headers, jwt_payload):
     # that is independent of the JWT extension (for example: should the authentication method change in the future)
     g_context.current_user = user
     return user
+
+
+def invalidate_current_user(response):
+    """ Requests that may modify the user drop it from the cache, so that the next request reads its own writes """
+    user = g_context.get('current_user')
+    if user is not None and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        user_cache.invalidate(user._id)
+    return response
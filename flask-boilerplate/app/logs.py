@@ -20,10 +20,13 @@ class TaskFormatter(logging.Formatter):
         task = self.get_current_task()
         if task and task.request:
             record.__dict__.update(task_id=task.request.id,
-                                   task_name=task.name)
+                                   task_name=task.name,
+                                   # id of the web request the task originates from (app/tracing.py)
+                                   request_id=getattr(task.request, 'request_id', None) or '-')
         else:
             record.__dict__.setdefault('task_name', '')
             record.__dict__.setdefault('task_id', '')
+            record.__dict__.setdefault('request_id', '-')
         return super().format(record)
 
 
@@ -57,7 +60,7 @@ class ContextualFilterCelery(ContextualFilter):
 
 webapp_logger_format = '[%(utcnow)s][user:%(user_id)s][%(url)s %(method)s %(request_id)8.8s] ' \
                        '%(levelname)s - %(message)s'
-celery_logger_format = '[%(utcnow)s] Task %(task_name)s[%(task_id)s] %(levelname)s - %(message)s'
+celery_logger_format = '[%(utcnow)s] Task %(task_name)s[%(task_id)s][%(request_id)8.8s] %(levelname)s - %(message)s'
 
 
 webapp_logging_config = {
@@ -163,3 +166,7 @@ websocket_logging_config = {
         }
     }
 }
+
+# the change stream watcher and the outbox relay are plain processes logging to the console as well
+change_watcher_logging_config = websocket_logging_config
+outbox_relay_logging_config = websocket_logging_config
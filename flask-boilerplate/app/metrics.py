@@ -0,0 +1,227 @@
+"""
+Prometheus metrics of every process role: HTTP requests of the webapp, MongoDB commands, Redis and RabbitMQ publishes,
+Celery tasks (with their resource usage, see app/utils/task_usage.py) and websocket connections.
+
+Multi-process servers (gunicorn workers, celery prefork pool) aggregate the metrics of all their processes:
+PROMETHEUS_MULTIPROC_DIR must be set in the environment of the server (one empty directory per server, it is cleared
+when the server starts), each process writes its metrics there and the exposition reads all of them.
+Without it (development server, tests, websocket server) each process exposes its own metrics.
+Exposition: GET /metrics on the webapp and on the websocket server, an HTTP server on Config.WORKER_METRICS_PORT in
+the celery worker.
+The webapp hooks import Flask when called: the worker and websocket processes do not load it for their metrics.
+"""
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+from prometheus_client import (
+    CollectorRegistry, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+
+from config import Config
+
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR is not None:
+    # the metrics files of the process are created with the metrics
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# latencies of local calls (MongoDB commands, publishes) are mostly below the default buckets
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+# tasks last from milliseconds (events) to an hour (task_time_limit)
+TASK_BUCKETS = (.01, .05, .1, .5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# memory growth and transferred bytes of the tasks, 1 KiB to 1 GiB
+MEMORY_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(11))
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Duration of the HTTP requests of the webapp',
+    ['endpoint', 'method', 'status'],
+)
+MONGO_COMMAND_DURATION = Histogram(
+    'mongo_command_duration_seconds', 'Duration of the MongoDB commands (pymongo command monitoring)',
+    ['command', 'outcome'], buckets=FAST_BUCKETS,
+)
+REDIS_PUBLISH_DURATION = Histogram(
+    'redis_publish_duration_seconds', 'Duration of the Redis pub/sub publishes',
+    ['channel'], buckets=FAST_BUCKETS,
+)
+RABBITMQ_PUBLISH_DURATION = Histogram(
+    'rabbitmq_publish_duration_seconds', 'Duration of the RabbitMQ publishes',
+    ['exchange', 'routing_key'], buckets=FAST_BUCKETS,
+)
+CELERY_TASK_DURATION = Histogram(
+    'celery_task_duration_seconds', 'Run time of the Celery tasks',
+    ['task', 'state'], buckets=TASK_BUCKETS,
+)
+CELERY_TASK_QUEUE_WAIT = Histogram(
+    'celery_task_queue_wait_seconds', 'Time between the publication of the Celery tasks and their start',
+    ['task'], buckets=TASK_BUCKETS,
+)
+CELERY_TASK_CPU = Histogram(
+    'celery_task_cpu_seconds', 'CPU time of the Celery tasks',
+    ['task'], buckets=TASK_BUCKETS,
+)
+CELERY_TASK_RSS_GROWTH = Histogram(
+    'celery_task_rss_growth_bytes', 'Growth of the resident memory of the worker process during the Celery tasks',
+    ['task'], buckets=MEMORY_BUCKETS,
+)
+CELERY_TASK_MONGO_COMMANDS = Histogram(
+    'celery_task_mongo_commands', 'MongoDB commands issued by the Celery tasks',
+    ['task'], buckets=COUNT_BUCKETS,
+)
+CELERY_TASK_MONGO_BYTES = Histogram(
+    'celery_task_mongo_bytes', 'Bytes exchanged with MongoDB by the Celery tasks (BSON size of commands and replies)',
+    ['task', 'direction'], buckets=MEMORY_BUCKETS,
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    'websocket_connections', 'Open websocket connections', multiprocess_mode='livesum',
+)
+WEBSOCKET_FANOUT_LAG = Histogram(
+    'websocket_fanout_lag_seconds', 'Time between the publication of the events and their delivery to the clients',
+    ['type'], buckets=FAST_BUCKETS,
+)
+
+# header of the Celery task messages holding their publication time
+PUBLISHED_AT_HEADER = 'published_at'
+
+
+def channel_group(channel: str) -> str:
+    """ Channel name without its identifiers (e.g. changes:user:<user_id> -> changes:user), a bounded label value """
+    return ':'.join(channel.split(':')[:2])
+
+
+@contextmanager
+def observe(histogram: Histogram, **labels):
+    """ Observe the duration of the block, including when it raises """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def metrics_registry() -> CollectorRegistry:
+    """ Registry of the metrics of the current process, or of all the processes of the server in multiprocess mode """
+    if MULTIPROC_DIR is None:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_exposition() -> tuple:
+    """ Body and content type of a metrics scrape """
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
+
+
+def clear_multiproc_dir():
+    """ Remove the metrics of the previous runs of the server, to be called before its processes are started """
+    if MULTIPROC_DIR is not None:
+        shutil.rmtree(MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+
+def mark_process_dead(pid: int):
+    """ Drop the live gauges of a stopped process of the server """
+    if MULTIPROC_DIR is not None:
+        multiprocess.mark_process_dead(pid)
+
+
+# webapp
+
+def start_request_timer():
+    from flask import g as g_context
+    g_context.request_started = time.perf_counter()
+
+
+def observe_request(response):
+    from flask import request, g as g_context
+
+    started = g_context.get('request_started')
+    if started is not None:
+        HTTP_REQUEST_DURATION.labels(
+            # unmatched requests (404) share a label: their paths are unbounded
+            endpoint=request.endpoint or 'unmatched', method=request.method, status=response.status_code,
+        ).observe(time.perf_counter() - started)
+    return response
+
+
+def metrics_view():
+    from flask import Response
+
+    body, content_type = metrics_exposition()
+    return Response(body, content_type=content_type)
+
+
+def init_metrics(app):
+    app.before_request(start_request_timer)
+    app.after_request(observe_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
+
+
+# celery
+
+def stamp_task_message(headers: Optional[dict] = None, **kwargs):
+    if headers is not None:
+        headers.setdefault(PUBLISHED_AT_HEADER, time.time())
+
+
+def start_task_timer(task=None, **kwargs):
+    task.request.metrics_started = time.perf_counter()
+    published_at = getattr(task.request, PUBLISHED_AT_HEADER, None)
+    if published_at is not None:
+        CELERY_TASK_QUEUE_WAIT.labels(task=task.name).observe(max(time.time() - published_at, 0))
+
+
+def observe_task(task=None, state=None, **kwargs):
+    started = getattr(task.request, 'metrics_started', None)
+    if started is not None:
+        CELERY_TASK_DURATION.labels(task=task.name, state=state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+def start_worker_metrics_server(**kwargs):
+    from prometheus_client import start_http_server
+
+    clear_multiproc_dir()
+    start_http_server(Config.WORKER_METRICS_PORT, registry=metrics_registry())
+
+
+def stop_worker_process(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
+
+
+def init_celery_metrics():
+    """ Task metrics of the processes publishing and running tasks """
+    from celery import signals
+
+    signals.before_task_publish.connect(stamp_task_message, weak=False)
+    signals.task_prerun.connect(start_task_timer, weak=False)
+    signals.task_postrun.connect(observe_task, weak=False)
+
+
+def init_worker_metrics():
+    """ Metrics server of the celery worker, exposing the metrics of all the processes of its pool """
+    from celery import signals
+
+    signals.worker_init.connect(start_worker_metrics_server, weak=False)
+    signals.worker_process_shutdown.connect(stop_worker_process, weak=False)
+
+
+# websocket
+
+def observe_fanout(event: dict):
+    """ Delivery lag of an event published with an ISO timestamp (UTC) """
+    timestamp = event.get('timestamp')
+    if not isinstance(timestamp, str):
+        return
+    try:
+        published_at = datetime.fromisoformat(timestamp)
+    except ValueError:
+        return
+    WEBSOCKET_FANOUT_LAG.labels(type=event.get('type', 'unknown')).observe(
+        max((datetime.utcnow() - published_at).total_seconds(), 0)
+    )
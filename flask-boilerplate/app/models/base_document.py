@@ -10,6 +10,8 @@ class BaseDocument(db.Document):
     DoesNotExist: db.DoesNotExist
     meta = {
         'abstract': True,
+        # indexes are declared in app.indexes and created by an explicit migration step
+        'auto_create_index': False,
     }
 
     _id = db.StringField(primary_key=True)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from mongoengine import StringField, DateTimeField, DictField
+from mongoengine import StringField, DateTimeField, DictField, IntField
 
 from app.models.base_document import BaseDocument
 from app.models.user import User
@@ -20,7 +20,16 @@ class Report(BaseDocument):
     )
     
     created_at = DateTimeField(default=datetime.utcnow)
+    # set with the outbox message of the processing task, in the same transaction
+    queued_at = DateTimeField()
     completed_at = DateTimeField()
     
     result_data = DictField()
     error_message = StringField()
+
+    # hash of the report request, used to serve identical requests from the same report
+    fingerprint = StringField()
+
+    # chunked processing: partial results are checkpointed by chunk index until the report is completed
+    chunk_count = IntField()
+    checkpoints = DictField()
@@ -2,13 +2,14 @@ import re
 import random
 import string
 from datetime import datetime
-from typing import Union
+from typing import Optional, Union
 
 import bcrypt
 import mongoengine as db
 from mongoengine import EmbeddedDocument
 
 from app.models.base_document import BaseDocument
+from app import balance as balance_ledger
 
 
 def generate_random_token():
@@ -28,6 +29,7 @@ class UserDetails(EmbeddedDocument):
 
 
 class Balance(EmbeddedDocument):
+    # compacted balance: the recent top-ups and spends are in the balance ledger shards (see app/balance.py)
     amount = db.IntField(required=True, default=0)
     last_topup = db.DateTimeField(null=True)
 
@@ -79,6 +81,8 @@ class User(BaseDocument):
     # profile and contacts
     details: UserDetails = db.EmbeddedDocumentField(UserDetails, required=True)
     profile_picture = db.URLField(default=True, null=True)
+    # resized copies of the profile picture: {size: {format: url}}
+    profile_picture_variants = db.DictField(default=dict)
     contacts: Contacts = db.EmbeddedDocumentField(Contacts, required=True, default=Contacts)
     signup_date = db.DateTimeField(required=True, default=lambda: datetime.utcnow())
     last_login = db.DateTimeField(null=True)
@@ -110,18 +114,22 @@ class User(BaseDocument):
         if amount <= 0:
             raise ValueError('Invalid amount for topup_balance()')
 
-        modified = self.modify(inc__balance__amount=amount, set__balance__last_topup=datetime.utcnow())
-
-        if not modified:
-            raise db.errors.OperationError
+        balance_ledger.topup(self._id, amount)
 
     def spend_balance(self, amount: int):
+        """ Raises InsufficientBalanceError (an OperationError) if the balance does not cover the amount """
         if self._get_changed_fields():
             raise db.errors.OperationError
         if amount <= 0:
             raise ValueError('Invalid amount for spend_balance()')
 
-        modified = self.modify(inc__balance__amount=-amount)
-        
-        if not modified:
-            raise db.errors.OperationError
+        balance_ledger.spend(self._id, amount)
+
+    def current_balance(self) -> int:
+        """ Compacted balance plus the top-ups and spends not compacted yet """
+        return self.balance.amount + balance_ledger.shard_balances([self._id]).get(self._id, 0)
+
+    def last_topup(self) -> Optional[datetime]:
+        """ Date of the last top-up, including the top-ups not compacted yet """
+        pending_topup = balance_ledger.pending_last_topup(self._id)
+        return max(filter(None, [self.balance.last_topup, pending_topup]), default=None)
@@ -0,0 +1,181 @@
+"""
+Transactional outbox: messages for the brokers (Celery tasks, Redis pub/sub, RabbitMQ) are inserted in the outbox
+collection in the same MongoDB transaction as the domain write they result from, then delivered by the relay
+process (outbox_relay.py). A request only waits for its MongoDB commit, never for a broker.
+
+Delivery is at least once: a message is removed after its delivery, so a relay crash in between delivers it again.
+Consumers must tolerate duplicates (Celery tasks keep the task id of the message).
+Several relays can run side by side: each batch is leased to a single relay (claim_batch).
+Messages keep the trace context and the request id of their origin: the deliveries continue its trace.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+import orjson
+from pymongo.client_session import ClientSession
+
+from app.extensions import mongo_client, redis_client, celery, OUTBOX_COLL
+from app.metrics import observe, channel_group, REDIS_PUBLISH_DURATION, RABBITMQ_PUBLISH_DURATION
+from app.models.base_document import generate_unique_id
+from app.tracing import span, inject, current_traceparent, current_request_id, TRACEPARENT, REQUEST_ID
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def transaction() -> ClientSession:
+    """ MongoDB transaction, committed when the block exits without error (needs a replica set) """
+    with mongo_client.start_session() as session:
+        with session.start_transaction():
+            yield session
+
+
+def add_message(transport: str, destination: str, payload, session: ClientSession, **options) -> str:
+    """ Insert a message in the outbox, as part of the transaction of the session """
+    message_id = generate_unique_id()
+    OUTBOX_COLL.insert_one({
+        '_id': message_id,
+        'transport': transport,
+        'destination': destination,
+        'payload': payload,
+        'options': options,
+        'created_at': datetime.utcnow(),
+        'available_at': datetime.utcnow(),
+        'attempts': 0,
+        TRACEPARENT: current_traceparent(),
+        REQUEST_ID: current_request_id(),
+    }, session=session)
+    return message_id
+
+
+def add_task(task_name: str, session: ClientSession, args=None, kwargs=None, **options) -> str:
+    """ Send a Celery task through the outbox (options are those of apply_async, e.g. task_id) """
+    return add_message('celery', task_name, {'args': args or [], 'kwargs': kwargs or {}}, session, **options)
+
+
+def deliver_celery(message: dict):
+    # send_task resolves the route by name: the relay does not need to import the task modules
+    # the traceparent header is set from the delivery span (before_task_publish)
+    options = dict(message['options'])
+    if message.get(REQUEST_ID):
+        options['headers'] = {REQUEST_ID: message[REQUEST_ID], **options.get('headers', {})}
+    celery.send_task(message['destination'], **message['payload'], **options)
+
+
+def encode_event(payload) -> bytes:
+    """ Body of a Redis or RabbitMQ message, event envelopes carry the trace context of the delivery """
+    return orjson.dumps(inject(dict(payload)) if isinstance(payload, dict) else payload)
+
+
+def deliver_redis(message: dict):
+    with observe(REDIS_PUBLISH_DURATION, channel=channel_group(message['destination'])):
+        redis_client.publish(message['destination'], encode_event(message['payload']))
+
+
+class RabbitMQPublisher:
+    """ Blocking RabbitMQ publisher with publisher confirms: a message is delivered once the broker has it """
+
+    def __init__(self):
+        self._connection = None
+        self._channel = None
+
+    def __call__(self, message: dict):
+        import pika
+
+        if self._channel is None or self._channel.is_closed:
+            self._connection = pika.BlockingConnection(Config.FLASK_PIKA_PARAMS)
+            self._channel = self._connection.channel()
+            self._channel.confirm_delivery()
+
+        routing_key = message['options'].get('routing_key', '')
+        try:
+            with observe(RABBITMQ_PUBLISH_DURATION, exchange=message['destination'], routing_key=routing_key):
+                self._channel.basic_publish(
+                    exchange=message['destination'],
+                    routing_key=routing_key,
+                    body=encode_event(message['payload']),
+                    properties=pika.BasicProperties(delivery_mode=2, content_type='application/json',
+                                                    headers=inject({})),
+                    mandatory=True,
+                )
+        except Exception:
+            self._channel = None
+            raise
+
+
+DELIVERY: Dict[str, Callable[[dict], None]] = {
+    'celery': deliver_celery,
+    'redis': deliver_redis,
+    'rabbitmq': RabbitMQPublisher(),
+}
+
+
+def claim_batch(batch_size: int, now: datetime) -> list:
+    """
+    Lease the pending messages (oldest first) to the calling relay: concurrent relays never deliver the same message.
+    The lease ends with the delivery (message removed) or the retry (message postponed); the messages of a relay that
+    crashed in between are delivered again once their lease expired.
+    """
+    candidates = [message['_id'] for message in OUTBOX_COLL.find(
+        {'available_at': {'$lte': now}}, {'_id': 1}
+    ).sort('created_at', 1).limit(batch_size)]
+    if not candidates:
+        return []
+
+    # each document is updated atomically: a message still available is leased by a single relay
+    lease = generate_unique_id()
+    OUTBOX_COLL.update_many({'_id': {'$in': candidates}, 'available_at': {'$lte': now}}, {'$set': {
+        'available_at': now + timedelta(seconds=Config.OUTBOX_LEASE_DURATION),
+        'locked_by': lease,
+    }})
+    leased = OUTBOX_COLL.find({'_id': {'$in': candidates}, 'locked_by': lease})
+    messages = {message['_id']: message for message in leased}
+    return [messages[message_id] for message_id in candidates if message_id in messages]
+
+
+def relay_batch(batch_size: int = None) -> int:
+    """ Deliver the pending messages (oldest first), return the number of messages handled """
+    batch_size = batch_size or Config.OUTBOX_BATCH_SIZE
+    now = datetime.utcnow()
+    messages = claim_batch(batch_size, now)
+
+    delivered = []
+    for message in messages:
+        try:
+            with span(f'outbox {message["transport"]} {message["destination"]}', message.get(TRACEPARENT),
+                      'PRODUCER', message_id=message['_id'], attempts=message['attempts']):
+                DELIVERY[message['transport']](message)
+        except Exception as exc:
+            # retried with an exponential backoff, the other messages are not held back
+            attempts = message['attempts'] + 1
+            delay = min(Config.OUTBOX_RETRY_MAX_DELAY, 2 ** attempts)
+            logger.warning(f'outbox message {message["_id"]} ({message["transport"]} {message["destination"]}) '
+                           f'delivery failed, attempt {attempts}, retry in {delay}s: {exc}')
+            OUTBOX_COLL.update_one({'_id': message['_id']}, {'$set': {
+                'attempts': attempts,
+                'available_at': now + timedelta(seconds=delay),
+                'last_error': str(exc),
+            }, '$unset': {'locked_by': ''}})
+        else:
+            delivered.append(message['_id'])
+
+    if delivered:
+        OUTBOX_COLL.delete_many({'_id': {'$in': delivered}})
+    return len(messages)
+
+
+def relay_outbox(stop: Optional[threading.Event] = None):
+    """
+    Deliver the outbox messages until stop is set.
+    Full batches are followed by the next one right away, the outbox is polled when it is drained.
+    """
+    stop = stop or threading.Event()
+    logger.info('outbox relay started')
+    while not stop.is_set():
+        if relay_batch() < Config.OUTBOX_BATCH_SIZE:
+            stop.wait(Config.OUTBOX_POLL_INTERVAL)
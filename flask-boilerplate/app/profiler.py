@@ -0,0 +1,115 @@
+"""
+Opt-in per-request profiler of the webapp, cheap enough to stay installed in production.
+
+A request is profiled with cProfile when it carries a valid Application-Profile header (a short-lived token signed
+with the JWT secret, delivered to admins by POST /admin/profiler/token), or when its endpoint is sampled and the
+request is drawn (Config.PROFILER_SAMPLE_RATES). The profile is written in the pstats format to
+Config.PROFILER_DIR, named after the request id, and its file name is returned in the Application-Profile header.
+The directory keeps the last Config.PROFILER_MAX_FILES profiles:
+
+    python3 -m pstats /tmp/profiles/<file>.prof
+    snakeviz /tmp/profiles/<file>.prof
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+from datetime import datetime
+
+from flask import request, g as g_context
+from flask_log_request_id import current_request_id
+from itsdangerous import BadSignature, TimestampSigner
+
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'Application-Profile'
+# the request id may come from a request header: it is reduced to these characters in the profile file names
+UNSAFE_REQUEST_ID_CHARACTERS = re.compile(r'[^A-Za-z0-9_-]')
+
+signer = TimestampSigner(Config.JWT_SECRET_KEY, salt='profiler')
+
+
+def create_profile_token(user_id: str) -> str:
+    return signer.sign(user_id).decode()
+
+
+def valid_profile_token(token: str) -> bool:
+    try:
+        signer.unsign(token, max_age=Config.PROFILER_TOKEN_MAX_AGE)
+        return True
+    except BadSignature:
+        return False
+
+
+def should_profile() -> bool:
+    token = request.headers.get(PROFILE_HEADER)
+    if token is not None:
+        return valid_profile_token(token)
+
+    sample_rate = Config.PROFILER_SAMPLE_RATES.get(request.endpoint)
+    return sample_rate is not None and random.random() < sample_rate
+
+
+def start_profiler():
+    if not should_profile():
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # a single profiler can be active at a time in the process (Python 3.12+): a concurrent request of a threaded
+        # worker is being profiled already
+        logger.warning('Request not profiled: another request is being profiled')
+        return
+
+    g_context.profiler = profiler
+    request_id = UNSAFE_REQUEST_ID_CHARACTERS.sub('_', current_request_id() or '')[:64]
+    g_context.profile_file = f'{datetime.utcnow():%Y%m%dT%H%M%S}-{request.endpoint}-{request_id}.prof'
+
+
+def stop_profiler():
+    profiler = g_context.pop('profiler', None)
+    if profiler is None:
+        return None
+
+    profiler.disable()
+    os.makedirs(Config.PROFILER_DIR, exist_ok=True)
+    path = os.path.join(Config.PROFILER_DIR, g_context.profile_file)
+    profiler.dump_stats(path)
+    logger.info(f'Request profile written to {path}')
+    remove_old_profiles()
+    return g_context.profile_file
+
+
+def remove_old_profiles():
+    """ Keep the last Config.PROFILER_MAX_FILES profiles of the directory """
+    with os.scandir(Config.PROFILER_DIR) as entries:
+        profiles = [entry for entry in entries if entry.name.endswith('.prof') and entry.is_file()]
+    if len(profiles) <= Config.PROFILER_MAX_FILES:
+        return
+
+    profiles.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in profiles[:len(profiles) - Config.PROFILER_MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            # removed meanwhile by another worker
+            pass
+
+
+def append_profile_header(response):
+    profile_file = stop_profiler()
+    if profile_file is not None:
+        response.headers[PROFILE_HEADER] = profile_file
+    return response
+
+
+def init_profiler(app):
+    app.before_request(start_profiler)
+    app.after_request(append_profile_header)
+    app.teardown_request(lambda error: stop_profiler())
@@ -25,6 +25,12 @@ schema_login = load_schema('login.json')
 # user schemas
 schema_user_put = load_schema('user_put.json')
 schema_user_contacts_post = load_schema('user_contacts_post.json')
+schema_user_profile_picture_upload = load_schema('user_profile_picture_upload.json')
+
+# admin schemas
+schema_admin_users_status = load_schema('admin_users_status.json')
+schema_admin_users_role = load_schema('admin_users_role.json')
+schema_admin_users_credit = load_schema('admin_users_credit.json')
 
 # webhook schemas
 schema_webhook_alert_post = load_schema('webhook_alert_post.json')
@@ -0,0 +1,56 @@
+"""
+Observability scope of each Flask request and Celery task: its span (app/tracing.py) and the accounting of its
+MongoDB commands (app/utils/mongo_commands.py), opened and closed together by a single hook per scope.
+The span is opened first: the commands of the scope, up to the end of their accounting, belong to it.
+"""
+from app.tracing import (
+    start_request_span, end_request_span, append_trace_header, start_task_span, end_task_span, inject_task_headers,
+)
+from app.utils.mongo_commands import (
+    start_request_scope, end_request_scope, append_server_timing, start_task_scope, end_task_scope,
+)
+
+
+# Flask requests
+
+def start_request():
+    start_request_span()
+    start_request_scope()
+
+
+def end_request(response):
+    # Server-Timing and Application-Trace-Id headers
+    return append_trace_header(append_server_timing(response))
+
+
+def teardown_request(error: BaseException = None):
+    # requests failing with an unhandled exception skip the after_request handlers
+    end_request_scope()
+    end_request_span(error)
+
+
+def init_request_scope(app):
+    app.before_request(start_request)
+    app.after_request(end_request)
+    app.teardown_request(teardown_request)
+
+
+# Celery tasks
+
+def start_task(task=None, **kwargs):
+    start_task_span(task=task)
+    start_task_scope(task=task)
+
+
+def end_task(task=None, state=None, **kwargs):
+    end_task_scope(task=task)
+    end_task_span(task=task, state=state)
+
+
+def init_task_scope():
+    from celery import signals
+
+    # trace context and request id in the headers of the tasks published by the process
+    signals.before_task_publish.connect(inject_task_headers, weak=False)
+    signals.task_prerun.connect(start_task, weak=False)
+    signals.task_postrun.connect(end_task, weak=False)
@@ -0,0 +1,109 @@
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+
+class ServiceRegistry:
+    """
+    Registry of the clients of external services (S3, MongoDB, ...).
+    Each client is created by its factory on first use and cached for the current process only:
+    a forked child process (gunicorn/celery workers) creates its own clients instead of sharing the parent's ones,
+    and a process that never uses a service never pays for importing or configuring its client.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._per_process: Dict[str, bool] = {}
+        self._after_fork: Dict[str, Optional[Callable[[], None]]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+        # drop the clients inherited from the parent process in forked children
+        os.register_at_fork(after_in_child=self.reset)
+
+    def register(self, name: str, factory: Callable[[], Any], per_process: bool = True,
+                 after_fork: Callable[[], None] = None):
+        """
+        Register the factory creating the named service client.
+        Objects holding no connections (per_process=False) are created lazily as well, but survive forks.
+        Clients also referenced outside of the registry get an after_fork hook, called in the forked child if the
+        parent process used the client: it drops those references (it must not use or close the parent's client,
+        the child is not in a consistent state yet), the child's client is created on its first use.
+        """
+        with self._lock:
+            self._factories[name] = factory
+            self._per_process[name] = per_process
+            self._after_fork[name] = after_fork
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """ Return the named service client, creating it if it was not used in the current process yet """
+        # defensive check in case the fork hook was bypassed (e.g. a fork performed by a C extension)
+        if self._pid != os.getpid():
+            self.reset()
+
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if name not in self._instances:
+                try:
+                    factory = self._factories[name]
+                except KeyError:
+                    raise KeyError(f'service {name} is not registered') from None
+                self._instances[name] = factory()
+            return self._instances[name]
+
+    def is_initialized(self, name: str) -> bool:
+        if self._pid != os.getpid():
+            return not self._per_process[name] and name in self._instances
+        return name in self._instances
+
+    def reset(self):
+        """ Forget all the per-process service clients, they are created again on next use """
+        hooks = [self._after_fork[name] for name in self._instances if self._after_fork[name] is not None]
+        self._lock = threading.RLock()
+        self._instances = {
+            name: instance for name, instance in self._instances.items() if not self._per_process[name]
+        }
+        self._pid = os.getpid()
+
+        for hook in hooks:
+            hook()
+
+    def proxy(self, name: str) -> 'ServiceProxy':
+        """ Return a module-level stand-in for the service client that resolves it on every access """
+        return ServiceProxy(self, name)
+
+
+class ServiceProxy:
+    """ Forwards attribute and item access to a service client of the registry, resolved at access time """
+
+    __slots__ = ('_registry', '_name')
+
+    def __init__(self, registry: ServiceRegistry, name: str):
+        object.__setattr__(self, '_registry', registry)
+        object.__setattr__(self, '_name', name)
+
+    def _get_service(self):
+        return self._registry.get(self._name)
+
+    def __getattr__(self, attr):
+        return getattr(self._get_service(), attr)
+
+    def __getitem__(self, key):
+        return self._get_service()[key]
+
+    def __call__(self, *args, **kwargs):
+        return self._get_service()(*args, **kwargs)
+
+    def __repr__(self):
+        if self._registry.is_initialized(self._name):
+            return f'<ServiceProxy {self._name}: {self._get_service()!r}>'
+        return f'<ServiceProxy {self._name} (not initialized)>'
+
+
+services = ServiceRegistry()
@@ -1,2 +1,3 @@
+from app.tasks.media import generate_profile_picture_variants
 from app.tasks.report import process_report
-from app.tasks.user import disable_inactive_users
+from app.tasks.user import disable_inactive_users, compact_balances
@@ -0,0 +1,75 @@
+import io
+import os
+from typing import Iterator, List, Tuple
+
+from botocore.exceptions import ClientError
+from celery.utils.log import get_task_logger
+from PIL import Image, ImageOps
+
+from app import celery, MEDIA_BUCKET
+from app.models import User
+from config import Config
+
+
+logger = get_task_logger(__name__)
+
+# Pillow format name and mime type of the supported variant formats
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+def build_image_variants(content: bytes, sizes: List[int], formats: List[str]) -> Iterator[Tuple[int, str, bytes]]:
+    """ Yields (size, format, data) square thumbnails of the image for each of the requested sizes and formats """
+    with Image.open(io.BytesIO(content)) as image:
+        # apply the EXIF orientation, since it is not preserved by the re-encoding
+        image = ImageOps.exif_transpose(image)
+
+        for size in sizes:
+            thumbnail = ImageOps.fit(image, (size, size), method=Image.LANCZOS)
+
+            for variant_format in formats:
+                pil_format, _ = VARIANT_FORMATS[variant_format]
+                # JPEG has no alpha channel
+                variant = thumbnail.convert('RGB') if pil_format == 'JPEG' else thumbnail.convert('RGBA')
+
+                output = io.BytesIO()
+                variant.save(output, format=pil_format, quality=Config.PROFILE_PIC_VARIANT_QUALITY, optimize=True)
+                yield size, variant_format, output.getvalue()
+
+
+@celery.task(autoretry_for=(ClientError,), retry_backoff=True, max_retries=3)
+def generate_profile_picture_variants(user_id, resource_path, version):
+    """ Generate resized variants of a profile picture and store them next to the original """
+    profile_picture = f'{Config.MEDIA_BASE_URL}/{resource_path}?v={version}'
+    original = MEDIA_BUCKET.Object(resource_path).get()['Body'].read()
+
+    variants = {}
+    base_path = os.path.splitext(resource_path)[0]
+    for size, variant_format, data in build_image_variants(
+        original, Config.PROFILE_PIC_VARIANT_SIZES, Config.PROFILE_PIC_VARIANT_FORMATS
+    ):
+        # the version is part of the key, so the variants can be cached indefinitely by clients and CDNs
+        variant_path = f'{base_path}-{size}-{version}.{variant_format}'
+
+        MEDIA_BUCKET.put_object(
+            Key=variant_path,
+            Body=data,
+            ACL='public-read',
+            ContentType=VARIANT_FORMATS[variant_format][1],
+            CacheControl=Config.MEDIA_VARIANT_CACHE_CONTROL,
+            Metadata={'user': user_id}
+        )
+        variants.setdefault(str(size), {})[variant_format] = f'{Config.MEDIA_BASE_URL}/{variant_path}'
+
+    # the variants are discarded if the picture has been replaced in the meantime
+    updated = User.objects(_id=user_id, profile_picture=profile_picture).update_one(
+        set__profile_picture_variants=variants
+    )
+    if not updated:
+        logger.info(f'profile picture of user {user_id} changed, variants of version {version} discarded')
+        return {'status': 'discarded', 'user_id': user_id}
+
+    logger.info(f'generated {sum(len(v) for v in variants.values())} profile picture variants for user {user_id}')
+    return {'status': 'completed', 'user_id': user_id, 'variants': variants}
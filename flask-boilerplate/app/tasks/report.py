@@ -1,9 +1,13 @@
 import time
 from datetime import datetime
+from typing import Dict, List
+from celery import chord
 from celery.utils.log import get_task_logger
 
-from app import celery
+from app import celery, REPORTS_COLL
 from app.models import Report
+from app.utils.report_cache import cache_completed_report, release_report, refresh_report_claim
+from config import Config
 
 logger = get_task_logger(__name__)
 
@@ -14,40 +18,144 @@ def build_report(data):
     return data
 
 
+def split_report_data(data: Dict, chunk_size: int = None) -> List[Dict]:
+    """ Split the report input into chunks of at most chunk_size items """
+    if chunk_size is None:
+        chunk_size = Config.REPORT_CHUNK_SIZE
+
+    items = list(data.items())
+    if not items:
+        return [{}]
+    return [dict(items[i:i + chunk_size]) for i in range(0, len(items), chunk_size)]
+
+
+def merge_report_results(partial_results: List[Dict]) -> Dict:
+    """ Merge the partial results of the report chunks, in chunk order """
+    if len(partial_results) == 1:
+        return partial_results[0]
+
+    result_data = {}
+    for partial_result in partial_results:
+        result_data.update(partial_result)
+    return result_data
+
+
+def complete_report(report: Report, result_data: Dict):
+    report.status = 'completed'
+    report.completed_at = datetime.utcnow()
+    report.result_data = result_data
+    report.checkpoints = {}  # partial results are no longer needed once merged
+    report.save()
+
+    # identical requests are served from this report for REPORT_CACHE_TTL seconds
+    if report.fingerprint:
+        cache_completed_report(report.fingerprint, report._id)
+
+
+def fail_report(report: Report, error_message: str):
+    report.status = 'failed'
+    report.error_message = error_message
+    report.save()
+
+    if report.fingerprint:
+        release_report(report.fingerprint, report._id)
+
+
 @celery.task
 def process_report(task_data):
     """
-    Simple report processing task that saves results to database.
+    Report processing task that saves results to database.
+    Small inputs are built inline, larger ones are split into chunks and built in parallel
+    by a chord of build_report_chunk tasks, whose results are merged by finalize_report.
     """
     user_id = task_data['user_id']
     report_id = task_data['report_id']
-    data = {'foo': 'bar'}  # mock data
+    data = task_data.get('data') or {}
 
     # get the report record
     try:
         report: Report = Report.objects(_id=report_id).get()
         report.status = 'running'
+        report.error_message = None
         report.save()
     except Report.DoesNotExist:
         logger.error(f'Report {report_id} not found')
         return {'status': 'failed', 'error': 'Report not found'}
 
     logger.info(f'Processing report {report_id} for user {user_id}')
-        
+
+    chunks = split_report_data(data)
+
+    if len(chunks) > 1:
+        # chunks already checkpointed by a previous (failed) run are skipped by build_report_chunk
+        report.update(set__chunk_count=len(chunks))
+        chord(
+            build_report_chunk.s(report_id, index, chunk) for index, chunk in enumerate(chunks)
+        )(finalize_report.s(report_id).on_error(report_chord_failed.s(report_id)))
+
+        logger.info(f'Dispatched {len(chunks)} chunks for report {report_id}')
+        return {'status': 'running', 'report_id': report_id, 'chunks': len(chunks)}
+
     try:
         result_data = build_report(data)
     except Exception as exc:
         logger.error(f'Error building report: {str(exc)}')
-        report.status = 'failed'
-        report.error_message = str(exc)
-        report.save()
+        fail_report(report, str(exc))
         return {'status': 'failed', 'error': str(exc)}
-        
+
     # mark report as completed
-    report.status = 'completed'
-    report.completed_at = datetime.utcnow()
-    report.result_data = result_data
-    report.save()
+    complete_report(report, result_data)
 
     logger.info(f'Completed report processing for user {user_id}')
     return {'status': 'completed', 'report_id': report_id}
+
+
+@celery.task(bind=True, autoretry_for=(Exception,), retry_backoff=True, max_retries=Config.REPORT_CHUNK_MAX_RETRIES)
+def build_report_chunk(self, report_id, index, chunk):
+    """ Build a single report chunk and checkpoint its partial result on the report """
+    checkpoint_key = str(index)
+
+    # resume: a chunk completed by a previous attempt is not computed again
+    report = REPORTS_COLL.find_one({'_id': report_id}, {f'checkpoints.{checkpoint_key}': True, 'fingerprint': True})
+    if report is None:
+        # deleted meanwhile: nothing to retry, finalize_report skips the missing report
+        logger.error(f'Report {report_id} not found')
+        return None
+    # the report is still in progress: identical requests keep attaching to it
+    if report.get('fingerprint'):
+        refresh_report_claim(report['fingerprint'], report_id)
+    if checkpoint_key in report.get('checkpoints', {}):
+        logger.info(f'Chunk {index} of report {report_id} restored from checkpoint')
+        return report['checkpoints'][checkpoint_key]
+
+    partial_result = build_report(chunk)
+
+    REPORTS_COLL.update_one({'_id': report_id}, {'$set': {f'checkpoints.{checkpoint_key}': partial_result}})
+    logger.info(f'Checkpointed chunk {index} of report {report_id}')
+    return partial_result
+
+
+@celery.task
+def finalize_report(partial_results, report_id):
+    """ Chord callback: merge the partial results and mark the report as completed """
+    try:
+        report: Report = Report.objects(_id=report_id).get()
+    except Report.DoesNotExist:
+        logger.error(f'Report {report_id} not found')
+        return {'status': 'failed', 'error': 'Report not found'}
+
+    complete_report(report, merge_report_results(partial_results))
+
+    logger.info(f'Completed report {report_id} from {len(partial_results)} chunks')
+    return {'status': 'completed', 'report_id': report_id}
+
+
+@celery.task
+def report_chord_failed(request, exc, traceback, report_id):
+    """ Chord error callback: a chunk ran out of retries, checkpoints are kept for a later resume """
+    logger.error(f'Error building report {report_id}: {str(exc)}')
+    try:
+        report: Report = Report.objects(_id=report_id).get()
+    except Report.DoesNotExist:
+        return
+    fail_report(report, str(exc))
@@ -1,30 +1,108 @@
+import time
 from datetime import datetime, timedelta
 from celery.utils.log import get_task_logger
 
-from app import celery
-from app.models import User
+from app import celery, USERS_COLL, TASK_CHECKPOINTS_COLL
+from app.balance import compact_balance, users_to_compact
+from config import Config
 
 
 logger = get_task_logger(__name__)
 
 
 @celery.task
-def disable_inactive_users():
-    """ Disable users who have not logged in for a long time """
-    utc_now = datetime.utcnow()
-    inactivity_threshold = utc_now - timedelta(days=365)
-
-    # Use efficient bulk update to disable inactive users
-    # Only update users who are currently active and haven't logged in for 1+ year
-    disabled_count = User.objects(
-        last_login__lte=inactivity_threshold,
-        status='active'
-    ).update(
-        set__status='inactive',
-    )
-
-    logger.info(f'disabled {disabled_count} inactive users')
+def disable_inactive_users(batch_size=None, throttle=None):
+    """
+    Disable users who have not logged in for a long time.
+    Users are processed in batches ordered by (last_login, _id), served by the (status, last_login, _id) index.
+    The progress is checkpointed after each batch so that an interrupted run is resumed (with the same inactivity
+    threshold) by the next one.
+    """
+    batch_size = batch_size or Config.INACTIVE_USERS_BATCH_SIZE
+    throttle = Config.INACTIVE_USERS_BATCH_THROTTLE if throttle is None else throttle
+    checkpoint_id = disable_inactive_users.name
+
+    checkpoint = TASK_CHECKPOINTS_COLL.find_one({'_id': checkpoint_id})
+    if checkpoint:
+        logger.info(f'resuming from checkpoint: last user {checkpoint["last_id"]}, '
+                    f'{checkpoint["disabled_count"]} users already disabled')
+    else:
+        utc_now = datetime.utcnow()
+        checkpoint = {
+            '_id': checkpoint_id,
+            'started_at': utc_now,
+            'inactivity_threshold': utc_now - timedelta(days=365),
+            # position of the last user processed
+            'last_login': None,
+            'last_id': '',
+            'disabled_count': 0,
+            'batches': 0,
+        }
+        TASK_CHECKPOINTS_COLL.insert_one(checkpoint)
+
+    inactivity_threshold = checkpoint['inactivity_threshold']
+    inactive_filter = {'status': 'active', 'last_login': {'$lte': inactivity_threshold}}
+
+    while True:
+        batch_start = time.perf_counter()
+
+        # only users who are currently active and haven't logged in for 1+ year, after the last one processed
+        batch_filter = dict(inactive_filter)
+        if checkpoint.get('last_login') is not None:
+            batch_filter['$or'] = [
+                {'last_login': {'$gt': checkpoint['last_login']}},
+                {'last_login': checkpoint['last_login'], '_id': {'$gt': checkpoint['last_id']}},
+            ]
+        users = list(USERS_COLL.find(
+            batch_filter, {'_id': True, 'last_login': True}
+        ).sort([('last_login', 1), ('_id', 1)]).limit(batch_size))
+
+        if not users:
+            break
+        user_ids = [user['_id'] for user in users]
+
+        # the inactivity filter is repeated, users who logged in meanwhile are not disabled
+        result = USERS_COLL.update_many(
+            {**inactive_filter, '_id': {'$in': user_ids}},
+            {'$set': {'status': 'deactivated'}}
+        )
+
+        checkpoint['last_login'] = users[-1]['last_login']
+        checkpoint['last_id'] = users[-1]['_id']
+        checkpoint['disabled_count'] += result.modified_count
+        checkpoint['batches'] += 1
+        TASK_CHECKPOINTS_COLL.replace_one({'_id': checkpoint_id}, checkpoint)
+
+        logger.info(f'batch {checkpoint["batches"]}: disabled {result.modified_count}/{len(user_ids)} users '
+                    f'in {(time.perf_counter() - batch_start) * 1000:.1f} ms')
+
+        if len(user_ids) < batch_size:
+            break
+
+        # spread the write load over time
+        time.sleep(throttle)
+
+    # the run completed: the next one starts from scratch
+    TASK_CHECKPOINTS_COLL.delete_one({'_id': checkpoint_id})
+
+    duration = (datetime.utcnow() - checkpoint['started_at']).total_seconds()
+    logger.info(f'disabled {checkpoint["disabled_count"]} inactive users in {checkpoint["batches"]} batches '
+                f'({duration:.1f} s)')
     return {
-        'disabled_users': disabled_count,
-        'inactive_since': inactivity_threshold.strftime('%Y-%m-%d')
+        'disabled_users': checkpoint['disabled_count'],
+        'inactive_since': inactivity_threshold.strftime('%Y-%m-%d'),
+        'batches': checkpoint['batches'],
+        'duration_seconds': round(duration, 3)
     }
+
+
+@celery.task
+def compact_balances():
+    """ Move the balance ledger shards of every user with pending top-ups or spends into their Balance.amount """
+    started = time.perf_counter()
+    user_ids = users_to_compact()
+    for user_id in user_ids:
+        compact_balance(user_id)
+
+    logger.info(f'compacted the balance of {len(user_ids)} users')
+    return {'users': len(user_ids), 'duration_seconds': round(time.perf_counter() - started, 3)}
@@ -0,0 +1,303 @@
+"""
+Lightweight distributed tracing of the requests, tasks and events across the process roles.
+
+Trace context follows the W3C traceparent format. It is propagated in the traceparent header of the HTTP requests
+and of the Celery task messages (with the request_id of the web request), in the outbox messages, and in the
+envelope of the events published on Redis and RabbitMQ (traceparent field, AMQP header).
+Spans are recorded for the web requests, the Celery tasks, the MongoDB commands, the Redis and broker publishes and
+the websocket deliveries, and exported in the Zipkin v2 JSON format by a background thread of each process:
+appended to a JSON lines file (TRACING_EXPORTER=file) or posted to a collector accepting Zipkin spans
+(TRACING_EXPORTER=zipkin, e.g. Zipkin or Jaeger). Without exporter, the trace ids are still propagated.
+The spans of the MongoDB commands are recorded by the command listener of app/utils/mongo_commands.py.
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import List, Optional, Union
+
+import orjson
+
+from app.services import services
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = 'traceparent'
+# Celery header carrying the id of the web request (flask_log_request_id) the task originates from
+REQUEST_ID = 'request_id'
+TRACEPARENT_PATTERN = re.compile(r'00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})')
+
+# name of the process role in the exported spans (webapp, worker, websocket...)
+service_name = 'app'
+
+
+def set_service_name(name: str):
+    global service_name
+    service_name = name
+
+
+class Span:
+    """ A timed operation of a trace, exported when finished if the trace is sampled """
+
+    __slots__ = ('name', 'kind', 'trace_id', 'span_id', 'parent_id', 'sampled', 'start', 'duration', 'attributes')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, kind: str = None,
+                 attributes: dict = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start = time.time()
+        self.duration = None
+        self.attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+
+    @property
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-{"01" if self.sampled else "00"}'
+
+    @property
+    def recording(self) -> bool:
+        return self.sampled and bool(Config.TRACING_EXPORTER)
+
+    def set(self, **attributes):
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def finish(self, error: BaseException = None, duration: float = None):
+        if self.duration is not None:
+            return
+        self.duration = duration if duration is not None else time.time() - self.start
+        if error is not None:
+            self.attributes['error'] = f'{type(error).__name__}: {error}'
+        if self.recording:
+            services.get('trace_exporter').export(self)
+
+    def to_zipkin(self) -> dict:
+        span = {
+            'traceId': self.trace_id,
+            'id': self.span_id,
+            'name': self.name,
+            'timestamp': int(self.start * 1e6),
+            'duration': max(int(self.duration * 1e6), 1),
+            'localEndpoint': {'serviceName': service_name},
+            'tags': {key: str(value) for key, value in self.attributes.items()},
+        }
+        if self.parent_id:
+            span['parentId'] = self.parent_id
+        if self.kind:
+            span['kind'] = self.kind
+        return span
+
+
+current_span: ContextVar[Optional[Span]] = ContextVar('trace_span', default=None)
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Optional[tuple]:
+    """ (trace id, parent span id, sampled) of a traceparent header, None if missing or invalid """
+    match = TRACEPARENT_PATTERN.fullmatch(traceparent.strip().lower()) if traceparent else None
+    if match is None:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def start_span(name: str, parent: Union[Span, str, None] = None, kind: str = None, **attributes) -> Span:
+    """ Child span of the parent (a span or a traceparent), of the current span by default, or root of a new trace """
+    if parent is None:
+        parent = current_span.get()
+    if isinstance(parent, Span):
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, kind, attributes)
+
+    context = parse_traceparent(parent)
+    if context is not None:
+        return Span(name, *context, kind, attributes)
+    return Span(name, secrets.token_hex(16), None, random.random() < Config.TRACING_SAMPLE_RATE, kind, attributes)
+
+
+def activate(span: Span) -> Token:
+    return current_span.set(span)
+
+
+def deactivate(token: Token):
+    current_span.reset(token)
+
+
+@contextmanager
+def span(name: str, parent: Union[Span, str, None] = None, kind: str = None, **attributes):
+    """ Span of the block, current span within the block """
+    new_span = start_span(name, parent, kind, **attributes)
+    token = activate(new_span)
+    try:
+        yield new_span
+    except BaseException as error:
+        new_span.finish(error)
+        raise
+    finally:
+        new_span.finish()
+        deactivate(token)
+
+
+def current_traceparent() -> Optional[str]:
+    active_span = current_span.get()
+    return active_span.traceparent if active_span is not None else None
+
+
+def inject(event: dict) -> dict:
+    """ Add the trace context to the envelope of an event """
+    traceparent = current_traceparent()
+    if traceparent is not None:
+        event[TRACEPARENT] = traceparent
+    return event
+
+
+class SpanExporter:
+    """
+    Exports the finished spans of the process in batches, from a background thread (dropped when lagging).
+    Without background thread, the queued spans are only written by flush().
+    """
+
+    def __init__(self, background: bool = True):
+        self._queue = queue.Queue(maxsize=Config.TRACING_QUEUE_SIZE)
+        self._dropped = 0
+        if background:
+            threading.Thread(target=self._run, name='span-exporter', daemon=True).start()
+            atexit.register(self.flush)
+
+    def export(self, finished_span: Span):
+        try:
+            self._queue.put_nowait(finished_span)
+        except queue.Full:
+            self._dropped += 1
+
+    def _batch(self, timeout: Optional[float]) -> List[Span]:
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout))
+            while len(batch) < Config.TRACING_BATCH_SIZE:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._batch(timeout=None)
+            # wait for more spans, a batch per export interval at most
+            time.sleep(Config.TRACING_EXPORT_INTERVAL)
+            batch += self._batch(timeout=0)
+            self._write(batch)
+
+    def flush(self):
+        while batch := self._batch(timeout=0):
+            self._write(batch)
+
+    def _write(self, batch: List[Span]):
+        if not batch:
+            return
+        spans = [finished_span.to_zipkin() for finished_span in batch]
+        try:
+            if Config.TRACING_EXPORTER == 'file':
+                os.makedirs(os.path.dirname(Config.TRACING_FILE) or '.', exist_ok=True)
+                # a single append per batch: the lines of the processes sharing the file are not interleaved
+                with open(Config.TRACING_FILE, 'ab') as file:
+                    file.write(b''.join(orjson.dumps(zipkin_span) + b'\n' for zipkin_span in spans))
+            elif Config.TRACING_EXPORTER == 'zipkin':
+                import requests
+                requests.post(Config.TRACING_COLLECTOR_URL, json=spans, timeout=5).raise_for_status()
+        except Exception as error:
+            logger.warning(f'Failed to export {len(spans)} spans: {error}')
+
+        if self._dropped:
+            logger.warning(f'{self._dropped} spans dropped, the exporter is lagging')
+            self._dropped = 0
+
+
+services.register('trace_exporter', SpanExporter)
+
+
+# Flask requests
+
+def start_request_span():
+    from flask import request, g as g_context
+    from flask_log_request_id import current_request_id
+
+    # without traceparent header, the request starts a trace (never a child of the current span of the thread)
+    request_span = start_span(
+        f'{request.method} {request.endpoint or "unmatched"}', request.headers.get(TRACEPARENT, ''), 'SERVER',
+        **{'http.method': request.method, 'http.path': request.path, REQUEST_ID: current_request_id()}
+    )
+    g_context.trace_span = request_span
+    g_context.trace_token = activate(request_span)
+
+
+def end_request_span(error: BaseException = None, status_code: int = None) -> Optional[Span]:
+    from flask import g as g_context
+
+    token = g_context.pop('trace_token', None)
+    if token is None:
+        return None
+    request_span = g_context.pop('trace_span')
+    request_span.set(**{'http.status_code': status_code})
+    request_span.finish(error)
+    deactivate(token)
+    return request_span
+
+
+def append_trace_header(response):
+    request_span = end_request_span(status_code=response.status_code)
+    if request_span is not None:
+        response.headers['Application-Trace-Id'] = request_span.trace_id
+    return response
+
+
+# Celery tasks
+
+def current_request_id() -> Optional[str]:
+    """ Id of the web request at the origin of the current request or task """
+    from flask import has_request_context
+    from celery import current_task
+
+    if has_request_context():
+        from flask_log_request_id import current_request_id as flask_request_id
+        return flask_request_id()
+    if current_task and current_task.request:
+        return getattr(current_task.request, REQUEST_ID, None)
+    return None
+
+
+def inject_task_headers(headers: Optional[dict] = None, **kwargs):
+    if headers is None:
+        return
+    traceparent = current_traceparent()
+    if traceparent is not None:
+        headers.setdefault(TRACEPARENT, traceparent)
+    request_id = current_request_id()
+    if request_id is not None:
+        headers.setdefault(REQUEST_ID, request_id)
+
+
+def start_task_span(task=None, **kwargs):
+    task_span = start_span(
+        f'celery {task.name}', getattr(task.request, TRACEPARENT, None), 'CONSUMER',
+        task_id=task.request.id, **{REQUEST_ID: getattr(task.request, REQUEST_ID, None)}
+    )
+    task.request.trace_span = task_span
+    task.request.trace_token = activate(task_span)
+
+
+def end_task_span(task=None, state=None, **kwargs):
+    token = getattr(task.request, 'trace_token', None)
+    if token is not None:
+        task.request.trace_token = None
+        task.request.trace_span.set(state=state)
+        task.request.trace_span.finish()
+        deactivate(token)
@@ -0,0 +1,137 @@
+"""
+Bulk import of users from MongoDB dumps, for production migrations and test fixtures:
+
+    flask --app webapp users import users.bson
+
+The input is streamed in batches. Each batch is validated and completed with the User model defaults, with plain
+text passwords hashed (bcrypt, the bottleneck of the import) by a pool of worker processes, then inserted with an
+unordered insert_many: users already in the database (duplicate _id or phone number) are skipped and counted.
+"""
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import bson
+from bson.json_util import loads
+from mongoengine.errors import ValidationError, FieldDoesNotExist
+from pymongo.errors import BulkWriteError
+
+from app.extensions import USERS_COLL
+from app.models.user import User
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+# invalid users reported individually, the following ones are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+def read_documents(path: str) -> Iterator[dict]:
+    """
+    Documents of a BSON dump (mongodump .bson) or of a MongoDB extended JSON file: JSON lines (.jsonl, .ndjson)
+    are streamed, a JSON array is loaded at once.
+    """
+    path = Path(path)
+    if path.suffix == '.bson':
+        with open(path, 'rb') as file:
+            yield from bson.decode_file_iter(file)
+    elif path.suffix in ('.jsonl', '.ndjson'):
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    yield loads(line)
+    else:
+        with open(path) as file:
+            yield from loads(file.read())
+
+
+def batches(documents: Iterable[dict], batch_size: int) -> Iterator[List[dict]]:
+    documents = iter(documents)
+    while batch := list(islice(documents, batch_size)):
+        yield batch
+
+
+def prepare_users(documents: List[dict]) -> List[Tuple[Optional[dict], Optional[str]]]:
+    """ Users as saved by User.save(): (document, None), or (None, error) for an invalid user """
+    prepared = []
+    for document in documents:
+        try:
+            user = User(**document)
+            user.validate()  # User.clean() hashes plain text passwords
+            prepared.append((user.to_mongo().to_dict(), None))
+        except (ValidationError, FieldDoesNotExist, TypeError, ValueError) as error:
+            prepared.append((None, f'user {document.get("_id") or document.get("phone_number")}: {error}'))
+    return prepared
+
+
+def prepared_batches(documents: Iterable[dict], batch_size: int, workers: int) -> Iterator[list]:
+    """ prepare_users() of each batch, in input order, by at most 2 batches per worker ahead of the inserts """
+    if not workers:
+        yield from map(prepare_users, batches(documents, batch_size))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in batches(documents, batch_size):
+            pending.append(executor.submit(prepare_users, batch))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def insert_users(documents: List[dict], stats: dict):
+    try:
+        stats['inserted'] += len(USERS_COLL.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as error:
+        stats['inserted'] += error.details['nInserted']
+        for write_error in error.details['writeErrors']:
+            if write_error['code'] == DUPLICATE_KEY_ERROR:
+                stats['duplicates'] += 1
+            else:
+                stats['failed'] += 1
+                logger.error(f'user import: {write_error["errmsg"]}')
+
+
+def import_users(path: str, batch_size: int = None, workers: int = None, echo: Callable = logger.info) -> dict:
+    """
+    Import the users of the file, reporting the progress at most once per second.
+    workers is the number of password hashing processes (default: CPU count, 0: hashed by the current process).
+    """
+    batch_size = batch_size or Config.USER_IMPORT_BATCH_SIZE
+    workers = os.cpu_count() if workers is None else workers
+
+    stats = {'read': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0, 'failed': 0}
+    started = last_report = time.perf_counter()
+
+    def report():
+        elapsed = time.perf_counter() - started
+        echo(f'{stats["read"]} users read: {stats["inserted"]} inserted, {stats["duplicates"]} duplicates, '
+             f'{stats["invalid"]} invalid, {stats["failed"]} failed - {stats["read"] / max(elapsed, 1e-9):.0f} users/s')
+
+    for prepared in prepared_batches(read_documents(path), batch_size, workers):
+        stats['read'] += len(prepared)
+        for _, error in prepared:
+            if error is not None:
+                stats['invalid'] += 1
+                if stats['invalid'] <= MAX_REPORTED_ERRORS:
+                    echo(f'invalid {error}')
+
+        documents = [document for document, _ in prepared if document is not None]
+        if documents:
+            insert_users(documents, stats)
+
+        if time.perf_counter() - last_report >= 1:
+            report()
+            last_report = time.perf_counter()
+
+    report()
+    stats['duration_seconds'] = round(time.perf_counter() - started, 3)
+    return stats
@@ -0,0 +1,67 @@
+"""
+Document change events published by the change stream watcher (app/change_stream.py) on Redis pub/sub.
+Kept free of Flask and database imports: it is shared by the webapp, the workers and the websocket server.
+"""
+from datetime import datetime
+from typing import Optional
+
+
+# every change of a watched collection is published on its collection channel,
+# changes of documents owned by a user are published on the channel of the user as well
+COLLECTION_CHANGES_CHANNEL = 'changes:{collection}'
+USER_CHANGES_CHANNEL = 'changes:user:{user_id}'
+# liveness of the watcher: the subscribers cannot trust their caches when the heartbeats stop
+HEARTBEAT_CHANNEL = 'changes:heartbeat'
+
+CHANGE_EVENT_TYPE = 'document-change'
+# published when changes may have been missed (resume token lost), every cache has to be cleared
+RESET_EVENT_TYPE = 'changes-reset'
+
+# name of the field referencing the owner of the documents of each watched collection (None: the document itself)
+WATCHED_COLLECTIONS = {
+    'users': None,
+    'reports': 'user',
+}
+
+
+def change_event(change: dict) -> dict:
+    """ Event published for a change stream document (insert, update, replace or delete) """
+    collection = change['ns']['coll']
+    document_id = change['documentKey']['_id']
+
+    owner_field = WATCHED_COLLECTIONS.get(collection)
+    if owner_field is None:
+        user_id = document_id if collection == 'users' else None
+    else:
+        # deleted documents are not available anymore: their owner is unknown
+        user_id = (change.get('fullDocument') or {}).get(owner_field)
+
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'type': CHANGE_EVENT_TYPE,
+        'data': {
+            'collection': collection,
+            'operation': change['operationType'],
+            'document_id': str(document_id),
+            'user_id': str(user_id) if user_id is not None else None,
+            # only the names of the updated fields, never their values
+            'updated_fields': sorted(change.get('updateDescription', {}).get('updatedFields', {})),
+        },
+    }
+
+
+def change_channels(event: dict) -> list:
+    """ Redis channels an event is published on """
+    data = event['data']
+    channels = [COLLECTION_CHANGES_CHANNEL.format(collection=data['collection'])]
+    if data['user_id'] is not None:
+        channels.append(USER_CHANGES_CHANNEL.format(user_id=data['user_id']))
+    return channels
+
+
+def reset_event(reason: Optional[str] = None) -> dict:
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'type': RESET_EVENT_TYPE,
+        'data': {'reason': reason},
+    }
@@ -6,3 +6,9 @@ def str_to_bool(value: str):
         return False
     else:
         raise ValueError(f'Cannot parse "{value}" into bool')
+
+
+def str_to_float_dict(value: str):
+    # "key=0.5,other_key=1" -> {'key': 0.5, 'other_key': 1.0}
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    return {key.strip(): float(number) for key, number in (item.split('=', 1) for item in items)}
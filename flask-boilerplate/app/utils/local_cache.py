@@ -0,0 +1,126 @@
+"""
+Process-local caches of MongoDB documents kept coherent across processes by the change stream watcher.
+
+Entries are dropped when the watcher publishes a change of their document, instead of expiring after a TTL.
+A cache is bypassed whenever its invalidations may be missed: until the process is subscribed to the changes,
+while the Redis subscription is down and when the heartbeats of the watcher stop.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+import orjson
+from redis.exceptions import RedisError
+
+from app.extensions import redis_client
+from app.services import services
+from app.utils.changes import COLLECTION_CHANGES_CHANNEL, HEARTBEAT_CHANNEL, RESET_EVENT_TYPE
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+_caches = []
+
+
+class LocalCache:
+    """ Bounded LRU cache of the documents of a collection, keyed by document id """
+
+    def __init__(self, collection: str, max_size: int = None):
+        self.collection = collection
+        self.max_size = max_size or Config.LOCAL_CACHE_MAX_SIZE
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # incremented by every invalidation, a value loaded meanwhile may be stale and is not stored
+        self._generation = 0
+        _caches.append(self)
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """ Cached value of the key, loaded (and cached unless None) on a miss """
+        if not Config.LOCAL_CACHE_ENABLED or not services.get('change_listener').is_live():
+            return loader()
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            generation = self._generation
+
+        value = loader()
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = value
+                    if len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+class ChangeListener:
+    """ Subscribes the process to the change events of the cached collections (background thread) """
+
+    def __init__(self):
+        self._subscribed = False
+        self._last_heartbeat = 0
+        self._thread = threading.Thread(target=self._run, name='change-listener', daemon=True)
+        self._thread.start()
+
+    def is_live(self) -> bool:
+        """ Whether the caches receive their invalidations """
+        heartbeat_timeout = 3 * Config.CHANGE_STREAM_HEARTBEAT_INTERVAL
+        return self._subscribed and time.monotonic() - self._last_heartbeat < heartbeat_timeout
+
+    def _run(self):
+        channels = {COLLECTION_CHANGES_CHANNEL.format(collection=cache.collection) for cache in _caches}
+        while True:
+            try:
+                pubsub = redis_client.pubsub()
+                pubsub.subscribe(HEARTBEAT_CHANNEL, *channels)
+                for message in pubsub.listen():
+                    self._handle(message)
+            except RedisError as error:
+                logger.warning(f'change events subscription lost, local caches disabled: {error}')
+            # the changes published while not subscribed are lost
+            self._subscribed = False
+            for cache in _caches:
+                cache.clear()
+            time.sleep(1)
+
+    def _handle(self, message: dict):
+        if message['type'] == 'subscribe':
+            self._subscribed = True
+            return
+        if message['type'] != 'message':
+            return
+        if message['channel'] == HEARTBEAT_CHANNEL:
+            if not self.is_live():
+                # the watcher was down (or this process just subscribed): changes may have been missed
+                for cache in _caches:
+                    cache.clear()
+            self._last_heartbeat = time.monotonic()
+            return
+
+        event = orjson.loads(message['data'])
+        for cache in _caches:
+            if message['channel'] != COLLECTION_CHANGES_CHANNEL.format(collection=cache.collection):
+                continue
+            if event['type'] == RESET_EVENT_TYPE:
+                cache.clear()
+            else:
+                cache.invalidate(event['data']['document_id'])
+
+
+# one listener thread per process, started on first use of a cache (threads do not survive forks)
+services.register('change_listener', ChangeListener)
@@ -0,0 +1,178 @@
+"""
+Accounting of the MongoDB commands issued by each Flask request and Celery task (pymongo command monitoring).
+
+A single listener of the MongoDB client observes every command: its duration in the Prometheus metrics, its span in
+the traced requests and tasks (app/tracing.py), and its accounting in the scope of the current request or task.
+
+Commands are counted and timed in the scope of the current request or task: the requests get a Server-Timing
+header, and the scopes issuing more than Config.MONGODB_SCOPE_COMMANDS_WARNING commands (N+1 queries, redundant
+round-trips) are logged. Commands slower than Config.MONGODB_SLOW_COMMAND_MS are logged with the shape of their
+filter (the values are replaced by their type), whatever their scope.
+The bytes exchanged with MongoDB (BSON size of the commands and replies) are only measured for the task scopes when
+Config.TASK_MONGO_BYTES_ACCOUNTING is set: re-encoding every command and reply costs about as much CPU as the driver.
+They are part of the resource usage of the tasks (app/utils/task_usage.py).
+"""
+import logging
+import threading
+from contextvars import ContextVar, Token
+from typing import Any, Optional
+
+import bson
+from pymongo import monitoring
+
+from app.metrics import MONGO_COMMAND_DURATION
+from app.tracing import current_span, start_span
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+# commands and the field holding their filter
+FILTER_FIELDS = {
+    'find': 'filter', 'count': 'query', 'distinct': 'query', 'findAndModify': 'query',
+    'update': 'updates', 'delete': 'deletes',
+}
+
+
+class CommandStats:
+    """ Commands issued in a scope (request or task) """
+
+    def __init__(self, name: str, measure_bytes: bool = False):
+        self.name = name
+        self.count = 0
+        self.duration_ms = 0.0
+        self.measure_bytes = measure_bytes
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+current_stats: ContextVar[Optional[CommandStats]] = ContextVar('mongo_command_stats', default=None)
+
+
+def start_scope(name: str, measure_bytes: bool = False) -> Token:
+    return current_stats.set(CommandStats(name, measure_bytes))
+
+
+def end_scope(token: Token) -> CommandStats:
+    """ Close the scope (the enclosing one is restored) and log it if it issued too many commands """
+    stats = current_stats.get()
+    current_stats.reset(token)
+    if stats.count > Config.MONGODB_SCOPE_COMMANDS_WARNING:
+        logger.warning(f'{stats.name} issued {stats.count} MongoDB commands ({stats.duration_ms:.1f} ms)')
+    return stats
+
+
+def value_shape(value: Any) -> Any:
+    """ Keys and operators of a filter, with the values replaced by their type """
+    if isinstance(value, dict):
+        return {key: value_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [value_shape(item) for item in value[:1]] + (['...'] if len(value) > 1 else [])
+    return type(value).__name__
+
+
+def command_shape(command_name: str, command: dict) -> Any:
+    """ Shape of the filter of a command (of the first statement of bulk writes, of the pipeline of aggregates) """
+    if command_name == 'aggregate':
+        return value_shape(command.get('pipeline', []))
+    field = FILTER_FIELDS.get(command_name)
+    if field is None:
+        return None
+    command_filter = command.get(field)
+    if field in ('updates', 'deletes'):
+        command_filter = (command_filter or [{}])[0].get('q')
+    return value_shape(command_filter) if command_filter is not None else None
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Observes the duration of the commands, records their spans, counts and times them in the scope of the current
+    request or task, logs the slow commands
+    """
+
+    def __init__(self):
+        # commands in progress (with their span) by connection and request id, until their outcome is known
+        self._commands = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        command_span = None
+        parent = current_span.get()
+        if parent is not None and parent.recording:
+            command_span = start_span(
+                f'mongo {event.command_name}', parent, 'CLIENT',
+                collection=event.command.get(event.command_name), database=event.database_name,
+            )
+        with self._lock:
+            self._commands[(event.connection_id, event.request_id)] = (event.command, command_span)
+
+        stats = current_stats.get()
+        if stats is not None and stats.measure_bytes:
+            stats.bytes_sent += len(bson.encode(event.command))
+
+    def _finished(self, event, outcome: str, error: str = None):
+        with self._lock:
+            command, command_span = self._commands.pop((event.connection_id, event.request_id), (None, None))
+
+        MONGO_COMMAND_DURATION.labels(command=event.command_name, outcome=outcome).observe(
+            event.duration_micros / 1e6
+        )
+        if command_span is not None:
+            command_span.set(error=error)
+            command_span.finish(duration=event.duration_micros / 1e6)
+
+        duration_ms = event.duration_micros / 1000
+        stats = current_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.duration_ms += duration_ms
+            if stats.measure_bytes and getattr(event, 'reply', None) is not None:
+                stats.bytes_received += len(bson.encode(event.reply))
+
+        if duration_ms >= Config.MONGODB_SLOW_COMMAND_MS and command is not None:
+            collection = command.get(event.command_name)
+            logger.warning(
+                f'Slow MongoDB command {event.command_name} on {collection} ({outcome}, {duration_ms:.1f} ms) '
+                f'in {stats.name if stats else "no request or task"}: {command_shape(event.command_name, command)}'
+            )
+
+    def succeeded(self, event):
+        self._finished(event, 'succeeded')
+
+    def failed(self, event):
+        self._finished(event, 'failed', error=str(event.failure))
+
+
+# Flask requests
+
+def start_request_scope():
+    from flask import request, g as g_context
+    g_context.mongo_command_scope = start_scope(request.endpoint or 'unmatched')
+
+
+def end_request_scope():
+    from flask import g as g_context
+    token = g_context.pop('mongo_command_scope', None)
+    return end_scope(token) if token is not None else None
+
+
+def append_server_timing(response):
+    stats = end_request_scope()
+    if stats is not None:
+        response.headers.add('Server-Timing', f'mongo;dur={stats.duration_ms:.1f};desc="{stats.count} commands"')
+    return response
+
+
+# Celery tasks
+
+def start_task_scope(task=None, **kwargs):
+    task.request.mongo_command_scope = start_scope(task.name, measure_bytes=Config.TASK_MONGO_BYTES_ACCOUNTING)
+    # kept after the end of the scope, for the resource usage of the task
+    task.request.mongo_command_stats = current_stats.get()
+
+
+def end_task_scope(task=None, **kwargs):
+    token = getattr(task.request, 'mongo_command_scope', None)
+    if token is not None:
+        task.request.mongo_command_scope = None
+        end_scope(token)
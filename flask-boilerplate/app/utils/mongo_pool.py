@@ -0,0 +1,61 @@
+import threading
+from collections import defaultdict
+
+from pymongo import monitoring
+
+
+POOL_STATS = ['open', 'in_use', 'waiting', 'created', 'closed', 'checkout_failed', 'cleared']
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Connection pool statistics of the MongoClient of the current process, per server:
+    open/in_use/waiting are current values, the other ones are counters since the client was created.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: dict.fromkeys(POOL_STATS, 0))
+
+    def _update(self, address, **changes):
+        with self._lock:
+            stats = self._stats[f'{address[0]}:{address[1]}']
+            for name, change in changes.items():
+                stats[name] += change
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {server: dict(stats) for server, stats in self._stats.items()}
+
+    def pool_created(self, event):
+        self._update(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._update(event.address, cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event.address, open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event.address, open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._update(event.address, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event.address, waiting=-1, checkout_failed=1)
+
+    def connection_checked_out(self, event):
+        self._update(event.address, waiting=-1, in_use=1)
+
+    def connection_checked_in(self, event):
+        self._update(event.address, in_use=-1)
@@ -0,0 +1,29 @@
+import os
+import time
+import logging
+import resource
+
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss() -> int:
+    """ Highest resident set size of the current process so far, in bytes """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if os.uname().sysname == 'Darwin' else max_rss * 1024
+
+
+def current_rss() -> int:
+    """ Resident set size of the current process in bytes (peak RSS where /proc is not available) """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def log_startup(role: str, started: float):
+    """ Log the time spent by an application factory (started is a time.perf_counter value) and the process RSS """
+    logger.info(f'{role} app ready in {(time.perf_counter() - started) * 1000:.1f} ms - '
+                f'RSS {current_rss() / 1024 / 1024:.1f} MB')
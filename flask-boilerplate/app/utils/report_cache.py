@@ -0,0 +1,68 @@
+import hashlib
+from typing import Dict, Optional
+
+import orjson
+
+from app import redis_client
+from config import Config
+
+
+# redis key holding the id of the report computed for a given input fingerprint
+REPORT_CACHE_KEY = 'reports:dedup:{fingerprint}'
+
+# the entry is only changed if it still points at the report: it may have expired and been claimed by another one
+COMPARE_AND_EXPIRE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+COMPARE_AND_DELETE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def report_fingerprint(user_id: str, data: Dict) -> str:
+    """ Deterministic hash of a report request: same user and same input data produce the same fingerprint """
+    # keys are sorted so that the fingerprint does not depend on the order of the submitted fields
+    normalized = orjson.dumps({'user': user_id, 'data': data or {}}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(normalized).hexdigest()
+
+
+def claim_report(fingerprint: str, report_id: str) -> Optional[str]:
+    """
+    Atomically register report_id as the report computing the given fingerprint (single-flight).
+    Returns None if the claim succeeded, otherwise the id of the report already registered for the fingerprint.
+    """
+    key = REPORT_CACHE_KEY.format(fingerprint=fingerprint)
+
+    while True:
+        # in-flight claims expire, so a lost report never blocks new submissions
+        if redis_client.set(key, report_id, nx=True, ex=Config.REPORT_CLAIM_TTL):
+            return None
+
+        # the existing claim may expire between the two calls, in which case the claim is retried
+        claimed_report_id = redis_client.get(key)
+        if claimed_report_id is not None:
+            return claimed_report_id
+
+
+def refresh_report_claim(fingerprint: str, report_id: str):
+    """ Extend the claim of a report in progress by REPORT_CLAIM_TTL seconds """
+    key = REPORT_CACHE_KEY.format(fingerprint=fingerprint)
+    redis_client.register_script(COMPARE_AND_EXPIRE)(keys=[key], args=[report_id, Config.REPORT_CLAIM_TTL])
+
+
+def cache_completed_report(fingerprint: str, report_id: str):
+    """ Keep pointing the fingerprint at the completed report for REPORT_CACHE_TTL seconds """
+    key = REPORT_CACHE_KEY.format(fingerprint=fingerprint)
+    redis_client.register_script(COMPARE_AND_EXPIRE)(keys=[key], args=[report_id, Config.REPORT_CACHE_TTL])
+
+
+def release_report(fingerprint: str, report_id: str):
+    """ Drop the cache entry, e.g. after a failure, so the next identical submission is computed again """
+    key = REPORT_CACHE_KEY.format(fingerprint=fingerprint)
+    redis_client.register_script(COMPARE_AND_DELETE)(keys=[key], args=[report_id])
@@ -0,0 +1,29 @@
+import hashlib
+
+
+class FileTooLargeError(ValueError):
+    pass
+
+
+class HashingReader:
+    """
+    Read-only file-like wrapper that hashes the content and enforces a size limit while the stream is consumed,
+    so that a single pass over an upload stream is enough to validate it, hash it and forward it
+    """
+
+    def __init__(self, stream, max_size: int, hash_name: str = 'md5'):
+        self._stream = stream
+        self._hash = hashlib.new(hash_name)
+        self.max_size = max_size
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self._stream.read(size)
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise FileTooLargeError(f'stream exceeds the maximum size of {self.max_size} bytes')
+        self._hash.update(chunk)
+        return chunk
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
@@ -0,0 +1,166 @@
+"""
+Resource usage of each Celery task: wall time, CPU time, growth of the resident memory (current and peak RSS) of the
+worker process, MongoDB commands and, when Config.TASK_MONGO_BYTES_ACCOUNTING is set, bytes exchanged with MongoDB.
+
+The usage is observed in the Prometheus task metrics, stored by task id in the task_usage collection (expired after
+Config.TASK_USAGE_RETENTION_DAYS, joined to the reports by task_id) and logged when a task grows the RSS of its
+process by more than Config.TASK_RSS_GROWTH_WARNING_MB. A run is recorded when it starts: the runs killed before
+their end (hard time limit, OOM killer, lost worker) stay unfinished. task_usage_summary() (flask --app webapp tasks
+usage) aggregates it per task: the basis for the worker_max_tasks_per_child and worker_max_memory_per_child settings
+(Config.CELERY_WORKER_MAX_TASKS_PER_CHILD, Config.CELERY_WORKER_MAX_MEMORY_PER_CHILD) and for moving heavy or
+leaky tasks to their own queue.
+"""
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from pymongo.errors import PyMongoError
+
+from app.metrics import CELERY_TASK_CPU, CELERY_TASK_RSS_GROWTH, CELERY_TASK_MONGO_COMMANDS, CELERY_TASK_MONGO_BYTES
+from app.utils.process import current_rss, peak_rss
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskUsage:
+    """ Resource usage of a task, measured from its start """
+
+    def __init__(self):
+        self.started_at = datetime.utcnow()
+        self._wall = time.perf_counter()
+        # CPU time of the thread running the task: the other threads of the process are not accounted
+        self._cpu = time.thread_time()
+        self.rss = current_rss()
+        self._peak_rss = peak_rss()
+
+    def finish(self, stats=None) -> dict:
+        """ Usage since the start, with the MongoDB command stats of the task scope (app/utils/mongo_commands.py) """
+        rss = current_rss()
+        measured_bytes = stats is not None and stats.measure_bytes
+        return {
+            'started_at': self.started_at,
+            'finished_at': datetime.utcnow(),
+            'wall_seconds': round(time.perf_counter() - self._wall, 6),
+            'cpu_seconds': round(time.thread_time() - self._cpu, 6),
+            'rss_bytes': rss,
+            'rss_growth_bytes': rss - self.rss,
+            'peak_rss_growth_bytes': peak_rss() - self._peak_rss,
+            'mongo_commands': stats.count if stats else 0,
+            'mongo_ms': round(stats.duration_ms, 3) if stats else 0.0,
+            'mongo_bytes_sent': stats.bytes_sent if measured_bytes else None,
+            'mongo_bytes_received': stats.bytes_received if measured_bytes else None,
+        }
+
+
+def observe_usage(task_name: str, usage: dict):
+    CELERY_TASK_CPU.labels(task=task_name).observe(usage['cpu_seconds'])
+    # memory released by the task is not a growth
+    CELERY_TASK_RSS_GROWTH.labels(task=task_name).observe(max(usage['rss_growth_bytes'], 0))
+    CELERY_TASK_MONGO_COMMANDS.labels(task=task_name).observe(usage['mongo_commands'])
+    if usage['mongo_bytes_sent'] is not None:
+        CELERY_TASK_MONGO_BYTES.labels(task=task_name, direction='sent').observe(usage['mongo_bytes_sent'])
+        CELERY_TASK_MONGO_BYTES.labels(task=task_name, direction='received').observe(usage['mongo_bytes_received'])
+
+
+def store_usage(task_id: str, task_name: str, state: str, usage: dict, request_id: str = None):
+    """ Record the usage of a run, from its start (state STARTED) to its end """
+    from app.extensions import TASK_USAGE_COLL
+
+    try:
+        # retried tasks keep their id: the last run is kept
+        TASK_USAGE_COLL.replace_one({'_id': task_id}, {
+            '_id': task_id,
+            'task': task_name,
+            'state': state,
+            'hostname': socket.gethostname(),
+            'pid': os.getpid(),
+            'request_id': request_id,
+            **usage,
+        }, upsert=True)
+    except PyMongoError as e:
+        logger.warning(f'Failed to store the resource usage of task {task_name}[{task_id}]: {e}')
+
+
+# Celery tasks
+
+def start_task_usage(task=None, task_id=None, **kwargs):
+    task_usage = task.request.task_usage = TaskUsage()
+    if Config.TASK_USAGE_RETENTION_DAYS:
+        # replaced at the end of the run: the runs killed before (hard time limit, OOM killer) stay STARTED
+        store_usage(task_id or task.request.id, task.name, 'STARTED', {
+            'started_at': task_usage.started_at, 'rss_bytes': task_usage.rss,
+        }, getattr(task.request, 'request_id', None))
+
+
+def end_task_usage(task=None, task_id=None, state=None, **kwargs):
+    task_usage = getattr(task.request, 'task_usage', None)
+    if task_usage is None:
+        return
+    task.request.task_usage = None
+
+    usage = task_usage.finish(getattr(task.request, 'mongo_command_stats', None))
+    observe_usage(task.name, usage)
+
+    rss_growth = usage['rss_growth_bytes']
+    if rss_growth > Config.TASK_RSS_GROWTH_WARNING_MB * 2 ** 20:
+        logger.warning(
+            f'Task {task.name}[{task_id}] grew the worker RSS by {rss_growth / 2 ** 20:.1f} MB '
+            f'(to {usage["rss_bytes"] / 2 ** 20:.1f} MB, {usage["cpu_seconds"]:.2f}s CPU)'
+        )
+
+    if Config.TASK_USAGE_RETENTION_DAYS:
+        store_usage(task_id or task.request.id, task.name, state or 'UNKNOWN', usage,
+                    getattr(task.request, 'request_id', None))
+
+
+def revoke_task_usage(request=None, terminated=None, **kwargs):
+    """ Runs terminated by a revoke (sent in the worker main process) """
+    from app.extensions import TASK_USAGE_COLL
+
+    if not terminated or request is None or not Config.TASK_USAGE_RETENTION_DAYS:
+        return
+    try:
+        TASK_USAGE_COLL.update_one({'_id': request.id, 'state': 'STARTED'}, {'$set': {
+            'state': 'REVOKED', 'finished_at': datetime.utcnow(),
+        }})
+    except PyMongoError as e:
+        logger.warning(f'Failed to store the revoke of task {request.id}: {e}')
+
+
+def init_task_usage():
+    from celery import signals
+
+    signals.task_prerun.connect(start_task_usage, weak=False)
+    signals.task_postrun.connect(end_task_usage, weak=False)
+    signals.task_revoked.connect(revoke_task_usage, weak=False)
+
+
+def task_usage_summary(days: int = 1) -> List[dict]:
+    """ Resource usage per task over the last days: runs, failures, averages and maximums """
+    from app.extensions import TASK_USAGE_COLL
+
+    return list(TASK_USAGE_COLL.aggregate([
+        {'$match': {'started_at': {'$gte': datetime.utcnow() - timedelta(days=days)}}},
+        {'$group': {
+            '_id': '$task',
+            'runs': {'$sum': 1},
+            'failures': {'$sum': {'$cond': [{'$eq': ['$state', 'FAILURE']}, 1, 0]}},
+            # killed (hard time limit, OOM killer), lost or still running
+            'unfinished': {'$sum': {'$cond': [{'$eq': ['$state', 'STARTED']}, 1, 0]}},
+            'avg_wall_seconds': {'$avg': '$wall_seconds'},
+            'avg_cpu_seconds': {'$avg': '$cpu_seconds'},
+            'max_cpu_seconds': {'$max': '$cpu_seconds'},
+            'avg_rss_growth_bytes': {'$avg': '$rss_growth_bytes'},
+            'max_rss_growth_bytes': {'$max': '$rss_growth_bytes'},
+            'max_peak_rss_growth_bytes': {'$max': '$peak_rss_growth_bytes'},
+            'max_rss_bytes': {'$max': '$rss_bytes'},
+            'avg_mongo_commands': {'$avg': '$mongo_commands'},
+            'avg_mongo_bytes': {'$avg': {'$add': ['$mongo_bytes_sent', '$mongo_bytes_received']}},
+        }},
+        {'$sort': {'avg_cpu_seconds': -1}},
+    ]))
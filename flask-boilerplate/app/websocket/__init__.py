@@ -1,10 +1,30 @@
+import time
+
 from app.websocket.events import events_websocket_endpoint
+from app.utils.process import log_startup
+from app.tracing import set_service_name
 
 from starlette.applications import Starlette
-from starlette.routing import WebSocketRoute
+from starlette.responses import Response
+from starlette.routing import Route, WebSocketRoute
+
+
+async def metrics_endpoint(request):
+    from app.metrics import metrics_exposition
+
+    body, content_type = metrics_exposition()
+    return Response(body, media_type=content_type)
 
 
 def create_app():
-    return Starlette(
-        routes=[WebSocketRoute('/ws', events_websocket_endpoint)]
+    """ Application factory of the websocket role - Starlette only, the Flask app package is never initialized """
+    started = time.perf_counter()
+    set_service_name('websocket')
+    app = Starlette(
+        routes=[
+            WebSocketRoute('/ws', events_websocket_endpoint),
+            Route('/metrics', metrics_endpoint),
+        ]
     )
+    log_startup('websocket', started)
+    return app
@@ -7,6 +7,8 @@ from starlette.websockets import WebSocket, WebSocketState
 
 from app.websocket.jwt import websocket_auth
 from app.websocket.utils import pubsub_listener, websocket_listener
+from app.utils.changes import USER_CHANGES_CHANNEL
+from app.metrics import WEBSOCKET_CONNECTIONS
 from config import Config
 
 logger = logging.getLogger(__name__)
@@ -37,21 +39,27 @@ async def events_websocket_endpoint(websocket: WebSocket, user_id: str):
     # subscribe to general events channel
     # clients can subscribe to specific channels based on their needs
     events_channel = 'events:event'
+    # live updates: changes of the user and of the documents they own (e.g. report status)
+    changes_channel = USER_CHANGES_CHANNEL.format(user_id=user_id)
     
-    await redis_pubsub.subscribe(events_channel)
+    await redis_pubsub.subscribe(events_channel, changes_channel)
     await websocket.accept()
+    WEBSOCKET_CONNECTIONS.inc()
     
     logger.info(f'User {user_id} connected to events websocket')
 
     # sender task relays events from redis pub/sub to websocket client
     # listener task waits for client disconnection
     sender = asyncio.create_task(
-        pubsub_listener(redis_pubsub, process_event_message, events_channel, websocket)
+        pubsub_listener(redis_pubsub, process_event_message, f'{events_channel}, {changes_channel}', websocket)
     )
     listener = asyncio.create_task(websocket_listener(websocket))
 
-    # wait for client disconnection
-    await listener
+    # wait for client disconnection (the gauge is decremented when the endpoint fails or is cancelled as well)
+    try:
+        await listener
+    finally:
+        WEBSOCKET_CONNECTIONS.dec()
 
     # cleanup: cancel sender task if still running
     sender.cancel()
@@ -61,7 +69,7 @@ async def events_websocket_endpoint(websocket: WebSocket, user_id: str):
         await websocket.close()
 
     # cleanup: unsubscribe and close Redis connection
-    await redis_pubsub.unsubscribe(events_channel)
+    await redis_pubsub.unsubscribe(events_channel, changes_channel)
     await redis_pubsub.close()
 
     logger.info(f'Closed events websocket for user {user_id}')
@@ -3,6 +3,9 @@ from redis.client import PubSub
 from starlette.websockets import WebSocket, WebSocketDisconnect
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
 
+from app.metrics import observe_fanout
+from app.tracing import span, TRACEPARENT
+
 import logging
 
 logger = logging.getLogger(__name__)
@@ -37,7 +40,10 @@ async def pubsub_listener(
             response = await callback(payload)
             
             if response:
-                await websocket.send_json(response)
+                # delivery span in the trace of the publisher of the event
+                with span('websocket send', response.get(TRACEPARENT), 'PRODUCER', channel=channel_id):
+                    await websocket.send_json(response)
+                observe_fanout(response)
 
         except (WebSocketDisconnect, ConnectionClosedOK, ConnectionClosedError) as exc:
             logger.info(f'websocket disconnected for channel {channel_id} - {exc}: {message}')
@@ -1,15 +1,21 @@
 import logging.config
-from celery.schedules import crontab
+from datetime import timedelta
+from celery.schedules import crontab, schedule
 from celery.signals import after_setup_task_logger
 
-from app import create_app
+from app import create_worker_app
 from app import celery
-from app.tasks import disable_inactive_users
+from app.tasks import disable_inactive_users, compact_balances
 from app.logs import logging_config_celery
+from app.metrics import init_worker_metrics
+from config import Config
 
-app = create_app()
+app = create_worker_app()
 app.app_context().push()
 
+# metrics of the tasks run by the pool processes, served on Config.WORKER_METRICS_PORT by the main process
+init_worker_metrics()
+
 
 # configure application logging
 def initialize_logging(logger=None, loglevel=logging.INFO, **kwargs):
@@ -28,6 +34,14 @@ def setup_scheduled_tasks(sender, **kwargs):
         name='disable_inactive_users'
     )
 
+    # move the balance ledger shards into the user balances
+    sender.add_periodic_task(
+        # not a crontab: intervals of 60 minutes or more are not valid minute steps
+        schedule(timedelta(minutes=Config.BALANCE_COMPACTION_INTERVAL)),
+        compact_balances.s(),
+        name='compact_balances'
+    )
+
 
 if __name__ == '__main__':
     argv = [
@@ -0,0 +1,16 @@
+import logging.config
+
+from app import create_worker_app
+from app.change_stream import watch_changes
+from app.logs import change_watcher_logging_config
+
+# configure application logging
+logging.config.dictConfig(change_watcher_logging_config)
+
+# the watcher only needs the data layer (MongoDB and Redis), like the celery workers
+app = create_worker_app(role='change-watcher')
+app.app_context().push()
+
+
+if __name__ == '__main__':
+    watch_changes()
@@ -2,7 +2,7 @@ import os
 from datetime import datetime, timedelta
 import pika
 
-from app.utils.helpers import str_to_bool
+from app.utils.helpers import str_to_bool, str_to_float_dict
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -25,15 +25,101 @@ class Config(object):
     # celery queues
     REPORT_CELERY_QUEUE = os.environ['REPORT_CELERY_QUEUE']
 
+    # report processing - inputs larger than one chunk are built in parallel by a celery chord
+    REPORT_CHUNK_SIZE = int(os.getenv('REPORT_CHUNK_SIZE', 100))
+    REPORT_CHUNK_MAX_RETRIES = int(os.getenv('REPORT_CHUNK_MAX_RETRIES', 3))
+    # identical report requests (same user and input) are served from the completed report within this time
+    REPORT_CACHE_TTL = int(os.getenv('REPORT_CACHE_TTL', 15 * 60))  # seconds
+    # a report in progress keeps its claim this long, refreshed by each of its chunks (seconds)
+    REPORT_CLAIM_TTL = int(os.getenv('REPORT_CLAIM_TTL', 2 * 60 * 60))
+
+    # recycling of the celery pool processes (unset: never), see the task usage summary (flask --app webapp tasks usage)
+    CELERY_WORKER_MAX_TASKS_PER_CHILD = int(os.getenv('CELERY_WORKER_MAX_TASKS_PER_CHILD', 0)) or None
+    # resident memory above which a pool process is replaced after its current task, in kilobytes
+    CELERY_WORKER_MAX_MEMORY_PER_CHILD = int(os.getenv('CELERY_WORKER_MAX_MEMORY_PER_CHILD', 0)) or None
+    # resource usage of the tasks (app/utils/task_usage.py) - kept this many days in the task_usage collection
+    # (0: not stored, metrics only), tasks growing the worker RSS by more than the warning are logged
+    TASK_USAGE_RETENTION_DAYS = int(os.getenv('TASK_USAGE_RETENTION_DAYS', 7))
+    TASK_RSS_GROWTH_WARNING_MB = float(os.getenv('TASK_RSS_GROWTH_WARNING_MB', 50))
+    # BSON size of the MongoDB commands and replies of the tasks - re-encodes them, for investigations only
+    TASK_MONGO_BYTES_ACCOUNTING = str_to_bool(os.getenv('TASK_MONGO_BYTES_ACCOUNTING', 'false'))
+
+    # user balances - top-ups and spends are spread over this many counter documents per user (app/balance.py)
+    # and moved into the user balance by the compact_balances task every BALANCE_COMPACTION_INTERVAL minutes
+    BALANCE_SHARDS = int(os.getenv('BALANCE_SHARDS', 4))
+    BALANCE_COMPACTION_INTERVAL = int(os.getenv('BALANCE_COMPACTION_INTERVAL', 5))
+    # admin bulk balance credits: users credited per transaction
+    ADMIN_BULK_BATCH_SIZE = int(os.getenv('ADMIN_BULK_BATCH_SIZE', 1000))
+    # bulk user import (flask --app webapp users import): users validated and inserted per batch
+    USER_IMPORT_BATCH_SIZE = int(os.getenv('USER_IMPORT_BATCH_SIZE', 1000))
+
+    # disable_inactive_users task - users are disabled in batches, pausing between batches (seconds)
+    INACTIVE_USERS_BATCH_SIZE = int(os.getenv('INACTIVE_USERS_BATCH_SIZE', 1000))
+    INACTIVE_USERS_BATCH_THROTTLE = float(os.getenv('INACTIVE_USERS_BATCH_THROTTLE', 0.1))
+
     # application database - MongoDB
-    # PyMongo config
+    # a single MongoClient per process is shared by MongoEngine and the raw pymongo collections
     MONGODB_URI = os.environ['MONGODB_URI']
-    # Flask-MongoEngine config
-    MONGODB_SETTINGS = {
-        'HOST': MONGODB_URI,
-        'DB': 'webapp',
-        'CONNECT': False
+    MONGODB_DB = os.getenv('MONGODB_DB', 'webapp')
+    # pool size is per process: the cluster sees (processes x MONGODB_MAX_POOL_SIZE) connections at most
+    MONGODB_CLIENT_OPTIONS = {
+        'maxPoolSize': int(os.getenv('MONGODB_MAX_POOL_SIZE', 50)),
+        'minPoolSize': int(os.getenv('MONGODB_MIN_POOL_SIZE', 0)),
+        'maxIdleTimeMS': int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', 5 * 60 * 1000)),
+        # time a request waits for a free connection of the pool before failing
+        'waitQueueTimeoutMS': int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+        'connectTimeoutMS': int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', 5000)),
+        'socketTimeoutMS': int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', 30000)),
+        'serverSelectionTimeoutMS': int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+        # wire compression, in order of preference (zstd and snappy need the zstandard/python-snappy packages)
+        'compressors': os.getenv('MONGODB_COMPRESSORS', 'zlib'),
     }
+    # commands slower than this are logged with the shape of their filter (milliseconds)
+    MONGODB_SLOW_COMMAND_MS = float(os.getenv('MONGODB_SLOW_COMMAND_MS', 100))
+    # requests and tasks issuing more commands than this are logged (N+1 queries, redundant round-trips)
+    MONGODB_SCOPE_COMMANDS_WARNING = int(os.getenv('MONGODB_SCOPE_COMMANDS_WARNING', 20))
+    # heavy reads that tolerate stale data (admin listings, report history, counts) are served by the secondaries
+    # of the replica set when one is lagging less than this (seconds, 90 at least), by the primary otherwise
+    # NOTE: MONGODB_URI must name the replica set (?replicaSet=rs0), a direct connection sends every read to one node
+    MONGODB_READ_MAX_STALENESS = int(os.getenv('MONGODB_READ_MAX_STALENESS', 90))
+
+    # change stream watcher (change_watcher.py) - publishes the changes of users and reports on Redis pub/sub
+    CHANGE_STREAM_TOKEN_SAVE_INTERVAL = float(os.getenv('CHANGE_STREAM_TOKEN_SAVE_INTERVAL', 1))  # seconds
+    CHANGE_STREAM_HEARTBEAT_INTERVAL = float(os.getenv('CHANGE_STREAM_HEARTBEAT_INTERVAL', 5))  # seconds
+    # process-local caches of documents invalidated by the change events, only enable with the watcher running
+    LOCAL_CACHE_ENABLED = str_to_bool(os.getenv('LOCAL_CACHE_ENABLED', 'false'))
+    LOCAL_CACHE_MAX_SIZE = int(os.getenv('LOCAL_CACHE_MAX_SIZE', 10000))  # entries per collection
+
+    # transactional outbox relay (outbox_relay.py) - delivers the messages written with the domain changes
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+    OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 0.2))  # seconds, when the outbox is drained
+    OUTBOX_RETRY_MAX_DELAY = int(os.getenv('OUTBOX_RETRY_MAX_DELAY', 5 * 60))  # seconds
+    # messages leased by a relay are delivered by another one after this time if the relay crashed (seconds)
+    OUTBOX_LEASE_DURATION = int(os.getenv('OUTBOX_LEASE_DURATION', 60))
+
+    # per-request profiler (app/profiler.py) - requests carrying a token of POST /admin/profiler/token are profiled,
+    # as well as a random fraction of the requests of the sampled endpoints, e.g. "report.reports_list=0.01"
+    PROFILER_SAMPLE_RATES = str_to_float_dict(os.getenv('PROFILER_SAMPLE_RATES', ''))
+    PROFILER_TOKEN_MAX_AGE = int(os.getenv('PROFILER_TOKEN_MAX_AGE', 10 * 60))  # seconds
+    PROFILER_DIR = os.getenv('PROFILER_DIR', '/tmp/profiles')
+    # the oldest profiles are removed beyond this number of files
+    PROFILER_MAX_FILES = int(os.getenv('PROFILER_MAX_FILES', 100))
+
+    # Prometheus metrics (app/metrics.py) - port of the metrics server of the celery worker
+    # the webapp and the websocket server expose theirs on GET /metrics
+    WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', 9808))
+
+    # tracing (app/tracing.py) - spans exported to a JSON lines file ('file'), to a Zipkin-compatible collector
+    # ('zipkin') or not at all (''): the trace context is propagated and logged in every case
+    TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', '')
+    TRACING_FILE = os.getenv('TRACING_FILE', '/tmp/traces/spans.jsonl')
+    TRACING_COLLECTOR_URL = os.getenv('TRACING_COLLECTOR_URL', 'http://localhost:9411/api/v2/spans')
+    # fraction of the new traces (requests without traceparent header) that are exported
+    TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', 1))
+    TRACING_EXPORT_INTERVAL = float(os.getenv('TRACING_EXPORT_INTERVAL', 1))  # seconds
+    TRACING_BATCH_SIZE = int(os.getenv('TRACING_BATCH_SIZE', 500))
+    # spans waiting for export, further spans are dropped
+    TRACING_QUEUE_SIZE = int(os.getenv('TRACING_QUEUE_SIZE', 10000))
 
     # JWT sessions database - Redis
     REDIS_EVENTS_URL = os.environ['REDIS_EVENTS_URL']
@@ -46,6 +132,9 @@ class Config(object):
             password=os.environ['FLASK_PIKA_PASSWORD']
         ) if os.environ.get('FLASK_PIKA_USERNAME', None) else pika.ConnectionParameters._DEFAULT
     )
+    # declare exchanges and queues when the webapp starts (skipped if unchanged since the last declaration)
+    # set to false in production and run "flask --app webapp rabbitmq declare" once per deploy instead
+    RABBITMQ_DECLARE_ON_STARTUP = str_to_bool(os.getenv('RABBITMQ_DECLARE_ON_STARTUP', 'true'))
 
     # media bucket (S3)
     MEDIA_BUCKET_ACCESS_KEY = os.environ['MEDIA_BUCKET_ACCESS_KEY']
@@ -89,6 +178,12 @@ class Config(object):
     PROFILE_PIC_ALLOWED_EXTENSIONS = ['.jpeg', '.jpg', '.png']
     PROFILE_PIC_ALLOWED_MIMETYPES = ['image/jpeg', 'image/png']
     PROFILE_PIC_MAX_SIZE = 200 * 1024  # 200 kB
+    PROFILE_PIC_UPLOAD_URL_EXPIRES = 300  # seconds - validity of presigned direct uploads
+    # resized variants generated in background after each upload
+    PROFILE_PIC_VARIANT_SIZES = [64, 128, 256]  # pixels (square)
+    PROFILE_PIC_VARIANT_FORMATS = ['webp', 'jpeg']
+    PROFILE_PIC_VARIANT_QUALITY = 80
+    MEDIA_VARIANT_CACHE_CONTROL = 'public, max-age=31536000, immutable'  # 1 year, variant keys are versioned
 
     # ---------------------------------------------------------
 
@@ -0,0 +1,20 @@
+"""
+Gunicorn settings of the webapp in production: gunicorn webapp:app
+The Prometheus metrics of the workers are aggregated through PROMETHEUS_MULTIPROC_DIR (see app/metrics.py).
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+raw_env = [f"PROMETHEUS_MULTIPROC_DIR={os.getenv('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-webapp')}"]
+
+
+def on_starting(server):
+    from app.metrics import clear_multiproc_dir
+    clear_multiproc_dir()
+
+
+def child_exit(server, worker):
+    from app.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -0,0 +1,16 @@
+import logging.config
+
+from app import create_worker_app
+from app.outbox import relay_outbox
+from app.logs import outbox_relay_logging_config
+
+# configure application logging
+logging.config.dictConfig(outbox_relay_logging_config)
+
+# the relay only needs the data layer (MongoDB and Redis) and the Celery app, like the celery workers
+app = create_worker_app(role='outbox-relay')
+app.app_context().push()
+
+
+if __name__ == '__main__':
+    relay_outbox()
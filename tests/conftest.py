@@ -13,9 +13,9 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent / "flask-boilerplate"))
 
 
-from app import create_app, init_mongo_indexes
+from app import create_app, sync_indexes
 from app import mongo_client, mongodb
-from app.models import User
+from app.user_import import import_users
 from flask import g
 
 
@@ -76,7 +76,7 @@ def webhook_test_client(flask_app):
 def init_database():
     # load mongodb test data
     script_dir = os.path.abspath(os.path.dirname(__file__))
-    init_mongo_indexes()
+    sync_indexes()
     load_collections(mongodb, os.path.join(script_dir, 'test_data/mongo_collections'))
     yield
     mongo_client.drop_database('webapp')
@@ -104,15 +104,15 @@ def load_collections(mongo_database: pymongo.mongo_client.database.Database, bac
 
         # filename without extension is the collection name
         coll_name = filename.split('/')[-1].split('.')[0]
-        with open(os.path.join(backup_db_dir, filename)) as file:
-            json_string = file.read()
-            coll_data = loads(json_string)
 
-        # insert users collection through MongoEngine model (this populates all the necessary fields)
+        # users are imported through the MongoEngine model (this populates all the necessary fields)
+        # with the bulk import used for production migrations, without worker processes for such small files
         if coll_name == 'users':
-            for user_data in coll_data:
-                u = User(**user_data)
-                u.save()
+            import_users(os.path.join(backup_db_dir, filename), workers=0)
             continue
 
+        with open(os.path.join(backup_db_dir, filename)) as file:
+            json_string = file.read()
+            coll_data = loads(json_string)
+
         mongo_database[coll_name].insert_many(coll_data)
@@ -1,5 +1,6 @@
 import pytest
 import json
+import threading
 import time
 import redis
 import pika
@@ -7,6 +8,7 @@ from unittest.mock import patch
 from freezegun import freeze_time
 
 from app.models import Report
+from app.outbox import relay_outbox
 from config import Config
 
 
@@ -31,7 +33,23 @@ def logged_test_client(test_client, init_database):
     return test_client
 
 
-def test_report_post_complete_workflow(init_database, logged_test_client, celery_worker):
+@pytest.fixture(scope='module')
+def outbox_relay(flask_app, init_database):
+    """Run the outbox relay in a background thread, delivering the messages written by the requests"""
+    stop = threading.Event()
+
+    def run():
+        with flask_app.app_context():
+            relay_outbox(stop)
+
+    relay = threading.Thread(target=run, daemon=True)
+    relay.start()
+    yield
+    stop.set()
+    relay.join(timeout=5)
+
+
+def test_report_post_complete_workflow(init_database, logged_test_client, celery_worker, outbox_relay):
     """Test complete report generation workflow"""
     test_client = logged_test_client
     
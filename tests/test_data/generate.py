@@ -0,0 +1,259 @@
+"""
+Deterministic generator of a large synthetic dataset (users, reports, another_model) for capacity testing.
+
+The fixtures of mongo_collections are a handful of documents: this dataset reproduces the volumes and the
+distributions of production (user growth over time, statuses, heavy users owning most reports, popular tags...)
+so that the scaling problems of the listings (/admin/users, /reports) can be reproduced locally.
+The same --seed and counts always generate the same documents, whatever the number of workers:
+
+    python3 -m tests.test_data.generate --users 1000000 --reports-per-user 5 --another-model 200000 --drop
+    python3 -m tests.test_data.generate --users 100000 --output /tmp/dataset
+
+Documents are generated by chunks in worker processes and bulk inserted into the database of the environment
+(MONGODB_URI, MONGODB_DB), then the indexes of app/indexes.py are created (building them after the load is faster
+than maintaining them during the load). With --output, the chunks are written to <collection>.bson files instead,
+to be loaded with mongorestore, or with "flask --app webapp users import" for users.
+All the generated users have the password GENERATED_PASSWORD.
+"""
+import argparse
+import calendar
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import bcrypt
+import bson
+
+# add flask-boilerplate to Python path (same as tests/conftest.py)
+sys.path.insert(0, str(Path(__file__).parent.parent.parent / "flask-boilerplate"))
+
+from app import mongodb, sync_indexes
+from app.models.another_model import StatusEnum
+
+
+GENERATED_PASSWORD = 'password'
+# bcrypt with the minimum cost and a fixed salt: hashing is not the point here and the output stays deterministic
+PASSWORD_HASH = bcrypt.hashpw(GENERATED_PASSWORD.encode('utf8'), b'$2b$04$generatedDatasetSalt1u')
+CHUNK_SIZE = 10000
+# end of the generated history, a fixed date keeps the dataset deterministic
+DEFAULT_END_DATE = '2024-06-01'
+
+USER_STATUSES = {'active': 80, 'deactivated': 15, 'pending_verification': 5}
+REPORT_STATUSES = {'completed': 90, 'failed': 4, 'pending': 4, 'running': 2}
+ANOTHER_MODEL_STATUSES = {StatusEnum.ACTIVE.value: 60, StatusEnum.DRAFT.value: 25, StatusEnum.ARCHIVED.value: 15}
+ADMIN_RATIO = 0.001
+FIRST_NAMES = ['James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+               'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Carlos', 'Yuki']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+              'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Tanaka', 'Lee']
+TAGS = [f'tag-{i}' for i in range(100)]
+
+
+class Dataset:
+    """ Parameters of the dataset, every document is a pure function of them and of its index """
+
+    def __init__(self, seed: int, users: int, reports: int, another_model: int, days: int, end_date: datetime):
+        self.seed = seed
+        self.counts = {'users': users, 'reports': reports, 'another_model': another_model}
+        self.end_date = end_date
+        self.start_date = end_date - timedelta(days=days)
+
+    def rng(self, collection: str, chunk: int) -> random.Random:
+        return random.Random(f'{self.seed}:{collection}:{chunk}')
+
+    def signup_date(self, user_index: int) -> datetime:
+        # growing signups: the density of users increases linearly over the period
+        position = ((user_index + 0.5) / self.counts['users']) ** 0.5
+        return self.start_date + (self.end_date - self.start_date) * position
+
+    def user_id(self, user_index: int) -> str:
+        return document_id(self.signup_date(user_index), user_index)
+
+    def random_date(self, rng: random.Random, after: datetime) -> datetime:
+        return after + (self.end_date - after) * rng.random()
+
+    def heavy_user(self, rng: random.Random) -> int:
+        # power law: a few early users own most of the reports and items
+        return min(int(self.counts['users'] * rng.random() ** 3), self.counts['users'] - 1)
+
+
+def document_id(created_at: datetime, index: int) -> str:
+    # ObjectId-like: creation timestamp then index, so that the _id order follows the creation order
+    return f'{calendar.timegm(created_at.utctimetuple()):08x}{index:016x}'
+
+
+def pick(rng: random.Random, weights: Dict[str, int]) -> str:
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def generate_user(dataset: Dataset, rng: random.Random, index: int) -> dict:
+    signup_date = dataset.signup_date(index)
+    status = pick(rng, USER_STATUSES)
+
+    last_login = None
+    if status == 'active':
+        # most active users logged in recently
+        last_login = max(signup_date, dataset.end_date - timedelta(days=rng.expovariate(1 / 15)))
+    elif status == 'deactivated':
+        # deactivated users stopped logging in during the first half of their history
+        last_login = signup_date + (dataset.end_date - signup_date) * rng.random() / 2
+
+    balance = 0 if rng.random() < 0.6 else int(rng.lognormvariate(6, 1.5))
+    first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    has_email = rng.random() < 0.7
+    return {
+        '_id': dataset.user_id(index),
+        'phone_number': f'+1555{index:08d}',
+        'password': PASSWORD_HASH,
+        'access_token': f'{rng.getrandbits(128):032x}',
+        'role': 'admin' if rng.random() < ADMIN_RATIO else 'user',
+        'status': status,
+        'details': {
+            'first_name': first_name,
+            'last_name': last_name,
+            'date_of_birth': datetime(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55)),
+        },
+        'profile_picture': None,
+        'profile_picture_variants': {},
+        'contacts': {
+            'email': {'contact': f'{first_name}.{last_name}.{index}@example.com'.lower()} if has_email else None,
+            'telegram': None,
+        },
+        'signup_date': signup_date,
+        'last_login': last_login,
+        'balance': {
+            'amount': balance,
+            'last_topup': dataset.random_date(rng, signup_date) if balance else None,
+        },
+    }
+
+
+def generate_report(dataset: Dataset, rng: random.Random, index: int) -> dict:
+    user_index = dataset.heavy_user(rng)
+    created_at = dataset.random_date(rng, dataset.signup_date(user_index))
+    status = pick(rng, REPORT_STATUSES)
+
+    report = {
+        '_id': document_id(created_at, index),
+        'user': dataset.user_id(user_index),
+        'task_id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        'status': status,
+        'created_at': created_at,
+        'queued_at': created_at,
+        'result_data': {},
+        'error_message': None,
+    }
+    if status == 'completed':
+        processed_items = rng.randint(1, 1000)
+        report['completed_at'] = created_at + timedelta(seconds=rng.expovariate(1 / 30))
+        report['result_data'] = {
+            'processed_items': processed_items,
+            'success_count': processed_items,
+            'error_count': 0,
+        }
+    elif status == 'failed':
+        report['completed_at'] = created_at + timedelta(seconds=rng.expovariate(1 / 10))
+        report['error_message'] = 'Report processing failed'
+    return report
+
+
+def generate_another_model(dataset: Dataset, rng: random.Random, index: int) -> dict:
+    created_at = dataset.random_date(rng, dataset.start_date)
+    status = pick(rng, ANOTHER_MODEL_STATUSES)
+    return {
+        '_id': document_id(created_at, index),
+        'name': f'Item {index}',
+        'description': None,
+        'status': status,
+        'is_active': rng.random() < 0.9,
+        'priority': rng.randint(1, 10),
+        'price': round(rng.lognormvariate(3, 1), 2),
+        'created_at': created_at,
+        'updated_at': dataset.random_date(rng, created_at),
+        'published_at': created_at if status != StatusEnum.DRAFT.value else None,
+        # popular tags are much more frequent (Zipf-like)
+        'tags': sorted({TAGS[int(len(TAGS) * rng.random() ** 4)] for _ in range(rng.randint(0, 5))}),
+        'metadata': {},
+        'settings': {'notifications_enabled': True, 'theme': rng.choice(['light', 'dark'])},
+        'creator': dataset.user_id(dataset.heavy_user(rng)),
+    }
+
+
+GENERATORS: Dict[str, Callable[[Dataset, random.Random, int], dict]] = {
+    'users': generate_user,
+    'reports': generate_report,
+    'another_model': generate_another_model,
+}
+
+
+def generate_chunk(dataset: Dataset, collection: str, chunk: int) -> List[dict]:
+    rng = dataset.rng(collection, chunk)
+    first = chunk * CHUNK_SIZE
+    last = min(first + CHUNK_SIZE, dataset.counts[collection])
+    return [GENERATORS[collection](dataset, rng, index) for index in range(first, last)]
+
+
+def insert_chunk(task: tuple) -> int:
+    documents = generate_chunk(*task)
+    mongodb[task[1]].insert_many(documents, ordered=False)
+    return len(documents)
+
+
+def encode_chunk(task: tuple) -> bytes:
+    return b''.join(bson.encode(document) for document in generate_chunk(*task))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--reports-per-user', type=float, default=5, help='average number of reports per user')
+    parser.add_argument('--another-model', type=int, default=0, help='number of another_model documents')
+    parser.add_argument('--days', type=int, default=730, help='length of the generated history')
+    parser.add_argument('--end-date', default=DEFAULT_END_DATE, help='end of the generated history (YYYY-MM-DD)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', type=Path, help='write <collection>.bson files to this directory instead')
+    parser.add_argument('--drop', action='store_true', help='drop the collections before loading')
+    args = parser.parse_args()
+
+    dataset = Dataset(
+        seed=args.seed, users=args.users, reports=int(args.users * args.reports_per_user),
+        another_model=args.another_model, days=args.days, end_date=datetime.fromisoformat(args.end_date),
+    )
+    if args.output:
+        args.output.mkdir(parents=True, exist_ok=True)
+
+    with Pool(args.workers) as pool:
+        for collection, count in dataset.counts.items():
+            if not count:
+                continue
+            start = time.perf_counter()
+            chunks = [(dataset, collection, chunk) for chunk in range((count + CHUNK_SIZE - 1) // CHUNK_SIZE)]
+
+            if args.output:
+                # chunks are written in order (and never all held in memory), the files do not depend on the number
+                # of workers either
+                with open(args.output / f'{collection}.bson', 'wb') as file:
+                    for data in pool.imap(encode_chunk, chunks):
+                        file.write(data)
+            else:
+                if args.drop:
+                    mongodb.drop_collection(collection)
+                for _ in pool.imap_unordered(insert_chunk, chunks):
+                    pass
+
+            elapsed = time.perf_counter() - start
+            print(f'{collection}: {count} documents in {elapsed:.1f} s ({count / elapsed:.0f} documents/s)')
+
+    if not args.output:
+        sync_indexes(echo=print)
+
+
+if __name__ == '__main__':
+    main()
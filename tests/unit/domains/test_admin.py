@@ -1,4 +1,7 @@
-from app import USERS_COLL
+import pytest
+
+from app import USERS_COLL, BALANCE_SHARDS_COLL, BALANCE_LEDGER_COLL
+from app.balance import shard_balances
 from config import Config
 
 
@@ -25,3 +28,109 @@ def test_admin_users_get(init_database, test_client):
     assert response.json['total_active_users'] == enabled_users_count
     assert 'users' in response.json
     assert len(response.json['users']) == min(Config.USERS_PAGE_SIZE, enabled_users_count)
+
+
+def test_admin_mongo_pool(init_database, test_client):
+    response = test_client.post('/login', json={'phone_number': '+19870000001', 'password': 'qwerty'})
+    assert response.status_code == 200
+
+    response = test_client.get('admin/mongo/pool')
+    assert response.status_code == 200
+    assert response.json['max_pool_size'] == Config.MONGODB_CLIENT_OPTIONS['maxPoolSize']
+    # MongoEngine (login) and pymongo (fixtures) queries went through the same, single pool
+    assert response.json['servers']
+    for stats in response.json['servers'].values():
+        assert stats['open'] >= 1 and stats['in_use'] >= 0
+
+
+def test_mongoengine_shares_the_mongo_client(init_database):
+    import mongoengine
+    from app.services import services
+
+    assert mongoengine.get_connection() is services.get('mongo_client')
+
+
+def test_admin_users_read_preference(init_database):
+    from app import STALE_READS
+    from app.domains.admin import get_users_page
+
+    # admin listings tolerate stale data and are served by the secondaries
+    assert get_users_page(0)._cursor.collection.read_preference == STALE_READS
+
+
+BULK_USER_IDS = [f'65c00000000000000000000{i}' for i in range(3)]
+
+
+@pytest.fixture(scope='function')
+def bulk_users(init_database):
+    USERS_COLL.insert_many([{
+        '_id': user_id,
+        'phone_number': f'+1987200000{i}',
+        'role': 'user',
+        'status': 'pending_verification',
+        'balance': {'amount': 0, 'last_topup': None},
+    } for i, user_id in enumerate(BULK_USER_IDS)])
+    yield BULK_USER_IDS
+    USERS_COLL.delete_many({'_id': {'$in': BULK_USER_IDS}})
+    BALANCE_SHARDS_COLL.delete_many({'user': {'$in': BULK_USER_IDS}})
+    BALANCE_LEDGER_COLL.delete_many({'user': {'$in': BULK_USER_IDS}})
+
+
+def login_admin(test_client):
+    response = test_client.post('/login', json={'phone_number': '+19870000001', 'password': 'qwerty'})
+    assert response.status_code == 200
+
+
+def test_admin_users_bulk_activate(bulk_users, test_client):
+    login_admin(test_client)
+    USERS_COLL.update_one({'_id': bulk_users[2]}, {'$set': {'status': 'active'}})
+
+    response = test_client.post('admin/users/activate', json={'users': [
+        {'_id': bulk_users[0]},
+        {'phone_number': '+19872000001'},
+        {'_id': bulk_users[2]},
+        {'phone_number': '+19872999999'},
+    ]})
+    assert response.status_code == 200
+    assert [result['result'] for result in response.json['results']] == \
+        ['updated', 'updated', 'unchanged', 'not_found']
+    assert response.json['results'][1]['_id'] == bulk_users[1]
+    assert response.json['summary'] == {'updated': 2, 'unchanged': 1, 'not_found': 1}
+    assert USERS_COLL.count_documents({'_id': {'$in': bulk_users}, 'status': 'active'}) == 3
+
+
+def test_admin_users_bulk_role(bulk_users, test_client):
+    login_admin(test_client)
+
+    response = test_client.post('admin/users/role', json={'users': [
+        {'_id': bulk_users[0], 'role': 'admin'},
+        {'_id': bulk_users[1], 'role': 'user'},
+    ]})
+    assert response.status_code == 200
+    assert [result['result'] for result in response.json['results']] == ['updated', 'unchanged']
+    assert USERS_COLL.find_one({'_id': bulk_users[0]})['role'] == 'admin'
+
+    # the role is required
+    response = test_client.post('admin/users/role', json={'users': [{'_id': bulk_users[0]}]})
+    assert response.status_code == 400
+
+
+def test_admin_users_bulk_balance_credit(bulk_users, test_client):
+    login_admin(test_client)
+
+    response = test_client.post('admin/users/balance-credit', json={'users': [
+        {'_id': user_id, 'amount': 100 * (i + 1)} for i, user_id in enumerate(bulk_users)
+    ]})
+    assert response.status_code == 200
+    assert response.json['summary'] == {'credited': 3}
+    balances = shard_balances(bulk_users)
+    assert [balances[user_id] for user_id in bulk_users] == [100, 200, 300]
+    assert BALANCE_LEDGER_COLL.count_documents({'user': {'$in': bulk_users}, 'kind': 'credit'}) == 3
+
+
+def test_admin_users_bulk_forbidden(bulk_users, test_client):
+    response = test_client.post('/login', json={'phone_number': '+19870000002', 'password': 'qwerty'})
+    assert response.status_code == 200
+
+    response = test_client.post('admin/users/deactivate', json={'users': [{'_id': bulk_users[0]}]})
+    assert response.status_code == 401
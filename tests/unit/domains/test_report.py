@@ -0,0 +1,118 @@
+from unittest.mock import patch
+
+import pytest
+
+from app import OUTBOX_COLL, redis_client
+from app.models import Report
+from app.utils.report_cache import (
+    REPORT_CACHE_KEY, report_fingerprint, claim_report, release_report, cache_completed_report,
+)
+from config import Config
+
+
+@pytest.fixture(scope='function')
+def logged_test_client(init_database, test_client):
+    response = test_client.post('/login', json={'phone_number': '+19870000002', 'password': 'qwerty'})
+    assert response.status_code == 200
+    return test_client
+
+
+def test_report_fingerprint():
+    user_id = '61d2fb409606db54d47d15c3'
+
+    # the fingerprint does not depend on the order of the input fields
+    assert report_fingerprint(user_id, {'a': 1, 'b': {'c': 2, 'd': 3}}) == \
+        report_fingerprint(user_id, {'b': {'d': 3, 'c': 2}, 'a': 1})
+    assert report_fingerprint(user_id, None) == report_fingerprint(user_id, {})
+
+    # different users or different inputs produce different fingerprints
+    assert report_fingerprint(user_id, {'a': 1}) != report_fingerprint('61d2db4ae433c7f4de2383f8', {'a': 1})
+    assert report_fingerprint(user_id, {'a': 1}) != report_fingerprint(user_id, {'a': 2})
+
+
+def test_report_claim_is_only_changed_by_its_report():
+    fingerprint = report_fingerprint('61d2fb409606db54d47d15c3', {'claim-test': 1})
+    key = REPORT_CACHE_KEY.format(fingerprint=fingerprint)
+    assert claim_report(fingerprint, 'report-a') is None
+    assert claim_report(fingerprint, 'report-b') == 'report-a'
+
+    # a report whose claim expired does not touch the claim of another report
+    release_report(fingerprint, 'report-b')
+    cache_completed_report(fingerprint, 'report-b')
+    assert redis_client.get(key) == 'report-a'
+    assert redis_client.ttl(key) > Config.REPORT_CACHE_TTL
+
+    cache_completed_report(fingerprint, 'report-a')
+    assert redis_client.ttl(key) <= Config.REPORT_CACHE_TTL
+    release_report(fingerprint, 'report-a')
+    assert redis_client.get(key) is None
+
+
+def test_report_post_deduplicated(logged_test_client):
+    OUTBOX_COLL.delete_many({})
+
+    response = logged_test_client.post('/report', json={'data': {'dedup-test': 1}})
+    assert response.status_code == 200
+    assert response.json['deduplicated'] is False
+    report_id = response.json['report_id']
+
+    # an identical request attaches to the in-flight report
+    response = logged_test_client.post('/report', json={'data': {'dedup-test': 1}})
+    assert response.status_code == 200
+    assert response.json['deduplicated'] is True
+    assert response.json['report_id'] == report_id
+
+    # a different input is a new report
+    response = logged_test_client.post('/report', json={'data': {'dedup-test': 2}})
+    assert response.status_code == 200
+    assert response.json['deduplicated'] is False
+    assert response.json['report_id'] != report_id
+
+    # the processing tasks are left in the outbox for the relay
+    assert OUTBOX_COLL.count_documents({'destination': 'app.tasks.report.process_report'}) == 2
+    assert Report.objects(fingerprint=Report.objects(_id=report_id).get().fingerprint).count() == 1
+
+
+def test_report_post_outbox_message(logged_test_client):
+    response = logged_test_client.post('/report', json={'data': {'outbox-test': 1}})
+    assert response.status_code == 200
+
+    # the task message is committed with the report, it keeps the task id of the report
+    report = Report.objects(_id=response.json['report_id']).get()
+    assert report.queued_at is not None
+    message = OUTBOX_COLL.find_one({'options.task_id': report.task_id})
+    assert message['transport'] == 'celery'
+    assert message['payload']['args'][0]['report_id'] == report._id
+
+
+def test_report_post_enqueue_failure_releases_claim(logged_test_client):
+    fingerprint = report_fingerprint('61d2fb409606db54d47d15c3', {'enqueue-failure-test': 1})
+    with patch('app.domains.report.add_task', side_effect=ConnectionError('outbox unavailable')):
+        response = logged_test_client.post('/report', json={'data': {'enqueue-failure-test': 1}})
+    assert response.status_code == 500
+
+    # the report is written with its task message or not at all
+    assert Report.objects(fingerprint=fingerprint).count() == 0
+    # the fingerprint is free: an identical request is a new report
+    assert claim_report(fingerprint, 'another-report') is None
+    release_report(fingerprint, 'another-report')
+
+    response = logged_test_client.post('/report', json={'data': {'enqueue-failure-test': 1}})
+    assert response.status_code == 200
+    assert response.json['deduplicated'] is False
+
+
+def test_report_post_claim_of_missing_report(logged_test_client):
+    # a claim left by a request that crashed before its commit
+    fingerprint = report_fingerprint('61d2fb409606db54d47d15c3', {'crash-test': 1})
+    assert claim_report(fingerprint, 'uncommitted-report-id') is None
+
+    response = logged_test_client.post('/report', json={'data': {'crash-test': 1}})
+    assert response.status_code == 200
+    assert response.json['deduplicated'] is False
+    assert OUTBOX_COLL.count_documents({'payload.args.report_id': response.json['report_id']}) == 1
+
+
+def test_report_post_invalid_data(logged_test_client):
+    response = logged_test_client.post('/report', json={'unexpected': 'field'})
+    assert response.status_code == 400
@@ -1,7 +1,11 @@
+import io
+import hashlib
 from datetime import datetime
+from unittest.mock import patch
 import pytest
 
-from app import USERS_COLL
+from app import USERS_COLL, OUTBOX_COLL
+from config import Config
 
 
 @pytest.fixture(scope='function')
@@ -156,3 +160,46 @@ def test_user_contacts_get(init_database, test_client, logged_test_user, reset_u
     r_contacts = r.json['contacts']
     assert r_contacts['email'] == {'contact': 'user@example.com'}
     assert r_contacts['telegram'] is None
+
+
+def read_upload(fileobj, *args, **kwargs):
+    # mocked upload_fileobj consuming the stream like boto3 does
+    while fileobj.read(8 * 1024):
+        pass
+
+
+def test_user_profile_picture_post(init_database, test_client, logged_test_user):
+    content = b'\x89PNG' + b'0' * 1024
+
+    OUTBOX_COLL.delete_many({})
+    with patch('app.domains.user.MEDIA_BUCKET') as mock_bucket:
+        mock_bucket.upload_fileobj.side_effect = read_upload
+        r = test_client.post('/user/profile-picture', data={'file': (io.BytesIO(content), 'picture.png')})
+        assert r.status_code == 200
+        mock_bucket.upload_fileobj.assert_called_once()
+        assert mock_bucket.upload_fileobj.call_args[0][1] == f'profile-pic/{logged_test_user}.png'
+
+    # the picture URL is versioned by the content hash
+    user = USERS_COLL.find_one({'_id': logged_test_user})
+    version = hashlib.md5(content).hexdigest()[:12]
+    assert user['profile_picture'] == f'{Config.MEDIA_BASE_URL}/profile-pic/{logged_test_user}.png?v={version}'
+    assert user['profile_picture_variants'] == {}
+
+    # resized variants are generated in background, the task is committed with the picture
+    message = OUTBOX_COLL.find_one({'destination': 'app.tasks.media.generate_profile_picture_variants'})
+    assert message['payload']['args'] == [logged_test_user, f'profile-pic/{logged_test_user}.png', version]
+    OUTBOX_COLL.delete_many({})
+
+
+def test_user_profile_picture_post_too_large(init_database, test_client, logged_test_user):
+    content = b'0' * (Config.PROFILE_PIC_MAX_SIZE + 1)
+
+    with patch('app.domains.user.MEDIA_BUCKET') as mock_bucket:
+        mock_bucket.upload_fileobj.side_effect = read_upload
+        r = test_client.post('/user/profile-picture', data={'file': (io.BytesIO(content), 'picture.png')})
+        assert r.status_code == 400
+        assert r.json['msg'] == 'file too large'
+
+    r = test_client.post('/user/profile-picture', data={'file': (io.BytesIO(b'0'), 'picture.gif')})
+    assert r.status_code == 400
+    assert r.json['msg'] == 'invalid file type'
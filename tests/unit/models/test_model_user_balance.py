@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from app import USERS_COLL, BALANCE_SHARDS_COLL, BALANCE_LEDGER_COLL
+from app.balance import InsufficientBalanceError, compact_balance
+from app.models import User
+
+
+USER_ID = '61d2fb409606db54d47d15c3'  # compacted balance of 500
+
+
+@pytest.fixture(scope='function')
+def balance_user(init_database):
+    yield User.objects(_id=USER_ID).get()
+    USERS_COLL.update_one({'_id': USER_ID}, {'$set': {'balance.amount': 500}})
+    BALANCE_SHARDS_COLL.delete_many({'user': USER_ID})
+    BALANCE_LEDGER_COLL.delete_many({'user': USER_ID})
+
+
+def test_topup_and_spend(balance_user):
+    balance_user.topup_balance(100)
+    balance_user.spend_balance(30)
+
+    # the user document is not modified until the ledger is compacted
+    assert User.objects(_id=USER_ID).get().balance.amount == 500
+    assert balance_user.current_balance() == 570
+    assert [entry['amount'] for entry in BALANCE_LEDGER_COLL.find({'user': USER_ID}).sort('created_at', 1)] == \
+        [100, -30]
+    # the top-up date is known before the compaction
+    assert balance_user.last_topup() == BALANCE_LEDGER_COLL.find_one({'user': USER_ID, 'kind': 'topup'})['created_at']
+
+
+def test_spend_guard(balance_user):
+    with pytest.raises(InsufficientBalanceError):
+        balance_user.spend_balance(501)
+
+    # a failed spend leaves no trace
+    assert balance_user.current_balance() == 500
+    assert BALANCE_LEDGER_COLL.count_documents({'user': USER_ID}) == 0
+
+
+def test_spend_across_shards(balance_user):
+    # 2 top-ups on 2 different shards, neither covers the spend on its own
+    with patch('app.balance.random.randrange', side_effect=[0, 1, 0]):
+        balance_user.topup_balance(300)
+        balance_user.topup_balance(300)
+        balance_user.spend_balance(1000)
+
+    assert balance_user.current_balance() == 100
+    assert User.objects(_id=USER_ID).get().balance.amount == 100
+
+
+def test_compact_balance(balance_user):
+    balance_user.topup_balance(200)
+    balance_user.spend_balance(50)
+
+    assert compact_balance(USER_ID) >= 1
+    user = User.objects(_id=USER_ID).get()
+    assert user.balance.amount == 650
+    assert user.balance.last_topup is not None
+    assert user.current_balance() == 650
+    assert BALANCE_LEDGER_COLL.count_documents({'user': USER_ID, 'compacted_at': None}) == 0
+    assert compact_balance(USER_ID) == 0
+
+
+def test_concurrent_spends_never_overdraw(balance_user):
+    def spend(_):
+        try:
+            balance_user.spend_balance(30)
+            return True
+        except InsufficientBalanceError:
+            return False
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        spent = sum(executor.map(spend, range(30)))
+
+    assert spent == 500 // 30
+    assert balance_user.current_balance() == 500 - spent * 30
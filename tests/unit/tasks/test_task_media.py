@@ -0,0 +1,21 @@
+import io
+
+from PIL import Image
+
+from app.tasks.media import build_image_variants
+
+
+def test_build_image_variants():
+    """Test resized square variants are produced for each size and format"""
+    original = io.BytesIO()
+    Image.new('RGBA', (400, 300), (255, 0, 0, 128)).save(original, format='PNG')
+
+    variants = list(build_image_variants(original.getvalue(), sizes=[64, 128], formats=['webp', 'jpeg']))
+
+    assert [(size, variant_format) for size, variant_format, _ in variants] == [
+        (64, 'webp'), (64, 'jpeg'), (128, 'webp'), (128, 'jpeg')
+    ]
+    for size, variant_format, data in variants:
+        with Image.open(io.BytesIO(data)) as image:
+            assert image.size == (size, size)
+            assert image.format == variant_format.upper()
@@ -1,7 +1,7 @@
 from unittest.mock import patch
 
 from app.models import Report
-from app.tasks.report import process_report
+from app.tasks.report import process_report, build_report_chunk, split_report_data, merge_report_results
 
 
 def test_process_report_task(init_database):
@@ -38,3 +38,41 @@ def test_process_report_task(init_database):
         assert updated_report.completed_at is not None
         assert updated_report.result_data == {'result': 'success', 'data': 'processed'}
         assert updated_report.error_message is None
+
+        # without input, the report is built from an empty input
+        mock_build.assert_called_once_with({})
+
+
+def test_split_and_merge_report_data():
+    """Test the report input is split into chunks and the partial results merged back"""
+    data = {f'key-{i}': i for i in range(5)}
+
+    chunks = split_report_data(data, chunk_size=2)
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert merge_report_results(chunks) == data
+
+    # empty inputs still produce a single (empty) chunk
+    assert split_report_data({}, chunk_size=2) == [{}]
+
+
+def test_build_report_chunk_checkpoint(init_database):
+    """Test a chunk is checkpointed on the report and restored on retry instead of being built again"""
+    report = Report(user='61d2fb409606db54d47d15c3', task_id='test-task-chunk', status='running')
+    report.save()
+
+    with patch('app.tasks.report.build_report') as mock_build:
+        mock_build.return_value = {'key-0': 'built'}
+
+        assert build_report_chunk(report._id, 0, {'key-0': 0}) == {'key-0': 'built'}
+        # a retried chunk is restored from the checkpoint
+        assert build_report_chunk(report._id, 0, {'key-0': 0}) == {'key-0': 'built'}
+        mock_build.assert_called_once()
+
+    assert Report.objects(_id=report._id).get().checkpoints == {'0': {'key-0': 'built'}}
+
+
+def test_build_report_chunk_deleted_report(init_database):
+    """Test a chunk of a deleted report is dropped instead of being retried"""
+    with patch('app.tasks.report.build_report') as mock_build:
+        assert build_report_chunk('65d000000000000000000000', 0, {'key-0': 0}) is None
+        mock_build.assert_not_called()
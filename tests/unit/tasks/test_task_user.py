@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pytest
+from freezegun import freeze_time
+
+from app import USERS_COLL, TASK_CHECKPOINTS_COLL
+from app.tasks.user import disable_inactive_users
+
+
+INACTIVE_USER_IDS = [f'65b0000000000000000000a{i}' for i in range(5)]
+
+
+@pytest.fixture(scope='function')
+def inactive_users(init_database):
+    USERS_COLL.insert_many([{
+        '_id': user_id,
+        'phone_number': f'+1987100000{i}',
+        'role': 'user',
+        'status': 'active',
+        'last_login': datetime(2020, 1, 1)
+    } for i, user_id in enumerate(INACTIVE_USER_IDS)])
+    yield INACTIVE_USER_IDS
+    USERS_COLL.delete_many({'_id': {'$in': INACTIVE_USER_IDS}})
+    TASK_CHECKPOINTS_COLL.delete_many({})
+
+
+@freeze_time('2024-06-01 00:00:00')
+def test_disable_inactive_users(inactive_users):
+    result = disable_inactive_users(batch_size=2, throttle=0)
+
+    assert result['disabled_users'] == len(inactive_users)
+    assert result['batches'] == 3
+    assert result['inactive_since'] == '2023-06-02'
+    assert USERS_COLL.count_documents({'_id': {'$in': inactive_users}, 'status': 'deactivated'}) == len(inactive_users)
+
+    # recently logged in users are untouched
+    assert USERS_COLL.count_documents({'_id': {'$nin': inactive_users}, 'status': 'deactivated'}) == 0
+
+    # a completed run removes its checkpoint
+    assert TASK_CHECKPOINTS_COLL.count_documents({}) == 0
+
+
+@freeze_time('2024-06-01 00:00:00')
+def test_disable_inactive_users_resume(inactive_users):
+    # simulate a run interrupted after the first two users
+    TASK_CHECKPOINTS_COLL.insert_one({
+        '_id': disable_inactive_users.name,
+        'started_at': datetime(2024, 5, 31),
+        'inactivity_threshold': datetime(2023, 5, 31),
+        'last_login': datetime(2020, 1, 1),
+        'last_id': inactive_users[1],
+        'disabled_count': 2,
+        'batches': 1,
+    })
+
+    result = disable_inactive_users(batch_size=2, throttle=0)
+
+    assert result['disabled_users'] == len(inactive_users)
+    assert result['inactive_since'] == '2023-05-31'
+    # users before the checkpoint are not processed again
+    assert USERS_COLL.count_documents({'_id': {'$in': inactive_users[:2]}, 'status': 'active'}) == 2
+    assert USERS_COLL.count_documents({'_id': {'$in': inactive_users[2:]}, 'status': 'deactivated'}) == 3
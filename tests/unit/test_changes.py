@@ -0,0 +1,79 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.utils.changes import change_event, change_channels
+from app.utils.local_cache import LocalCache, _caches
+
+
+@pytest.fixture(scope='function')
+def local_cache():
+    cache = LocalCache('test_collection')
+    yield cache
+    # not invalidated by the change listener of the process anymore
+    _caches.remove(cache)
+
+
+def test_change_event_report_update():
+    event = change_event({
+        'operationType': 'update',
+        'ns': {'db': 'webapp', 'coll': 'reports'},
+        'documentKey': {'_id': 'report-id'},
+        'updateDescription': {'updatedFields': {'status': 'completed', 'result': {'data': 'secret'}}},
+        'fullDocument': {'_id': 'report-id', 'user': 'user-id'},
+    })
+
+    assert event['type'] == 'document-change'
+    assert event['data'] == {
+        'collection': 'reports', 'operation': 'update', 'document_id': 'report-id',
+        'user_id': 'user-id', 'updated_fields': ['result', 'status'],
+    }
+    assert change_channels(event) == ['changes:reports', 'changes:user:user-id']
+
+
+def test_change_event_deleted_report():
+    event = change_event({
+        'operationType': 'delete',
+        'ns': {'db': 'webapp', 'coll': 'reports'},
+        'documentKey': {'_id': 'report-id'},
+    })
+
+    # the owner of a deleted document is unknown: only published on the collection channel
+    assert event['data']['user_id'] is None
+    assert change_channels(event) == ['changes:reports']
+
+
+def test_local_cache_invalidation(local_cache):
+    listener = MagicMock(is_live=MagicMock(return_value=True))
+    cache = local_cache
+    loader = MagicMock(return_value={'_id': 'id'})
+
+    with patch('app.utils.local_cache.Config.LOCAL_CACHE_ENABLED', True), \
+            patch('app.utils.local_cache.services.get', return_value=listener):
+        assert cache.get('id', loader) == {'_id': 'id'}
+        assert cache.get('id', loader) == {'_id': 'id'}
+        assert loader.call_count == 1
+
+        cache.invalidate('id')
+        cache.get('id', loader)
+        assert loader.call_count == 2
+
+        # caching stops as soon as the invalidations may be missed
+        listener.is_live.return_value = False
+        cache.get('id', loader)
+        assert loader.call_count == 3
+
+
+def test_local_cache_invalidated_while_loading(local_cache):
+    listener = MagicMock(is_live=MagicMock(return_value=True))
+    cache = local_cache
+
+    def loader():
+        # the document changes while it is being loaded
+        cache.invalidate('id')
+        return {'_id': 'id'}
+
+    with patch('app.utils.local_cache.Config.LOCAL_CACHE_ENABLED', True), \
+            patch('app.utils.local_cache.services.get', return_value=listener):
+        cache.get('id', loader)
+        assert cache.get('id', MagicMock(return_value={'_id': 'id', 'v': 2})) == {'_id': 'id', 'v': 2}
@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from app.models import User, Report, AnotherModel
+from tests.test_data.generate import Dataset, generate_chunk
+
+
+def dataset(seed: int = 1) -> Dataset:
+    return Dataset(seed=seed, users=500, reports=2000, another_model=100, days=365, end_date=datetime(2024, 6, 1))
+
+
+def test_generated_dataset_is_deterministic():
+    for collection in ['users', 'reports', 'another_model']:
+        assert generate_chunk(dataset(), collection, 0) == generate_chunk(dataset(), collection, 0)
+    assert generate_chunk(dataset(seed=2), 'users', 0) != generate_chunk(dataset(), 'users', 0)
+
+
+def test_generated_documents_are_valid():
+    users = generate_chunk(dataset(), 'users', 0)
+    reports = generate_chunk(dataset(), 'reports', 0)
+    items = generate_chunk(dataset(), 'another_model', 0)
+
+    assert len(users) == 500 and len(reports) == 2000
+    assert len({user['_id'] for user in users}) == len({user['phone_number'] for user in users}) == 500
+    # reports belong to existing users and were created after their signup
+    signup_dates = {user['_id']: user['signup_date'] for user in users}
+    assert all(report['created_at'] >= signup_dates[report['user']] for report in reports)
+
+    for model, documents in [(User, users), (Report, reports), (AnotherModel, items)]:
+        for document in documents[:50]:
+            model._from_son(document).validate()
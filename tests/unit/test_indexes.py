@@ -0,0 +1,39 @@
+from app import mongodb
+from app.indexes import INDEXES, plan_index_changes, sync_indexes
+
+
+def test_sync_indexes_is_idempotent(init_database):
+    # the indexes are synchronized by the init_database fixture
+    for collection_name, declared in INDEXES.items():
+        plan = plan_index_changes(collection_name, declared)
+        assert plan['create'] == [] and plan['rebuild'] == []
+
+    plans = sync_indexes(dry_run=True)
+    assert all(not plan['create'] and not plan['rebuild'] for plan in plans.values())
+
+
+def test_sync_indexes_drop_obsolete(init_database):
+    mongodb['reports'].create_index('fingerprint', name='obsolete_fingerprint')
+
+    plans = sync_indexes(dry_run=True, obsolete='drop')
+    assert 'obsolete_fingerprint' in plans['reports']['obsolete']
+    assert 'obsolete_fingerprint' in [index['name'] for index in mongodb['reports'].list_indexes()]
+
+    sync_indexes(obsolete='drop')
+    assert 'obsolete_fingerprint' not in [index['name'] for index in mongodb['reports'].list_indexes()]
+
+
+def test_sync_indexes_unique_rebuild_needs_flag(init_database):
+    # a unique index built without its uniqueness
+    mongodb['reports'].drop_index('task_id_1')
+    mongodb['reports'].create_index('task_id', name='task_id_1')
+
+    try:
+        # not dropped: the task ids would not be unique during the rebuild
+        sync_indexes()
+        assert not mongodb['reports'].index_information()['task_id_1'].get('unique')
+
+        sync_indexes(rebuild_unique=True)
+        assert mongodb['reports'].index_information()['task_id_1']['unique']
+    finally:
+        sync_indexes(rebuild_unique=True)
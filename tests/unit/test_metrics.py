@@ -0,0 +1,37 @@
+from prometheus_client.parser import text_string_to_metric_families
+
+from app.metrics import channel_group
+
+
+def scrape(test_client) -> dict:
+    response = test_client.get('/metrics')
+    assert response.status_code == 200
+    return {family.name: family for family in text_string_to_metric_families(response.get_data(as_text=True))}
+
+
+def sample_count(family, **labels) -> float:
+    return sum(
+        sample.value for sample in family.samples
+        if sample.name.endswith('_count') and all(sample.labels.get(key) == value for key, value in labels.items())
+    )
+
+
+def test_metrics(init_database, test_client):
+    before = scrape(test_client)
+    response = test_client.post('/login', json={'phone_number': '+19870000002', 'password': 'qwerty'})
+    assert response.status_code == 200
+    after = scrape(test_client)
+
+    http_requests = 'http_request_duration_seconds'
+    assert sample_count(after[http_requests], endpoint='auth.login', method='POST', status='200') == \
+        sample_count(before[http_requests], endpoint='auth.login', method='POST', status='200') + 1
+
+    # the login queries went through the command monitoring of the MongoDB client
+    mongo_commands = 'mongo_command_duration_seconds'
+    assert sample_count(after[mongo_commands], command='find') > sample_count(before[mongo_commands], command='find')
+
+
+def test_channel_group():
+    assert channel_group('changes:user:61d2fb409606db54d47d15c3') == 'changes:user'
+    assert channel_group('changes:reports') == 'changes:reports'
+    assert channel_group('events:event') == 'events:event'
@@ -0,0 +1,50 @@
+import logging
+import re
+from datetime import datetime
+
+from app import USERS_COLL
+from app.utils.mongo_commands import command_shape, start_scope, end_scope
+from config import Config
+
+
+def test_command_shape():
+    command = {'find': 'users', 'filter': {'status': 'active', 'last_login': {'$lte': datetime(2024, 1, 1)}}}
+    assert command_shape('find', command) == {'status': 'str', 'last_login': {'$lte': 'datetime'}}
+
+    command = {'update': 'users', 'updates': [{'q': {'_id': {'$in': ['a', 'b']}}, 'u': {'$set': {'status': 'x'}}}]}
+    assert command_shape('update', command) == {'_id': {'$in': ['str', '...']}}
+
+    assert command_shape('insert', {'insert': 'users', 'documents': [{'_id': 'a'}]}) is None
+
+
+def test_scope_counts_commands(init_database):
+    token = start_scope('test')
+    USERS_COLL.find_one({'_id': '61d2fb409606db54d47d15c3'})
+    USERS_COLL.count_documents({'status': 'active'})
+    stats = end_scope(token)
+
+    assert stats.count == 2
+    assert stats.duration_ms > 0
+
+
+def test_server_timing_header(init_database, test_client):
+    response = test_client.post('/login', json={'phone_number': '+19870000002', 'password': 'qwerty'})
+    assert response.status_code == 200
+
+    # login: find the user, update its last login
+    server_timing = re.fullmatch(r'mongo;dur=[0-9.]+;desc="(\d+) commands"', response.headers['Server-Timing'])
+    assert server_timing and int(server_timing.group(1)) >= 2
+
+
+def test_commands_warnings(init_database, test_client, monkeypatch, caplog):
+    monkeypatch.setattr(Config, 'MONGODB_SCOPE_COMMANDS_WARNING', 1)
+    monkeypatch.setattr(Config, 'MONGODB_SLOW_COMMAND_MS', 0)
+
+    with caplog.at_level(logging.WARNING, logger='app.utils.mongo_commands'):
+        response = test_client.post('/login', json={'phone_number': '+19870000002', 'password': 'qwerty'})
+    assert response.status_code == 200
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith('auth.login issued') for message in messages)
+    assert any(message.startswith('Slow MongoDB command find on users') and "'phone_number': 'str'" in message
+               for message in messages)
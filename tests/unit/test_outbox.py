@@ -0,0 +1,67 @@
+from unittest.mock import patch
+
+from app import OUTBOX_COLL
+from app.outbox import transaction, add_task, add_message, relay_batch
+
+
+def test_relay_delivers_and_removes_messages(init_database):
+    OUTBOX_COLL.delete_many({})
+    with transaction() as session:
+        add_task('app.tasks.report.process_report', session, args=[{'report_id': 'id'}], task_id='task-id')
+        add_message('redis', 'events:event', {'type': 'a-simple-event'}, session)
+
+    with patch('app.outbox.celery.send_task') as mock_send_task, \
+            patch('app.outbox.redis_client.publish') as mock_publish:
+        assert relay_batch() == 2
+
+    mock_send_task.assert_called_once_with(
+        'app.tasks.report.process_report', args=[{'report_id': 'id'}], kwargs={}, task_id='task-id'
+    )
+    mock_publish.assert_called_once()
+    assert OUTBOX_COLL.count_documents({}) == 0
+
+
+def test_relay_retries_failed_delivery(init_database):
+    OUTBOX_COLL.delete_many({})
+    with transaction() as session:
+        message_id = add_task('app.tasks.report.process_report', session, task_id='task-id')
+
+    with patch('app.outbox.celery.send_task', side_effect=ConnectionError('broker down')):
+        assert relay_batch() == 1
+
+    # the message is kept and postponed
+    message = OUTBOX_COLL.find_one({'_id': message_id})
+    assert message['attempts'] == 1
+    assert message['last_error'] == 'broker down'
+    assert message['available_at'] > message['created_at']
+    with patch('app.outbox.celery.send_task') as mock_send_task:
+        assert relay_batch() == 0
+    mock_send_task.assert_not_called()
+
+
+def test_aborted_transaction_leaves_no_message(init_database):
+    OUTBOX_COLL.delete_many({})
+    try:
+        with transaction() as session:
+            add_task('app.tasks.report.process_report', session, task_id='task-id')
+            raise RuntimeError('domain write failed')
+    except RuntimeError:
+        pass
+
+    assert OUTBOX_COLL.count_documents({}) == 0
+
+
+def test_batch_is_leased_to_a_single_relay(init_database):
+    OUTBOX_COLL.delete_many({})
+    with transaction() as session:
+        add_message('redis', 'events:event', {'type': 'a-simple-event'}, session)
+
+    # a second relay polling while the first one delivers does not get the leased message
+    def concurrent_relay(*args):
+        assert relay_batch() == 0
+
+    with patch('app.outbox.redis_client.publish', side_effect=concurrent_relay) as mock_publish:
+        assert relay_batch() == 1
+
+    mock_publish.assert_called_once()
+    assert OUTBOX_COLL.count_documents({}) == 0
@@ -0,0 +1,75 @@
+import os
+import pstats
+
+import pytest
+
+from app.profiler import PROFILE_HEADER
+from config import Config
+
+
+@pytest.fixture(scope='function')
+def profiler_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'PROFILER_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_profile_with_token(init_database, test_client, profiler_dir):
+    response = test_client.post('/login', json={'phone_number': '+19870000001', 'password': 'qwerty'})
+    assert response.status_code == 200
+
+    response = test_client.post('/admin/profiler/token')
+    assert response.status_code == 200
+    assert response.json['header'] == PROFILE_HEADER
+    token = response.json['token']
+
+    response = test_client.get('/user', headers={PROFILE_HEADER: token})
+    assert response.status_code == 200
+
+    # the profile is named after the request id
+    profile_file = response.headers[PROFILE_HEADER]
+    assert response.headers['Application-Request-Id'] in profile_file
+    assert os.listdir(profiler_dir) == [profile_file]
+    assert pstats.Stats(str(profiler_dir / profile_file)).total_calls > 0
+
+
+def test_profile_invalid_token(init_database, test_client, profiler_dir):
+    response = test_client.post('/login', json={'phone_number': '+19870000002', 'password': 'qwerty'})
+    assert response.status_code == 200
+
+    response = test_client.get('/user', headers={PROFILE_HEADER: 'forged.token'})
+    assert response.status_code == 200
+    assert PROFILE_HEADER not in response.headers
+    assert os.listdir(profiler_dir) == []
+
+    # only admins get profiling tokens
+    response = test_client.post('/admin/profiler/token')
+    assert response.status_code == 401
+
+
+def test_profile_sampled_endpoint(init_database, test_client, profiler_dir, monkeypatch):
+    response = test_client.post('/login', json={'phone_number': '+19870000002', 'password': 'qwerty'})
+    assert response.status_code == 200
+
+    monkeypatch.setattr(Config, 'PROFILER_SAMPLE_RATES', {'user.get_user': 1.0})
+    response = test_client.get('/user')
+    assert PROFILE_HEADER in response.headers
+
+    response = test_client.get('/reports')
+    assert PROFILE_HEADER not in response.headers
+    assert len(os.listdir(profiler_dir)) == 1
+
+
+def test_profile_file_name_and_retention(init_database, test_client, profiler_dir, monkeypatch):
+    response = test_client.post('/login', json={'phone_number': '+19870000002', 'password': 'qwerty'})
+    assert response.status_code == 200
+    monkeypatch.setattr(Config, 'PROFILER_SAMPLE_RATES', {'user.get_user': 1.0})
+    monkeypatch.setattr(Config, 'PROFILER_MAX_FILES', 2)
+
+    # a request id sent by the client does not escape the profiles directory
+    response = test_client.get('/user', headers={'X-Request-ID': '../../etc/passwd'})
+    assert '/' not in response.headers[PROFILE_HEADER]
+    assert os.listdir(profiler_dir) == [response.headers[PROFILE_HEADER]]
+
+    for _ in range(3):
+        test_client.get('/user')
+    assert len(os.listdir(profiler_dir)) == 2
@@ -0,0 +1,33 @@
+from unittest.mock import patch, MagicMock
+
+from app.factory import setup_rabbitmq, rabbitmq_topology_fingerprint, RABBITMQ_TOPOLOGY_KEY
+from config import EVENT_TYPES
+
+
+def test_setup_rabbitmq_declares_once(flask_app):
+    mock_channel = MagicMock()
+    stored = {}
+
+    with patch('app.factory.pika_client') as mock_pika, patch('app.factory.redis_client') as mock_redis:
+        mock_pika.channel.return_value = mock_channel
+        mock_redis.get.side_effect = stored.get
+        mock_redis.set.side_effect = stored.__setitem__
+
+        # first declaration stores the topology fingerprint
+        assert setup_rabbitmq(flask_app) is True
+        assert stored[RABBITMQ_TOPOLOGY_KEY] == rabbitmq_topology_fingerprint()
+        mock_channel.exchange_declare.assert_called_once()
+        assert mock_channel.queue_declare.call_count == len(EVENT_TYPES)
+        mock_pika.return_channel.assert_called_once_with(mock_channel)
+
+        # unchanged topology: no broker round-trips
+        assert setup_rabbitmq(flask_app) is False
+        mock_pika.channel.assert_called_once()
+
+        # forced declaration
+        assert setup_rabbitmq(flask_app, force=True) is True
+        assert mock_pika.channel.call_count == 2
+
+    # the fingerprint changes with the event types
+    with patch('app.factory.EVENT_TYPES', EVENT_TYPES + ['a-new-event']):
+        assert rabbitmq_topology_fingerprint() != stored[RABBITMQ_TOPOLOGY_KEY]
@@ -0,0 +1,81 @@
+import os
+from unittest.mock import MagicMock, patch
+
+from app.models import User
+from app.services import ServiceRegistry, services
+
+
+def test_service_created_on_first_use():
+    registry = ServiceRegistry()
+    factory = MagicMock(return_value={'key': 'value'})
+    registry.register('client', factory)
+    client = registry.proxy('client')
+
+    # registering the service and creating its proxy does not create the client
+    factory.assert_not_called()
+    assert not registry.is_initialized('client')
+
+    assert client['key'] == 'value'
+    assert client.get('key') == 'value'
+    factory.assert_called_once()
+
+
+def test_service_recreated_after_fork():
+    registry = ServiceRegistry()
+    registry.register('client', lambda: object())
+    registry.register('spec', lambda: object(), per_process=False)
+    client, spec = registry.get('client'), registry.get('spec')
+
+    assert registry.get('client') is client
+
+    # simulate running in a forked child process
+    with patch('app.services.os.getpid', return_value=os.getpid() + 1):
+        assert registry.get('client') is not client
+        assert registry.get('spec') is spec
+
+
+def test_after_fork_hook():
+    registry = ServiceRegistry()
+    factory = MagicMock(side_effect=lambda: object())
+    after_fork, unused_after_fork = MagicMock(), MagicMock()
+    registry.register('client', factory, after_fork=after_fork)
+    registry.register('unused', MagicMock(), after_fork=unused_after_fork)
+    registry.get('client')
+
+    registry.reset()
+
+    # the hook of the used client drops the references to it, the client is only created again on next use
+    after_fork.assert_called_once()
+    unused_after_fork.assert_not_called()
+    assert factory.call_count == 1
+    assert not registry.is_initialized('client')
+    registry.get('client')
+    assert factory.call_count == 2
+
+
+def test_mongo_client_after_fork(init_database):
+    parent_client = services.get('mongo_client')
+    assert User._get_collection().database.client is parent_client
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # child: the models and the raw collections share a new client, the one of the parent is left open
+        try:
+            child_client = services.get('mongo_client')
+            ok = child_client is not parent_client \
+                and User._get_collection().database.client is child_client \
+                and User.objects(_id='61d2fb409606db54d47d15c3').count() == 1
+        except Exception:
+            ok = False
+        os.write(write_fd, b'ok' if ok else b'ko')
+        os._exit(0)
+
+    os.close(write_fd)
+    assert os.read(read_fd, 2) == b'ok'
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    # the parent keeps using its client
+    assert services.get('mongo_client') is parent_client
+    assert User.objects(_id='61d2fb409606db54d47d15c3').count() == 1
@@ -0,0 +1,84 @@
+import logging
+from types import SimpleNamespace
+
+from app import USERS_COLL, TASK_USAGE_COLL
+from app.utils.mongo_commands import start_task_scope, end_task_scope
+from app.utils.task_usage import start_task_usage, end_task_usage, revoke_task_usage, task_usage_summary
+from config import Config
+
+
+def run_task(task_id: str, work) -> SimpleNamespace:
+    """ Run work between the task signal handlers, in their connection order """
+    task = SimpleNamespace(name='tests.usage_task', request=SimpleNamespace(id=task_id, request_id='request-id'))
+    start_task_scope(task=task)
+    start_task_usage(task=task)
+    work()
+    end_task_scope(task=task)
+    end_task_usage(task=task, task_id=task_id, state='SUCCESS')
+    return task
+
+
+def test_task_usage_is_stored(init_database, monkeypatch):
+    monkeypatch.setattr(Config, 'TASK_MONGO_BYTES_ACCOUNTING', True)
+    TASK_USAGE_COLL.delete_many({})
+    run_task('usage-task-id', lambda: [
+        USERS_COLL.find_one({'_id': '61d2fb409606db54d47d15c3'}),
+        sum(range(100000)),
+    ])
+
+    usage = TASK_USAGE_COLL.find_one({'_id': 'usage-task-id'})
+    assert usage['task'] == 'tests.usage_task'
+    assert usage['state'] == 'SUCCESS'
+    assert usage['request_id'] == 'request-id'
+    assert usage['wall_seconds'] >= usage['cpu_seconds'] > 0
+    assert usage['peak_rss_growth_bytes'] >= 0
+    # the storage of the usage is not accounted to the task
+    assert usage['mongo_commands'] == 1
+    assert usage['mongo_bytes_sent'] > 0 and usage['mongo_bytes_received'] > 0
+
+    summary = {task['_id']: task for task in task_usage_summary(days=1)}
+    assert summary['tests.usage_task']['runs'] == 1
+    assert summary['tests.usage_task']['unfinished'] == 0
+    assert summary['tests.usage_task']['avg_mongo_commands'] == 1
+    TASK_USAGE_COLL.delete_many({})
+
+
+def test_mongo_bytes_not_measured_by_default(init_database):
+    TASK_USAGE_COLL.delete_many({})
+    run_task('unmeasured-task-id', lambda: USERS_COLL.find_one({'_id': '61d2fb409606db54d47d15c3'}))
+
+    usage = TASK_USAGE_COLL.find_one({'_id': 'unmeasured-task-id'})
+    assert usage['mongo_commands'] == 1
+    assert usage['mongo_bytes_sent'] is None and usage['mongo_bytes_received'] is None
+    TASK_USAGE_COLL.delete_many({})
+
+
+def test_killed_task_is_unfinished(init_database):
+    TASK_USAGE_COLL.delete_many({})
+    # killed before the end of the task: task_postrun is never sent
+    task = SimpleNamespace(name='tests.usage_task', request=SimpleNamespace(id='killed-task-id', request_id=None))
+    start_task_usage(task=task)
+    start_task_usage(task=SimpleNamespace(name='tests.usage_task',
+                                          request=SimpleNamespace(id='revoked-task-id', request_id=None)))
+    revoke_task_usage(request=SimpleNamespace(id='revoked-task-id'), terminated=True)
+
+    assert TASK_USAGE_COLL.find_one({'_id': 'killed-task-id'})['state'] == 'STARTED'
+    assert TASK_USAGE_COLL.find_one({'_id': 'revoked-task-id'})['state'] == 'REVOKED'
+    summary = {task['_id']: task for task in task_usage_summary(days=1)}
+    assert summary['tests.usage_task']['runs'] == 2
+    assert summary['tests.usage_task']['unfinished'] == 1
+    TASK_USAGE_COLL.delete_many({})
+
+
+def test_memory_growth_warning(init_database, monkeypatch, caplog):
+    monkeypatch.setattr(Config, 'TASK_RSS_GROWTH_WARNING_MB', 1)
+    monkeypatch.setattr(Config, 'TASK_USAGE_RETENTION_DAYS', 0)
+    retained = []
+
+    with caplog.at_level(logging.WARNING, logger='app.utils.task_usage'):
+        run_task('leaky-task-id', lambda: retained.append(b'x' * (8 * 2 ** 20)))
+
+    assert any(record.getMessage().startswith('Task tests.usage_task[leaky-task-id] grew the worker RSS')
+               for record in caplog.records)
+    # not stored without retention
+    assert TASK_USAGE_COLL.find_one({'_id': 'leaky-task-id'}) is None
@@ -0,0 +1,49 @@
+import bcrypt
+import pytest
+from bson.json_util import dumps
+
+from app import USERS_COLL
+from app.models import User
+from app.user_import import import_users
+
+
+IMPORT_USER_IDS = [f'65d00000000000000000000{i}' for i in range(4)]
+
+
+@pytest.fixture(scope='function')
+def users_file(init_database, tmp_path):
+    users = [{
+        '_id': user_id,
+        'phone_number': f'+1987300000{i}',
+        'password': f'password-{i}',
+        'role': 'user',
+        'status': 'active',
+        'details': {'first_name': 'Imported', 'last_name': f'User {i}'},
+    } for i, user_id in enumerate(IMPORT_USER_IDS)]
+    # an existing user and an invalid user
+    users.append({'_id': '61d2fb409606db54d47d15c3', 'phone_number': '+19870000002', 'password': 'x',
+                  'role': 'user', 'status': 'active', 'details': {'first_name': 'A', 'last_name': 'B'}})
+    users.append({'_id': '65d0000000000000000000ff', 'phone_number': '+19873000099', 'password': 'x',
+                  'role': 'superuser', 'status': 'active', 'details': {'first_name': 'A', 'last_name': 'B'}})
+
+    path = tmp_path / 'users.jsonl'
+    path.write_text('\n'.join(dumps(user) for user in users))
+    yield str(path)
+    USERS_COLL.delete_many({'_id': {'$in': IMPORT_USER_IDS}})
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_import_users(users_file, workers):
+    stats = import_users(users_file, batch_size=2, workers=workers, echo=lambda message: None)
+
+    assert stats['read'] == 6
+    assert stats['inserted'] == 4
+    assert stats['duplicates'] == 1
+    assert stats['invalid'] == 1
+    assert stats['failed'] == 0
+
+    # the users are saved as by User.save(): hashed password and model defaults
+    user = User.objects(_id=IMPORT_USER_IDS[0]).get()
+    assert bcrypt.checkpw(b'password-0', user.password)
+    assert user.balance.amount == 0
+    assert user.access_token